@@ -48,6 +48,7 @@ from Foundation import NSData
 from Foundation import NSPropertyListSerialization
 from Foundation import NSPropertyListMutableContainers
 from Foundation import NSPropertyListXMLFormat_v1_0
+from Foundation import NSPropertyListBinaryFormat_v1_0
 # pylint: enable=E0611
 
 # Disable PyLint complaining about 'invalid' camelCase names
@@ -107,14 +108,20 @@ def readPlistFromString(data):
         return dataObject
 
 
-def writePlist(dataObject, filepath):
+def writePlist(dataObject, filepath, binary=False):
     '''
     Write 'rootObject' as a plist to filepath.
+    If binary is True, writes a binary plist, which is much faster
+    to read back in.
     '''
+    if binary:
+        plistFormat = NSPropertyListBinaryFormat_v1_0
+    else:
+        plistFormat = NSPropertyListXMLFormat_v1_0
     plistData, error = (
         NSPropertyListSerialization.
         dataFromPropertyList_format_errorDescription_(
-            dataObject, NSPropertyListXMLFormat_v1_0, None))
+            dataObject, plistFormat, None))
     if plistData is None:
         if error:
             error = error.encode('ascii', 'ignore')
@@ -34,6 +34,7 @@ from .. import munkirepo
 from .. import osinstaller
 from .. import osutils
 from .. import pkgutils
+from .. import utils
 from .. import FoundationPlist
 from ..cliutils import pref
 
@@ -262,7 +263,7 @@ def find_matching_pkginfo(repo, pkginfo):
             possiblematches = catdb['receipts'].get(pkgids[0])
             if possiblematches:
                 versionlist = list(possiblematches.keys())
-                versionlist.sort(key=pkgutils.MunkiLooseVersion, reverse=True)
+                versionlist.sort(key=utils.version_key, reverse=True)
                 # go through possible matches, newest version first
                 for versionkey in versionlist:
                     testpkgindexes = possiblematches[versionkey]
@@ -283,7 +284,7 @@ def find_matching_pkginfo(repo, pkginfo):
             possiblematches = catdb['applications'].get(app)
             if possiblematches:
                 versionlist = list(possiblematches.keys())
-                versionlist.sort(key=pkgutils.MunkiLooseVersion, reverse=True)
+                versionlist.sort(key=utils.version_key, reverse=True)
                 indexes = catdb['applications'][app][versionlist[0]]
                 return catdb['items'][indexes[0]]
 
@@ -292,7 +293,7 @@ def find_matching_pkginfo(repo, pkginfo):
         possiblematches = catdb['profiles'].get(identifier)
         if possiblematches:
             versionlist = list(possiblematches.keys())
-            versionlist.sort(key=pkgutils.MunkiLooseVersion, reverse=True)
+            versionlist.sort(key=utils.version_key, reverse=True)
             indexes = catdb['profiles'][identifier][versionlist[0]]
             return catdb['items'][indexes[0]]
 
@@ -303,7 +304,7 @@ def find_matching_pkginfo(repo, pkginfo):
     possiblematches = catdb['installer_items'].get(installer_item_name)
     if possiblematches:
         versionlist = list(possiblematches.keys())
-        versionlist.sort(key=pkgutils.MunkiLooseVersion, reverse=True)
+        versionlist.sort(key=utils.version_key, reverse=True)
         indexes = catdb['installer_items'][installer_item_name][versionlist[0]]
         return catdb['items'][indexes[0]]
 
@@ -23,9 +23,7 @@ AppleUpdates object defined here
 from __future__ import absolute_import, print_function
 
 import glob
-import hashlib
 import os
-import subprocess
 
 try:
     # Python 2
@@ -54,8 +52,10 @@ from .. import munkistatus
 from .. import munkihash
 from .. import munkilog
 from .. import osutils
+from .. import pkgutils
 from .. import prefs
 from .. import processes
+from .. import receipts
 from .. import reports
 from .. import updatecheck
 from .. import FoundationPlist
@@ -226,20 +226,14 @@ class AppleUpdates(object):
 
     def installed_apple_pkgs_changed(self):
         """Generates a SHA-256 checksum of the info for all packages in the
-        receipts database whose id matches com.apple.* and compares it to a
-        stored version of this checksum.
+        receipts database whose id starts with com.apple and compares it to
+        a stored version of this checksum.
 
         Returns:
           Boolean. False if the checksums match, True if they differ."""
         # pylint: disable=no-self-use
-        cmd = ['/usr/sbin/pkgutil', '--regexp', '--pkg-info-plist',
-               r'com\.apple\.*']
-        proc = subprocess.Popen(cmd, shell=False, bufsize=1,
-                                stdin=subprocess.PIPE,
-                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        output = proc.communicate()[0] # don't decode because we need the bytes
-
-        current_apple_packages_checksum = hashlib.sha256(output).hexdigest()
+        current_apple_packages_checksum = receipts.packages_checksum(
+            pkgutils.installed_package_snapshot(), prefix='com.apple')
         old_apple_packages_checksum = prefs.pref(
             'InstalledApplePackagesChecksum')
 
@@ -472,6 +466,14 @@ class AppleUpdates(object):
                             display.display_debug1(
                                 'Processing metadata for %s, %s...',
                                 item['productKey'], item['display_name'])
+                            try:
+                                metadata_item = catalogs.full_pkginfo(
+                                    metadata_item)
+                            except catalogs.CatalogItemDetailsError as err:
+                                display.display_warning(
+                                    'Skipping metadata for %s: %s',
+                                    item['productKey'], err)
+                                continue
                             self.copy_update_metadata(item, metadata_item)
             plist = {'AppleUpdates': apple_updates}
             FoundationPlist.writePlist(plist, self.apple_updates_plist)
@@ -0,0 +1,224 @@
+# encoding: utf-8
+#
+# Copyright 2009-2020 Greg Neagle.
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+checksumcache
+
+A persistent cache of the MD5 checksums of files, so we don't re-read large
+files on every run just to find they haven't changed.
+
+A cached checksum is used only while the file's inode, size, modification
+time and change time all match what they were when it was computed.
+"""
+from __future__ import absolute_import, print_function
+
+# standard Python libs
+import os
+import sqlite3
+import threading
+import time
+
+# our libs
+from . import display
+from . import munkihash
+from . import prefs
+from . import reports
+
+
+CHECKSUM_CACHE_TABLE_CREATE = (
+    'CREATE TABLE IF NOT EXISTS md5_checksums ('
+    'path TEXT PRIMARY KEY,'
+    'inode INTEGER,'
+    'size INTEGER,'
+    'mtime INTEGER,'
+    'ctime INTEGER,'
+    'md5 TEXT'
+    ')')
+
+CHECKSUM_CACHE_TABLE_SELECT = (
+    'SELECT inode, size, mtime, ctime, md5 FROM md5_checksums WHERE path=?')
+
+CHECKSUM_CACHE_TABLE_REPLACE = (
+    'INSERT OR REPLACE INTO md5_checksums VALUES ('
+    '?, '  # path
+    '?, '  # inode
+    '?, '  # size
+    '?, '  # mtime
+    '?, '  # ctime
+    '? '   # md5
+    ')')
+
+# files modified less than this many seconds before we hash them might be
+# modified again without changing their mtime, so we don't cache those
+RECENTLY_MODIFIED_SECONDS = 2
+
+
+def cache_path():
+    '''Returns the path to our checksum cache database'''
+    return os.path.join(
+        prefs.pref('ManagedInstallDir'), 'checksum_cache.sqlite')
+
+
+def _signature(attrs):
+    '''Returns a tuple of (inode, size, mtime, ctime) from os.stat results.
+    Times are in nanoseconds where we can get them.'''
+    return (attrs.st_ino, attrs.st_size,
+            getattr(attrs, 'st_mtime_ns', attrs.st_mtime),
+            getattr(attrs, 'st_ctime_ns', attrs.st_ctime))
+
+
+def _connection():
+    '''Returns our connection to the checksum cache, opening it (and
+    creating the database if needed) the first time we're called in a run.
+    A database that isn't one is replaced. Raises sqlite3.Error if that
+    fails. Callers must hold _LOCK.'''
+    # pylint: disable=global-statement
+    global _CONNECTION
+    path = cache_path()
+    if _CONNECTION is not None and _CONNECTION[0] == path:
+        return _CONNECTION[1]
+    close_cache()
+    try:
+        conn = _open(path)
+    except sqlite3.OperationalError:
+        raise
+    except sqlite3.DatabaseError as err:
+        display.display_debug1(
+            'Replacing damaged checksum cache %s: %s', path, err)
+        _remove(path)
+        conn = _open(path)
+    _CONNECTION = (path, conn)
+    return conn
+
+
+def _open(path):
+    '''Opens the database at path, making sure it has our table'''
+    # worker threads share the connection; _LOCK serializes its use
+    conn = sqlite3.connect(path, check_same_thread=False)
+    try:
+        conn.execute(CHECKSUM_CACHE_TABLE_CREATE)
+    except sqlite3.Error:
+        conn.close()
+        raise
+    return conn
+
+
+def _remove(path):
+    '''Removes the database at path'''
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+def _damaged(err):
+    '''Called when a query finds the database damaged; removes it so the
+    next query starts a new one'''
+    display.display_debug1('Replacing damaged checksum cache: %s', err)
+    path = _CONNECTION[0] if _CONNECTION else cache_path()
+    close_cache()
+    _remove(path)
+
+
+def close_cache():
+    '''Closes our connection to the checksum cache, if it's open. Called at
+    the start of each update check session.'''
+    # pylint: disable=global-statement
+    global _CONNECTION
+    with _LOCK:
+        if _CONNECTION is not None:
+            try:
+                _CONNECTION[1].close()
+            except sqlite3.Error:
+                pass
+            _CONNECTION = None
+
+
+def cached_md5(path, signature):
+    '''Returns the cached MD5 checksum of path if it was computed when the
+    file had signature, None otherwise'''
+    with _LOCK:
+        try:
+            row = _connection().execute(
+                CHECKSUM_CACHE_TABLE_SELECT, (path,)).fetchone()
+        except sqlite3.OperationalError as err:
+            display.display_debug1('Could not read checksum cache: %s', err)
+            return None
+        except sqlite3.DatabaseError as err:
+            _damaged(err)
+            return None
+    if row and tuple(row[:4]) == signature:
+        return row[4]
+    return None
+
+
+def cache_md5(path, signature, md5):
+    '''Records the MD5 checksum of path, computed when the file had
+    signature'''
+    with _LOCK:
+        try:
+            conn = _connection()
+            with conn:
+                conn.execute(
+                    CHECKSUM_CACHE_TABLE_REPLACE, (path,) + signature + (md5,))
+        except sqlite3.OperationalError as err:
+            display.display_debug1('Could not update checksum cache: %s', err)
+        except sqlite3.DatabaseError as err:
+            _damaged(err)
+
+
+def getmd5hash(path):
+    '''Returns the MD5 checksum of the file at path, like
+    munkihash.getmd5hash, using the cached checksum if the file hasn't
+    changed since it was computed. If the ForceChecksumVerification
+    preference is set, the file is always read.'''
+    try:
+        signature = _signature(os.stat(path))
+    except OSError:
+        signature = None
+    if signature is None or not os.path.isfile(path):
+        return munkihash.getmd5hash(path)
+
+    if not prefs.pref('ForceChecksumVerification'):
+        md5 = cached_md5(path, signature)
+        if md5:
+            reports.increment_counter('ChecksumCacheHits')
+            return md5
+
+    reports.increment_counter('ChecksumCacheMisses')
+    md5 = munkihash.getmd5hash(path)
+    if md5 in ('NOT A FILE', 'HASH_ERROR'):
+        return md5
+    # don't cache a checksum for a file that changed while we read it, or
+    # that could change again without its mtime changing
+    try:
+        attrs = os.stat(path)
+    except OSError:
+        return md5
+    if (_signature(attrs) == signature and
+            time.time() - attrs.st_mtime >= RECENTLY_MODIFIED_SECONDS):
+        cache_md5(path, signature, md5)
+    return md5
+
+
+# module globals
+# (path, connection) of the open checksum cache, and the lock that guards
+# it; RLock because _damaged calls close_cache while holding it
+_CONNECTION = None
+_LOCK = threading.RLock()
+
+
+if __name__ == '__main__':
+    print('This is a library of support tools for the Munki Suite.')
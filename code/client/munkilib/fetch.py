@@ -59,6 +59,7 @@ from . import munkihash
 from . import munkilog
 from . import osutils
 from . import prefs
+from . import reports
 
 
 from .gurl import Gurl
@@ -196,6 +197,7 @@ def header_dict_from_list(array):
     return header_dict
 
 
+@reports.Timer('Downloads')
 def get_url(url, destinationpath,
             custom_headers=None, message=None, onlyifnewer=False,
             resume=False, follow_redirects=False, pkginfo=None):
@@ -287,6 +289,9 @@ def get_url(url, destinationpath,
         # Re-raise the error as a GurlError
         raise GurlError(-1, str(err))
 
+    reports.increment_counter('Downloads')
+    reports.increment_counter('BytesDownloaded', connection.bytesReceived)
+
     if connection.error is not None:
         # gurl returned an error
         display.display_detail(
@@ -324,6 +329,7 @@ def get_url(url, destinationpath,
     elif connection.status == 304:
         # unchanged on server
         display.display_debug1('Item is unchanged on the server.')
+        reports.increment_counter('DownloadsUnchanged')
         return connection.headers
     else:
         # there was an HTTP error of some sort; remove our temp download.
@@ -46,6 +46,7 @@ from . import display
 from . import munkilog
 from . import osutils
 from . import pkgutils
+from . import predicates
 from . import prefs
 from . import reports
 from . import utils
@@ -493,11 +494,13 @@ def app_data():
         plistpath = os.path.join(pathname, 'Contents', 'Info.plist')
         if os.path.exists(plistpath):
             try:
-                plist = FoundationPlist.readPlist(plistpath)
+                plist = pkgutils.read_cached_plist(plistpath)
                 iteminfo['bundleid'] = plist.get('CFBundleIdentifier', '')
                 if 'CFBundleName' in plist:
                     iteminfo['name'] = plist['CFBundleName']
-                iteminfo['version'] = pkgutils.getBundleVersion(pathname)
+                iteminfo['version'] = (
+                    pkgutils.getVersionString(plist) or
+                    pkgutils.getBundleVersion(pathname))
                 application_data.append(iteminfo)
             except BaseException:
                 pass
@@ -524,6 +527,55 @@ def filtered_app_data():
                     not item['path'].startswith('/Users/Shared/'))]
 
 
+class AppIndex(object):
+    """Installed applications from app_data(), indexed by bundleid and by
+    name. Each list of apps is sorted highest version first."""
+
+    def __init__(self, appdata):
+        self.by_bundleid = {}
+        self.by_name = {}
+        apps = sorted([item for item in appdata if item.get('path')],
+                      key=_app_version_key, reverse=True)
+        for item in apps:
+            if item.get('bundleid'):
+                self.by_bundleid.setdefault(item['bundleid'], []).append(item)
+            if item.get('name'):
+                self.by_name.setdefault(item['name'], []).append(item)
+
+    def find(self, bundleid='', name=''):
+        '''Returns a list of the apps matching bundleid or name, highest
+        version first'''
+        matches = []
+        if bundleid:
+            matches.extend(self.by_bundleid.get(bundleid, []))
+        if name:
+            if bundleid:
+                # don't list apps matching both twice
+                matches.extend(item for item in self.by_name.get(name, [])
+                               if item.get('bundleid') != bundleid)
+                matches.sort(key=_app_version_key, reverse=True)
+            else:
+                matches.extend(self.by_name.get(name, []))
+        return matches
+
+
+def _app_version_key(item):
+    '''Returns a sort key for the version of an app_data() item'''
+    return utils.version_key(item.get('version'))
+
+
+@utils.Memoize
+def app_index():
+    '''Returns an AppIndex of app_data()'''
+    return AppIndex(app_data())
+
+
+@utils.Memoize
+def filtered_app_index():
+    '''Returns an AppIndex of filtered_app_data()'''
+    return AppIndex(filtered_app_data())
+
+
 @utils.Memoize
 def get_version():
     """Returns version of munkitools, reading version.plist"""
@@ -683,6 +735,7 @@ def valid_plist(path):
 
 
 @utils.Memoize
+@reports.Timer('ConditionScripts')
 def get_conditions():
     """Fetches key/value pairs from condition scripts
     which can be placed into /usr/local/munki/conditions"""
@@ -827,23 +880,44 @@ def predicate_info_object():
     return info_object
 
 
+def ns_predicate(predicate_string):
+    '''Returns a (cached) NSPredicate for predicate_string. Raises an
+    exception if the predicate can't be parsed.'''
+    if predicate_string not in _NSPREDICATES:
+        _NSPREDICATES[predicate_string] = NSPredicate.predicateWithFormat_(
+            predicate_string)
+    return _NSPREDICATES[predicate_string]
+
+
+@reports.Timer('Predicates')
 def predicate_evaluates_as_true(predicate_string, additional_info=None):
     '''Evaluates predicate against our info object'''
+    reports.increment_counter('PredicatesEvaluated')
     display.display_debug1('Evaluating predicate: %s', predicate_string)
     info_object = predicate_info_object()
     if isinstance(additional_info, dict):
         info_object.update(additional_info)
     try:
-        predicate = NSPredicate.predicateWithFormat_(predicate_string)
-    except BaseException as err:
-        display.display_warning('%s', err)
-        # can't parse predicate, so return False
-        return False
-
-    result = predicate.evaluateWithObject_(info_object)
+        result = predicates.evaluate_predicate(predicate_string, info_object)
+    except predicates.PredicateError as err:
+        # use NSPredicate for anything our own evaluator doesn't handle
+        display.display_debug2(
+            'Evaluating predicate with NSPredicate: %s', err)
+        try:
+            predicate = ns_predicate(predicate_string)
+        except BaseException as err:
+            display.display_warning('%s', err)
+            # can't parse predicate, so return False
+            return False
+        result = predicate.evaluateWithObject_(info_object)
     display.display_debug1('Predicate %s is %s', predicate_string, result)
     return result
 
 
+# module globals
+# parsed NSPredicates, keyed by predicate string
+_NSPREDICATES = {}
+
+
 if __name__ == '__main__':
     print('This is a library of support tools for the Munki Suite.')
@@ -51,6 +51,7 @@ from .. import scriptutils
 from .. import FoundationPlist
 
 from ..updatecheck import catalogs
+from ..updatecheck import depgraph
 from ..updatecheck import manifestutils
 
 # initialize our report fields
@@ -112,8 +113,7 @@ def item_prereqs_in_skipped_items(item, skipped_items):
         % (item['name'], item.get('version_to_install')))
 
     # get list of prerequisites for this item
-    prerequisites = item.get('requires', [])
-    prerequisites.extend(item.get('update_for', []))
+    prerequisites = depgraph.prerequisites(item)
     if not prerequisites:
         display.display_debug1(
             '%s-%s has no prerequisites.'
@@ -121,32 +121,9 @@ def item_prereqs_in_skipped_items(item, skipped_items):
         return []
     display.display_debug1('Prerequisites: %s' % ", ".join(prerequisites))
 
-    # build a dictionary of names and versions of skipped items
-    skipped_item_dict = {}
-    for skipped_item in skipped_items:
-        if skipped_item['name'] not in skipped_item_dict:
-            skipped_item_dict[skipped_item['name']] = []
-        normalized_version = pkgutils.trim_version_string(
-            skipped_item.get('version_to_install', '0.0'))
-        display.display_debug1(
-            'Adding skipped item: %s-%s',
-            skipped_item['name'], normalized_version)
-        skipped_item_dict[skipped_item['name']].append(normalized_version)
-
-    # now check prereqs against the skipped items
-    matched_prereqs = []
-    for prereq in prerequisites:
-        (name, version) = catalogs.split_name_and_version(prereq)
-        display.display_debug1(
-            'Comparing %s-%s against skipped items', name, version)
-        if name in skipped_item_dict:
-            if version:
-                version = pkgutils.trim_version_string(version)
-                if version in skipped_item_dict[name]:
-                    matched_prereqs.append(prereq)
-            else:
-                matched_prereqs.append(prereq)
-    return matched_prereqs
+    if not isinstance(skipped_items, depgraph.SkippedItems):
+        skipped_items = depgraph.SkippedItems(skipped_items)
+    return skipped_items.skipped_prerequisites(item)
 
 
 def requires_restart(item):
@@ -213,7 +190,8 @@ def install_with_info(
     """
     restartflag = False
     itemindex = 0
-    skipped_installs = []
+    # indexed so we can check prerequisites against it as we go
+    skipped_installs = depgraph.SkippedItems()
     for item in installlist:
         # Keep track of when this particular install started.
         utc_now = datetime.datetime.utcnow()
@@ -627,6 +605,7 @@ def process_removals(removallist, only_unattended=False):
     return (restart_flag, skipped_removals)
 
 
+@reports.Timer('InstallerRun')
 def run(only_unattended=False):
     """Runs the install/removal session.
 
@@ -676,9 +655,10 @@ def run(only_unattended=False):
                 # set indeterminate progress bar
                 munkistatus.percent(-1)
                 munkilog.log("Processing removals")
-                (removals_need_restart,
-                 skipped_removals) = process_removals(
-                     removallist, only_unattended=only_unattended)
+                with reports.Timer('Removals'):
+                    (removals_need_restart,
+                     skipped_removals) = process_removals(
+                         removallist, only_unattended=only_unattended)
                 # if any removals were skipped, record them for later
                 installinfo['removals'] = skipped_removals
 
@@ -699,9 +679,11 @@ def run(only_unattended=False):
                     # set indeterminate progress bar
                     munkistatus.percent(-1)
                     munkilog.log("Processing installs")
-                    (installs_need_restart, skipped_installs) = (
-                        install_with_info(installdir, installlist,
-                                          only_unattended=only_unattended))
+                    with reports.Timer('Installs'):
+                        (installs_need_restart, skipped_installs) = (
+                            install_with_info(
+                                installdir, installlist,
+                                only_unattended=only_unattended))
                     # if any installs were skipped record them for later
                     installinfo['managed_installs'] = skipped_installs
 
@@ -27,6 +27,7 @@ import re
 import shutil
 import subprocess
 import tempfile
+import threading
 
 try:
     # Python 2
@@ -36,11 +37,14 @@ except ImportError:
     from urllib.parse import unquote
 
 
-from distutils import version
 from xml.dom import minidom
 
 from . import display
 from . import osutils
+from . import plistreader
+from . import prefs
+from . import receipts
+from . import reports
 from . import utils
 from . import FoundationPlist
 
@@ -78,97 +82,61 @@ def getPkgRestartInfo(filename):
     return installerinfo
 
 
-def _cmp(x, y):
-    """
-    Replacement for built-in function cmp that was removed in Python 3
+class MunkiLooseVersion(object):
+    '''Class to compare version strings like "10.6" and "10.6.0" as equal.
+    Parses versions like distutils' LooseVersion; comparisons use the
+    (cached) keys from utils.version_key'''
 
-    Compare the two objects x and y and return an integer according to
-    the outcome. The return value is negative if x < y, zero if x == y
-    and strictly positive if x > y.
-    """
-    return (x > y) - (x < y)
+    def __init__(self, vstring=None):
+        """init method"""
+        self.parse(vstring)
 
+    def parse(self, vstring):
+        """Parses a version string"""
+        self.vstring = utils.version_string(vstring)
+        self.version = utils.version_components(self.vstring)
+        self.key = utils.version_key(self.vstring)
 
-class MunkiLooseVersion(version.LooseVersion):
-    '''Subclass version.LooseVersion to compare things like
-    "10.6" and "10.6.0" as equal'''
+    def __str__(self):
+        return self.vstring
 
-    def __init__(self, vstring=None):
-        """init method"""
-        # pylint: disable=unicode-builtin
-        if vstring is None:
-            # treat None like an empty string
-            self.parse('')
-        if vstring is not None:
-            try:
-                if isinstance(vstring, unicode):
-                    # unicode string! Why? Oh well...
-                    # convert to string so version.LooseVersion doesn't choke
-                    vstring = vstring.encode('UTF-8')
-            except NameError:
-                # python 3
-                pass
-            self.parse(str(vstring))
-
-    def _pad(self, version_list, max_length):
-        """Pad a version list by adding extra 0
-        components to the end if needed"""
-        # copy the version_list so we don't modify it
-        cmp_list = list(version_list)
-        while len(cmp_list) < max_length:
-            cmp_list.append(0)
-        return cmp_list
-
-    def _compare(self, other):
-        """Complete comparison mechanism since LooseVersion's is broken
-        in Python 3"""
-        if not isinstance(other, version.LooseVersion):
-            other = MunkiLooseVersion(other)
-
-        max_length = max(len(self.version), len(other.version))
-        self_cmp_version = self._pad(self.version, max_length)
-        other_cmp_version = self._pad(other.version, max_length)
-        cmp_result = 0
-        for index, value in enumerate(self_cmp_version):
-            try:
-                cmp_result = _cmp(value, other_cmp_version[index])
-            except TypeError:
-                # integer is less than character/string
-                if isinstance(value, int):
-                    return -1
-                return 1
-            else:
-                if cmp_result:
-                    return cmp_result
-        return cmp_result
+    def __repr__(self):
+        return "MunkiLooseVersion ('%s')" % str(self)
+
+    @staticmethod
+    def _key(other):
+        """Returns the version key to compare another version to"""
+        if isinstance(other, MunkiLooseVersion):
+            return other.key
+        return utils.version_key(other)
 
     def __hash__(self):
         """Hash method"""
-        return hash(self.version)
+        return hash(self.key)
 
     def __eq__(self, other):
         """Equals comparison"""
-        return self._compare(other) == 0
+        return self.key == self._key(other)
 
     def __ne__(self, other):
         """Not-equals comparison"""
-        return self._compare(other) != 0
+        return self.key != self._key(other)
 
     def __lt__(self, other):
         """Less than comparison"""
-        return self._compare(other) < 0
+        return self.key < self._key(other)
 
     def __le__(self, other):
         """Less than or equals comparison"""
-        return self._compare(other) <= 0
+        return self.key <= self._key(other)
 
     def __gt__(self, other):
         """Greater than comparison"""
-        return self._compare(other) > 0
+        return self.key > self._key(other)
 
     def __ge__(self, other):
         """Greater than or equals comparison"""
-        return self._compare(other) >= 0
+        return self.key >= self._key(other)
 
 
 def padVersionString(versString, tupleCount):
@@ -261,6 +229,36 @@ def getBundleInfo(path):
     return None
 
 
+def read_cached_plist(path):
+    """Returns the contents of the plist at path like
+    FoundationPlist.readPlist, but reads each plist only once per run
+    unless it changes. The returned object is shared with other callers,
+    so don't modify it."""
+    try:
+        attrs = os.stat(path)
+    except OSError:
+        # let readPlist raise the error
+        return FoundationPlist.readPlist(path)
+    signature = (getattr(attrs, 'st_mtime_ns', attrs.st_mtime),
+                 attrs.st_size, attrs.st_ino)
+    with _PLIST_CACHE_LOCK:
+        cached = _PLIST_CACHE.get(path)
+    if cached and cached[0] == signature:
+        reports.increment_counter('PlistCacheHits')
+        return cached[1]
+    reports.increment_counter('PlistCacheMisses')
+    plist = FoundationPlist.readPlist(path)
+    with _PLIST_CACHE_LOCK:
+        _PLIST_CACHE[path] = (signature, plist)
+    return plist
+
+
+def clear_plist_cache():
+    """Forgets the plists read by read_cached_plist"""
+    with _PLIST_CACHE_LOCK:
+        _PLIST_CACHE.clear()
+
+
 def getAppBundleExecutable(bundlepath):
     """Returns path to the actual executable in an app bundle or None"""
     plist = getBundleInfo(bundlepath)
@@ -632,50 +630,11 @@ def getInstalledPackageVersion(pkgid):
     if it exists, or an empty string if it does not
     """
 
-    # First check (Leopard and later) package database
-    proc = subprocess.Popen(['/usr/sbin/pkgutil',
-                             '--pkg-info-plist', pkgid],
-                            bufsize=1,
-                            stdout=subprocess.PIPE,
-                            stderr=subprocess.PIPE)
-    out = proc.communicate()[0]
-
-    if out:
-        try:
-            plist = FoundationPlist.readPlistFromString(out)
-        except FoundationPlist.NSPropertyListSerializationException:
-            pass
-        else:
-            foundbundleid = plist.get('pkgid')
-            foundvers = plist.get('pkg-version', '0.0.0.0.0')
-            if pkgid == foundbundleid:
-                display.display_debug2('\tThis machine has %s, version %s',
-                                       pkgid, foundvers)
-                return foundvers
-
-    # If we got to this point, we haven't found the pkgid yet.
-    # Check /Library/Receipts
-    receiptsdir = '/Library/Receipts'
-    if os.path.exists(receiptsdir):
-        installitems = osutils.listdir(receiptsdir)
-        highestversion = '0'
-        for item in installitems:
-            if item.endswith('.pkg'):
-                info = getBundlePackageInfo(os.path.join(receiptsdir, item))
-                if info:
-                    infoitem = info[0]
-                    foundbundleid = infoitem['packageid']
-                    foundvers = infoitem['version']
-                    if pkgid == foundbundleid:
-                        if (MunkiLooseVersion(foundvers) >
-                                MunkiLooseVersion(highestversion)):
-                            highestversion = foundvers
-
-        if highestversion != '0':
-            display.display_debug2('\tThis machine has %s, version %s',
-                                   pkgid, highestversion)
-            return highestversion
-
+    foundvers = getInstalledPackages().get(pkgid)
+    if foundvers:
+        display.display_debug2('\tThis machine has %s, version %s',
+                               pkgid, foundvers)
+        return foundvers
 
     # This package does not appear to be currently installed
     display.display_debug2('\tThis machine does not have %s' % pkgid)
@@ -866,9 +825,10 @@ def getPackageMetaData(pkgitem):
     return cataloginfo
 
 
-@utils.Memoize
-def getInstalledPackages():
-    """Builds a dictionary of installed receipts and their version number"""
+def read_installed_packages():
+    """Asks pkgutil for info on all installed packages, and checks
+    /Library/Receipts. Returns a dictionary of pkgids and dicts with their
+    'version' and (for pkgutil receipts) 'install_time'."""
     installedpkgs = {}
 
     # we use the --regexp option to pkgutil to get it to return receipt
@@ -877,15 +837,17 @@ def getInstalledPackages():
                              '--pkg-info-plist', '.*'], bufsize=8192,
                             stdout=subprocess.PIPE, stderr=subprocess.PIPE)
     out = proc.communicate()[0]
-    while out:
-        (pliststr, out) = utils.getFirstPlist(out)
-        if pliststr:
-            plist = FoundationPlist.readPlistFromString(pliststr)
+    try:
+        for plist in plistreader.iter_plists_from_string(out):
             if 'pkg-version' in plist and 'pkgid' in plist:
-                installedpkgs[plist['pkgid']] = (
-                    plist['pkg-version'] or '0.0.0.0.0')
-        else:
-            break
+                installedpkgs[plist['pkgid']] = {
+                    'version': plist['pkg-version'] or '0.0.0.0.0'}
+                if 'install-time' in plist:
+                    installedpkgs[plist['pkgid']]['install_time'] = (
+                        plist['install-time'])
+    except plistreader.PlistReadError as err:
+        display.display_error(
+            'Could not parse installed package info: %s', err)
 
     # Now check /Library/Receipts
     receiptsdir = '/Library/Receipts'
@@ -896,10 +858,10 @@ def getInstalledPackages():
                 pkginfo = getOnePackageInfo(
                     os.path.join(receiptsdir, item))
                 pkgid = pkginfo.get('packageid')
-                thisversion = pkginfo.get('version')
+                thisversion = pkginfo.get('version') or '0.0.0.0.0'
                 if pkgid:
                     if not pkgid in installedpkgs:
-                        installedpkgs[pkgid] = thisversion
+                        installedpkgs[pkgid] = {'version': thisversion}
                     else:
                         # pkgid is already in our list. There must be
                         # multiple receipts with the same pkgid.
@@ -907,13 +869,29 @@ def getInstalledPackages():
                         # number, since that's the one that's
                         # installed, since presumably
                         # the newer package replaced the older one
-                        storedversion = installedpkgs[pkgid]
+                        storedversion = installedpkgs[pkgid]['version']
                         if (MunkiLooseVersion(thisversion) >
                                 MunkiLooseVersion(storedversion)):
-                            installedpkgs[pkgid] = thisversion
+                            installedpkgs[pkgid] = {'version': thisversion}
     return installedpkgs
 
 
+def installed_package_snapshot():
+    """Returns a dictionary of pkgids and dicts with their 'version' and
+    'install_time', from our saved snapshot of the receipts if they haven't
+    changed since it was saved."""
+    snapshot_path = os.path.join(
+        prefs.pref('ManagedInstallDir'), 'InstalledPackages.plist')
+    return receipts.installed_packages(
+        snapshot_path, read_installed_packages)
+
+
+@utils.Memoize
+def getInstalledPackages():
+    """Builds a dictionary of installed receipts and their version number"""
+    return dict((pkgid, info['version'])
+                for (pkgid, info) in installed_package_snapshot().items())
+
 
 # This function doesn't really have anything to do with packages or receipts
 # but is used by makepkginfo, munkiimport, and installer.py, so it might as
@@ -944,5 +922,11 @@ def isApplication(pathname):
     return False
 
 
+# module globals
+# plists read by read_cached_plist, keyed by path
+_PLIST_CACHE = {}
+_PLIST_CACHE_LOCK = threading.Lock()
+
+
 if __name__ == '__main__':
     print('This is a library of support tools for the Munki Suite.')
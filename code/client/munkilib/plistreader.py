@@ -0,0 +1,294 @@
+# encoding: utf-8
+#
+# Copyright 2020 Greg Neagle.
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+plistreader.py
+
+Streaming reader for XML property lists.
+
+FoundationPlist has to build the entire object graph of a plist before we
+can look at any of it. For very large plists that are a top-level array
+(like catalogs) this module can instead hand back one array element at a
+time as it is parsed, optionally skipping the values of some dictionary
+keys entirely, so callers never need the whole plist in memory at once.
+
+Only XML plists are supported.
+"""
+from __future__ import absolute_import, print_function
+
+import base64
+import datetime
+from xml.parsers import expat
+
+
+# size of the chunks we feed to the parser
+CHUNK_SIZE = 64 * 1024
+
+# the start and end of each plist in a series of plists
+PLIST_HEADER = b'<?xml version'
+PLIST_FOOTER = b'</plist>'
+
+
+class PlistReadError(Exception):
+    """Raised when a plist can't be read or parsed"""
+    pass
+
+
+class _PlistHandler(object):
+    """expat handlers that build plist objects. Completed elements of a
+    top-level array are moved to self.elements as soon as they are
+    finished, instead of being added to the array."""
+    # pylint: disable=too-many-instance-attributes
+
+    def __init__(self, parser, stream=False, skip_keys=None):
+        self.parser = parser
+        self.stream = stream
+        self.skip_keys = skip_keys or ()
+        # containers we are in the middle of building
+        self.stack = []
+        # the dictionary key we are waiting for a value for, per container
+        self.pending_keys = []
+        self.data = []
+        self.root = None
+        self.have_root = False
+        # info on the top-level array element being built
+        self.element_start = 0
+        self.skipped_keys = []
+        # nesting depth of a value we are skipping
+        self.skip_depth = 0
+        # completed top-level array elements:
+        # tuples of (value, byte offset, byte length, skipped keys)
+        self.elements = []
+
+        parser.StartElementHandler = self.start_element
+        parser.EndElementHandler = self.end_element
+        parser.CharacterDataHandler = self.character_data
+
+    def _at_element_level(self):
+        '''Returns True if we are directly inside a top-level array
+        element'''
+        return self.stream and len(self.stack) == 2
+
+    def start_element(self, tag, dummy_attrs):
+        '''Handles the start of an element'''
+        if self.skip_depth:
+            self.skip_depth += 1
+            return
+        if (self._at_element_level() and self.pending_keys[-1] is not None
+                and self.pending_keys[-1] in self.skip_keys):
+            # don't build the value for this key
+            self.skipped_keys.append(self.pending_keys[-1])
+            self.pending_keys[-1] = None
+            self.skip_depth = 1
+            return
+        if self.stream and not self.stack and tag != 'plist':
+            if tag != 'array':
+                raise PlistReadError('Root object is not an array')
+        elif self.stream and len(self.stack) == 1:
+            # starting an element of the top-level array
+            self.element_start = self.parser.CurrentByteIndex
+            self.skipped_keys = []
+        if tag == 'dict':
+            self.stack.append({})
+            self.pending_keys.append(None)
+        elif tag == 'array':
+            self.stack.append([])
+            self.pending_keys.append(None)
+        self.data = []
+
+    def end_element(self, tag):
+        '''Handles the end of an element'''
+        if self.skip_depth:
+            self.skip_depth -= 1
+            return
+        if tag == 'plist':
+            return
+        if tag == 'key':
+            if not self.stack or not isinstance(self.stack[-1], dict):
+                raise PlistReadError('<key> outside of a <dict>')
+            self.pending_keys[-1] = ''.join(self.data)
+            return
+        if tag in ('dict', 'array'):
+            self.pending_keys.pop()
+            value = self.stack.pop()
+        else:
+            value = self._leaf_value(tag, ''.join(self.data))
+        self._add_value(tag, value)
+
+    def character_data(self, data):
+        '''Collects character data for the current element'''
+        if not self.skip_depth:
+            self.data.append(data)
+
+    def _leaf_value(self, tag, text):
+        '''Converts the text of a simple element to a Python value'''
+        # pylint: disable=no-self-use
+        try:
+            if tag == 'string':
+                return text
+            if tag == 'integer':
+                return int(text)
+            if tag == 'real':
+                return float(text)
+            if tag == 'true':
+                return True
+            if tag == 'false':
+                return False
+            if tag == 'date':
+                return datetime.datetime.strptime(
+                    text.strip(), '%Y-%m-%dT%H:%M:%SZ')
+            if tag == 'data':
+                return base64.b64decode(''.join(text.split()))
+        except (ValueError, TypeError) as err:
+            raise PlistReadError(
+                'Invalid value for <%s>: %s' % (tag, err))
+        raise PlistReadError('Unexpected element <%s>' % tag)
+
+    def _add_value(self, tag, value):
+        '''Adds a completed value to its container'''
+        if not self.stack:
+            self.root = value
+            self.have_root = True
+            return
+        if self.stream and len(self.stack) == 1:
+            # a completed element of the top-level array
+            end = self.parser.CurrentByteIndex
+            if end == self.element_start:
+                # an empty element like <dict/>
+                end += len('<%s/>' % tag)
+            else:
+                end += len('</%s>' % tag)
+            self.elements.append(
+                (value, self.element_start, end - self.element_start,
+                 self.skipped_keys))
+            return
+        container = self.stack[-1]
+        if isinstance(container, dict):
+            key = self.pending_keys[-1]
+            if key is None:
+                raise PlistReadError('<dict> value without a <key>')
+            container[key] = value
+            self.pending_keys[-1] = None
+        else:
+            container.append(value)
+
+
+def _new_parser():
+    '''Returns a new expat parser'''
+    parser = expat.ParserCreate()
+    parser.buffer_text = True
+    return parser
+
+
+def iter_array(filepath, skip_keys=None):
+    """Parses the XML plist at filepath, which must have an array as its
+    root object, and yields its elements one at a time as they are parsed.
+
+    If skip_keys is given, values for those keys are not built for
+    dictionaries that are elements of the array.
+
+    Yields tuples of (element, offset, length, skipped_keys), where offset
+    and length describe the bytes of the element in the file (so it can be
+    re-read later with read_plist_range) and skipped_keys is a list of the
+    keys that were skipped for this element.
+
+    Raises PlistReadError if the file can't be read or parsed.
+    """
+    parser = _new_parser()
+    handler = _PlistHandler(parser, stream=True, skip_keys=skip_keys)
+    try:
+        fileobj = open(filepath, 'rb')
+    except (OSError, IOError) as err:
+        raise PlistReadError(err)
+    try:
+        while True:
+            try:
+                chunk = fileobj.read(CHUNK_SIZE)
+                parser.Parse(chunk, not chunk)
+            except (OSError, IOError, expat.ExpatError) as err:
+                raise PlistReadError(err)
+            for element in handler.elements:
+                yield element
+            del handler.elements[:]
+            if not chunk:
+                break
+    finally:
+        fileobj.close()
+    if not handler.have_root:
+        raise PlistReadError('No plist object found in %s' % filepath)
+
+
+def read_plist_from_string(data):
+    """Parses XML plist data and returns the root object. data may also be
+    a single bare plist element, like '<dict>...</dict>'.
+
+    Raises PlistReadError if the data can't be parsed."""
+    parser = _new_parser()
+    handler = _PlistHandler(parser)
+    try:
+        parser.Parse(data, True)
+    except expat.ExpatError as err:
+        raise PlistReadError(err)
+    if not handler.have_root:
+        raise PlistReadError('No plist object found')
+    return handler.root
+
+
+def read_plist(filepath):
+    """Reads the XML plist at filepath and returns the root object.
+
+    Raises PlistReadError if the file can't be read or parsed."""
+    try:
+        with open(filepath, 'rb') as fileobj:
+            data = fileobj.read()
+    except (OSError, IOError) as err:
+        raise PlistReadError(err)
+    return read_plist_from_string(data)
+
+
+def read_plist_range(filepath, offset, length):
+    """Reads and parses a single plist element from filepath, given its
+    byte offset and length as returned by iter_array.
+
+    Raises PlistReadError if the element can't be read or parsed."""
+    try:
+        with open(filepath, 'rb') as fileobj:
+            fileobj.seek(offset)
+            data = fileobj.read(length)
+    except (OSError, IOError) as err:
+        raise PlistReadError(err)
+    return read_plist_from_string(data)
+
+
+def iter_plists_from_string(data):
+    """Parses a byte string holding a series of XML plists, like the output
+    of `pkgutil --pkg-info-plist` for many packages, and yields the root
+    object of each in turn. As with utils.getFirstPlist, anything outside
+    the plists is ignored, but the plists are found by their offsets
+    instead of by copying the rest of the string after each one.
+
+    Raises PlistReadError if one of the plists can't be parsed."""
+    start = data.find(PLIST_HEADER)
+    while start != -1:
+        end = data.find(PLIST_FOOTER, start + len(PLIST_HEADER))
+        if end == -1:
+            return
+        end += len(PLIST_FOOTER)
+        yield read_plist_from_string(data[start:end])
+        start = data.find(PLIST_HEADER, end)
+
+
+if __name__ == '__main__':
+    print('This is a library of support tools for the Munki Suite.')
@@ -0,0 +1,628 @@
+# encoding: utf-8
+#
+# Copyright 2020 Greg Neagle.
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+predicates.py
+
+Pure-Python evaluation of NSPredicate-style conditions.
+
+conditional_items conditions and installable_condition strings are
+NSPredicate format strings. This module parses the subset of that syntax
+Munki admins actually use and compiles each predicate string once into a
+function that can be evaluated against our info object:
+
+  - comparisons: ==, =, !=, <>, <, <=, =<, >, >=, =>, BETWEEN
+  - string and collection operators: IN, CONTAINS, BEGINSWITH, ENDSWITH,
+    LIKE, MATCHES, with [c] and [d] options
+  - ANY, SOME, ALL and NONE aggregate modifiers
+  - AND, OR, NOT (and &&, ||, !), parentheses, TRUEPREDICATE and
+    FALSEPREDICATE
+  - string, number, boolean and NULL literals, {aggregate} literals, key
+    paths, SELF, and CAST(value, "NSDate")
+
+Anything outside this subset, or values that can't be compared the way
+NSPredicate would compare them, raise PredicateError so the caller can
+fall back to NSPredicate.
+"""
+from __future__ import absolute_import, print_function
+
+import calendar
+import datetime
+import re
+import unicodedata
+
+try:
+    # Python 2
+    STRING_TYPES = (str, unicode)
+    NUMBER_TYPES = (int, long, float)
+except NameError:
+    # Python 3
+    STRING_TYPES = (str,)
+    NUMBER_TYPES = (int, float)
+
+# seconds between the Unix epoch and NSDate's reference date (2001-01-01)
+NSDATE_REFERENCE_OFFSET = 978307200
+
+
+class PredicateError(Exception):
+    """Raised when a predicate can't be compiled or evaluated"""
+    pass
+
+
+class _Date(object):
+    """A point in time, as seconds since the Unix epoch"""
+    # pylint: disable=too-few-public-methods
+    __slots__ = ('seconds',)
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+    def __repr__(self):
+        return '_Date(%r)' % self.seconds
+
+
+# tokenizing
+
+_TOKEN_RE = re.compile(r'''
+    (?P<space>\s+)
+  | (?P<number>-?(?:\d+\.\d*|\.\d+|\d+)(?:[eE][-+]?\d+)?)
+  | (?P<string>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')
+  | (?P<op>==|=<|=>|<=|>=|!=|<>|&&|\|\||[=<>!])
+  | (?P<punct>[(){},\[\]])
+  | (?P<word>[A-Za-z_][A-Za-z0-9_]*(?:\.[A-Za-z_][A-Za-z0-9_]*)*)
+''', re.VERBOSE | re.DOTALL)
+
+_ESCAPE_RE = re.compile(r'\\(.)', re.DOTALL)
+_ESCAPES = {'n': '\n', 'r': '\r', 't': '\t', '0': '\0'}
+
+KEYWORDS = set([
+    'AND', 'OR', 'NOT', 'IN', 'CONTAINS', 'BEGINSWITH', 'ENDSWITH', 'LIKE',
+    'MATCHES', 'BETWEEN', 'ANY', 'SOME', 'ALL', 'NONE', 'TRUE', 'YES',
+    'FALSE', 'NO', 'NULL', 'NIL', 'SELF', 'CAST', 'TRUEPREDICATE',
+    'FALSEPREDICATE'])
+
+# reserved words for NSPredicate features we don't support
+UNSUPPORTED_WORDS = set([
+    'FIRST', 'LAST', 'SIZE', 'ANYKEY', 'SUBQUERY', 'FETCH', 'FUNCTION',
+    'CASEINSENSITIVE', 'CI'])
+
+
+def _unescape(match):
+    '''Replacement function for backslash escapes in string literals'''
+    char = match.group(1)
+    return _ESCAPES.get(char, char)
+
+
+def tokenize(predicate_string):
+    '''Splits a predicate string into a list of (kind, value) tuples,
+    ending with ('END', None)'''
+    tokens = []
+    position = 0
+    while position < len(predicate_string):
+        match = _TOKEN_RE.match(predicate_string, position)
+        if not match:
+            raise PredicateError(
+                'Unsupported syntax at "%s"' % predicate_string[position:])
+        position = match.end()
+        kind = match.lastgroup
+        text = match.group(kind)
+        if kind == 'space':
+            continue
+        if kind == 'number':
+            if re.match(r'^-?\d+$', text):
+                tokens.append(('NUMBER', int(text)))
+            else:
+                tokens.append(('NUMBER', float(text)))
+        elif kind == 'string':
+            tokens.append(('STRING', _ESCAPE_RE.sub(_unescape, text[1:-1])))
+        elif kind in ('op', 'punct'):
+            tokens.append(('OP', text))
+        elif '.' in text:
+            keypath = text.split('.')
+            if keypath[0].upper() == 'SELF':
+                keypath = keypath[1:]
+            for component in keypath:
+                if component.upper() in KEYWORDS | UNSUPPORTED_WORDS:
+                    raise PredicateError(
+                        'Unsupported key path "%s"' % text)
+            tokens.append(('KEYPATH', keypath))
+        elif text.upper() in KEYWORDS:
+            tokens.append(('KEYWORD', text.upper()))
+        elif text.upper() in UNSUPPORTED_WORDS:
+            raise PredicateError('Unsupported keyword "%s"' % text)
+        else:
+            tokens.append(('KEYPATH', [text]))
+    tokens.append(('END', None))
+    return tokens
+
+
+# values
+
+def _text(value):
+    '''Returns value as a unicode string'''
+    if isinstance(value, bytes) and not isinstance(value, type(u'')):
+        return value.decode('UTF-8', 'replace')
+    return value
+
+
+def _normalize(value):
+    '''Converts a value from the info object (or a literal) to the types
+    we compare: None, bools and numbers, unicode strings, _Dates, lists
+    and dictionaries'''
+    if value is None or isinstance(value, NUMBER_TYPES + (_Date, dict)):
+        return value
+    if isinstance(value, STRING_TYPES):
+        return _text(value)
+    if isinstance(value, datetime.datetime):
+        # plist dates are naive datetimes in UTC
+        return _Date(calendar.timegm(value.utctimetuple()) +
+                     value.microsecond / 1000000.0)
+    if hasattr(value, 'timeIntervalSince1970'):
+        # NSDate
+        return _Date(value.timeIntervalSince1970())
+    if hasattr(value, 'keys'):
+        # NSDictionary
+        return value
+    if hasattr(value, '__iter__'):
+        return [_normalize(item) for item in value]
+    return value
+
+
+def _value_for_key(value, key):
+    '''Looks up key in value, like NSObject's valueForKey:'''
+    if value is None:
+        return None
+    if hasattr(value, 'keys'):
+        return value.get(key)
+    if not _is_string(value) and hasattr(value, '__iter__'):
+        return [_value_for_key(item, key) for item in value]
+    raise PredicateError('Can\'t look up key "%s" in %r' % (key, value))
+
+
+def _fold(value, options):
+    '''Applies the case and diacritic insensitive options to a string'''
+    if 'd' in options:
+        value = u''.join(char for char in unicodedata.normalize('NFD', value)
+                         if not unicodedata.combining(char))
+    if 'c' in options:
+        value = value.lower()
+    return value
+
+
+def _is_string(value):
+    '''Returns True if value is a string'''
+    return isinstance(value, STRING_TYPES)
+
+
+def _is_number(value):
+    '''Returns True if value is a number or a bool'''
+    return isinstance(value, NUMBER_TYPES)
+
+
+def _equal(left, right, options):
+    '''Returns True if left and right are equal, like isEqual:'''
+    if _is_string(left) and _is_string(right):
+        return _fold(left, options) == _fold(right, options)
+    if isinstance(left, _Date) or isinstance(right, _Date):
+        return (isinstance(left, _Date) and isinstance(right, _Date) and
+                left.seconds == right.seconds)
+    if _is_number(left) and _is_number(right):
+        return left == right
+    if _is_string(left) or _is_string(right):
+        return False
+    if isinstance(left, list) and isinstance(right, list):
+        return len(left) == len(right) and all(
+            _equal(this, that, options) for (this, that) in zip(left, right))
+    return left == right
+
+
+def _ordered(left, right, options):
+    '''Returns left and right as a pair of values Python can order the same
+    way NSPredicate would, or raises PredicateError'''
+    if _is_number(left) and _is_number(right):
+        return (left, right)
+    if _is_string(left) and _is_string(right):
+        return (_fold(left, options), _fold(right, options))
+    if isinstance(left, _Date) and isinstance(right, _Date):
+        return (left.seconds, right.seconds)
+    raise PredicateError('Can\'t compare %r to %r' % (left, right))
+
+
+def _strings(left, right, options):
+    '''Returns left and right folded for a string operator, or None if
+    left is NULL'''
+    if left is None:
+        return None
+    if not (_is_string(left) and _is_string(right)):
+        raise PredicateError(
+            'String operator used with %r and %r' % (left, right))
+    return (_fold(left, options), _fold(right, options))
+
+
+_PATTERNS = {}
+
+
+def _like_regex(pattern):
+    '''Returns a compiled regex for a LIKE pattern, where * matches any
+    characters and ? matches one character'''
+    if ('LIKE', pattern) not in _PATTERNS:
+        regex = []
+        escaped = False
+        for char in pattern:
+            if escaped:
+                regex.append(re.escape(char))
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == '*':
+                regex.append('.*')
+            elif char == '?':
+                regex.append('.')
+            else:
+                regex.append(re.escape(char))
+        _PATTERNS[('LIKE', pattern)] = re.compile(
+            u''.join(regex) + r'\Z', re.DOTALL)
+    return _PATTERNS[('LIKE', pattern)]
+
+
+def _matches_regex(pattern, options):
+    '''Returns a compiled regex for a MATCHES pattern'''
+    flags = re.DOTALL | re.UNICODE
+    if 'c' in options:
+        flags |= re.IGNORECASE
+    if ('MATCHES', pattern, flags) not in _PATTERNS:
+        try:
+            _PATTERNS[('MATCHES', pattern, flags)] = re.compile(
+                u'(?:%s)\\Z' % pattern, flags)
+        except re.error as err:
+            raise PredicateError('Invalid regular expression: %s' % err)
+    return _PATTERNS[('MATCHES', pattern, flags)]
+
+
+def _op_in(left, right, options):
+    '''left IN right'''
+    if _is_string(right):
+        if left is None:
+            return False
+        if not _is_string(left):
+            raise PredicateError('IN used with %r and %r' % (left, right))
+        return _fold(left, options) in _fold(right, options)
+    if isinstance(right, list):
+        return any(_equal(left, item, options) for item in right)
+    raise PredicateError('IN used with %r and %r' % (left, right))
+
+
+def _op_contains(left, right, options):
+    '''left CONTAINS right'''
+    if left is None:
+        return False
+    return _op_in(right, left, options)
+
+
+def _op_beginswith(left, right, options):
+    '''left BEGINSWITH right'''
+    values = _strings(left, right, options)
+    return values is not None and values[0].startswith(values[1])
+
+
+def _op_endswith(left, right, options):
+    '''left ENDSWITH right'''
+    values = _strings(left, right, options)
+    return values is not None and values[0].endswith(values[1])
+
+
+def _op_like(left, right, options):
+    '''left LIKE right'''
+    values = _strings(left, right, options)
+    return (values is not None and
+            _like_regex(values[1]).match(values[0]) is not None)
+
+
+def _op_matches(left, right, options):
+    '''left MATCHES right'''
+    if left is None:
+        return False
+    if not (_is_string(left) and _is_string(right)):
+        raise PredicateError('MATCHES used with %r and %r' % (left, right))
+    if 'd' in options:
+        left = _fold(left, 'd')
+    return _matches_regex(right, options).match(left) is not None
+
+
+def _op_between(left, right, options):
+    '''left BETWEEN {low, high}'''
+    if not isinstance(right, list) or len(right) != 2:
+        raise PredicateError('BETWEEN needs a pair of values')
+    (low, value) = _ordered(right[0], left, options)
+    (value, high) = _ordered(left, right[1], options)
+    return low <= value <= high
+
+
+def _op_equal(left, right, options):
+    '''left == right'''
+    return _equal(left, right, options)
+
+
+def _op_not_equal(left, right, options):
+    '''left != right'''
+    return not _equal(left, right, options)
+
+
+def _op_less(left, right, options):
+    '''left < right'''
+    (left, right) = _ordered(left, right, options)
+    return left < right
+
+
+def _op_less_or_equal(left, right, options):
+    '''left <= right'''
+    (left, right) = _ordered(left, right, options)
+    return left <= right
+
+
+def _op_greater(left, right, options):
+    '''left > right'''
+    (left, right) = _ordered(left, right, options)
+    return left > right
+
+
+def _op_greater_or_equal(left, right, options):
+    '''left >= right'''
+    (left, right) = _ordered(left, right, options)
+    return left >= right
+
+
+OPERATORS = {
+    '==': _op_equal,
+    '!=': _op_not_equal,
+    '<': _op_less,
+    '<=': _op_less_or_equal,
+    '>': _op_greater,
+    '>=': _op_greater_or_equal,
+    'IN': _op_in,
+    'CONTAINS': _op_contains,
+    'BEGINSWITH': _op_beginswith,
+    'ENDSWITH': _op_endswith,
+    'LIKE': _op_like,
+    'MATCHES': _op_matches,
+    'BETWEEN': _op_between,
+}
+
+OPERATOR_ALIASES = {'=': '==', '<>': '!=', '=<': '<=', '=>': '>='}
+
+
+def _cast_to_date(value):
+    '''CAST(value, "NSDate")'''
+    value = _normalize(value)
+    if isinstance(value, _Date):
+        return value
+    if _is_number(value) and not isinstance(value, bool):
+        # numbers are seconds since the NSDate reference date
+        return _Date(NSDATE_REFERENCE_OFFSET + value)
+    if _is_string(value):
+        for date_format in ('%Y-%m-%dT%H:%M:%SZ', '%Y-%m-%d %H:%M:%S +0000'):
+            try:
+                return _normalize(
+                    datetime.datetime.strptime(value.strip(), date_format))
+            except ValueError:
+                pass
+    raise PredicateError('Can\'t CAST %r to NSDate' % value)
+
+
+# parsing and compiling
+
+class _Parser(object):
+    """Recursive descent parser that turns a token list into a function
+    taking an info object"""
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.position = 0
+
+    def _peek(self):
+        '''Returns the next token without consuming it'''
+        return self.tokens[self.position]
+
+    def _accept(self, kind, *values):
+        '''Consumes and returns the next token if it matches, else returns
+        None'''
+        token = self.tokens[self.position]
+        if token[0] == kind and (not values or token[1] in values):
+            self.position += 1
+            return token
+        return None
+
+    def _expect(self, kind, *values):
+        '''Consumes and returns the next token, which must match'''
+        token = self._accept(kind, *values)
+        if token is None:
+            raise PredicateError(
+                'Expected %s but found %r' % (
+                    ' or '.join(values) or kind, self._peek()[1]))
+        return token
+
+    def parse(self):
+        '''Parses the whole predicate'''
+        predicate = self._parse_or()
+        self._expect('END')
+        return predicate
+
+    def _parse_or(self):
+        '''predicate OR predicate ...'''
+        parts = [self._parse_and()]
+        while (self._accept('KEYWORD', 'OR') or
+               self._accept('OP', '||')):
+            parts.append(self._parse_and())
+        if len(parts) == 1:
+            return parts[0]
+        return lambda obj: any(part(obj) for part in parts)
+
+    def _parse_and(self):
+        '''predicate AND predicate ...'''
+        parts = [self._parse_not()]
+        while (self._accept('KEYWORD', 'AND') or
+               self._accept('OP', '&&')):
+            parts.append(self._parse_not())
+        if len(parts) == 1:
+            return parts[0]
+        return lambda obj: all(part(obj) for part in parts)
+
+    def _parse_not(self):
+        '''NOT predicate'''
+        if self._accept('KEYWORD', 'NOT') or self._accept('OP', '!'):
+            inner = self._parse_not()
+            return lambda obj: not inner(obj)
+        return self._parse_primary()
+
+    def _parse_primary(self):
+        '''(predicate), TRUEPREDICATE, FALSEPREDICATE or a comparison'''
+        if self._accept('OP', '('):
+            predicate = self._parse_or()
+            self._expect('OP', ')')
+            return predicate
+        if self._accept('KEYWORD', 'TRUEPREDICATE'):
+            return lambda obj: True
+        if self._accept('KEYWORD', 'FALSEPREDICATE'):
+            return lambda obj: False
+        return self._parse_comparison()
+
+    def _parse_comparison(self):
+        '''[modifier] expression operator[options] expression'''
+        modifier = self._accept('KEYWORD', 'ANY', 'SOME', 'ALL', 'NONE')
+        left = self._parse_expression()
+        token = self._peek()
+        if token[0] == 'OP' and (token[1] in OPERATORS or
+                                 token[1] in OPERATOR_ALIASES):
+            operator = OPERATOR_ALIASES.get(token[1], token[1])
+        elif token[0] == 'KEYWORD' and token[1] in OPERATORS:
+            operator = token[1]
+        else:
+            raise PredicateError('Expected an operator but found %r'
+                                 % token[1])
+        self.position += 1
+        options = ''
+        if self._accept('OP', '['):
+            options = self._expect('KEYPATH')[1][0].lower()
+            if len(options) > 3 or not set(options) <= set('cdnl'):
+                raise PredicateError('Unsupported options [%s]' % options)
+            self._expect('OP', ']')
+        right = self._parse_expression()
+        return _comparison(
+            modifier and modifier[1], left, OPERATORS[operator], options,
+            right)
+
+    def _parse_expression(self):
+        '''A literal, key path, aggregate or CAST'''
+        # pylint: disable=too-many-return-statements
+        token = self._peek()
+        self.position += 1
+        if token[0] in ('STRING', 'NUMBER'):
+            value = _normalize(token[1])
+            return lambda obj: value
+        if token[0] == 'KEYPATH':
+            keypath = token[1]
+            return lambda obj: _keypath_value(obj, keypath)
+        if token == ('KEYWORD', 'SELF'):
+            return lambda obj: obj
+        if token[0] == 'KEYWORD' and token[1] in ('TRUE', 'YES'):
+            return lambda obj: True
+        if token[0] == 'KEYWORD' and token[1] in ('FALSE', 'NO'):
+            return lambda obj: False
+        if token[0] == 'KEYWORD' and token[1] in ('NULL', 'NIL'):
+            return lambda obj: None
+        if token == ('OP', '{'):
+            items = []
+            if not self._accept('OP', '}'):
+                items.append(self._parse_expression())
+                while self._accept('OP', ','):
+                    items.append(self._parse_expression())
+                self._expect('OP', '}')
+            return lambda obj: [item(obj) for item in items]
+        if token == ('KEYWORD', 'CAST'):
+            self._expect('OP', '(')
+            value = self._parse_expression()
+            self._expect('OP', ',')
+            cast_type = self._expect('STRING')[1]
+            self._expect('OP', ')')
+            if cast_type != 'NSDate':
+                raise PredicateError('Unsupported CAST to %s' % cast_type)
+            return lambda obj: _cast_to_date(value(obj))
+        raise PredicateError('Unexpected %r' % (token[1],))
+
+
+def _keypath_value(obj, keypath):
+    '''Returns the value for a key path in obj'''
+    value = obj
+    for key in keypath:
+        value = _value_for_key(value, key)
+    return value
+
+
+def _comparison(modifier, left, operator, options, right):
+    '''Returns a function that evaluates a comparison'''
+
+    def compare(obj):
+        '''Evaluates the comparison against obj'''
+        lvalue = _normalize(left(obj))
+        rvalue = _normalize(right(obj))
+        if modifier is None:
+            return operator(lvalue, rvalue, options)
+        if not isinstance(lvalue, list):
+            raise PredicateError(
+                '%s used with a non-collection %r' % (modifier, lvalue))
+        results = (operator(item, rvalue, options) for item in lvalue)
+        if modifier == 'ALL':
+            return all(results)
+        if modifier == 'NONE':
+            return not any(results)
+        return any(results)
+
+    return compare
+
+
+_COMPILED = {}
+
+
+def compile_predicate(predicate_string):
+    """Returns a function that takes an info object (a dictionary) and
+    returns True if predicate_string is true for it. Predicates are parsed
+    only once; the compiled function is cached.
+
+    Raises PredicateError if the predicate uses syntax we don't support.
+    The compiled function raises PredicateError if it meets values it
+    can't compare the way NSPredicate would."""
+    try:
+        compiled = _COMPILED[predicate_string]
+    except KeyError:
+        try:
+            compiled = _Parser(tokenize(predicate_string)).parse()
+        except PredicateError as err:
+            compiled = err
+        _COMPILED[predicate_string] = compiled
+    if isinstance(compiled, PredicateError):
+        raise compiled
+    return compiled
+
+
+def evaluate_predicate(predicate_string, info_object):
+    """Returns True if predicate_string is true for info_object.
+
+    Raises PredicateError if the predicate can't be compiled or
+    evaluated."""
+    return bool(compile_predicate(predicate_string)(info_object))
+
+
+if __name__ == '__main__':
+    print('This is a library of support tools for the Munki Suite.')
@@ -58,22 +58,28 @@ DEFAULT_PREFS = {
     'ClientResourcesFilename': None,
     'ClientResourceURL': None,
     'DaysBetweenNotifications': 1,
+    'DeferCatalogItemDetails': False,
     'FollowHTTPRedirects': 'none',
+    'ForceChecksumVerification': False,
+    'FullUpdateCheckInterval': 0,
     'HelpURL': None,
     'IconURL': None,
     'IgnoreSystemProxies': False,
     'InstallRequiresLogout': False,
     'InstallAppleSoftwareUpdates': False,
+    'InstalledStateWorkers': 4,
     'LastNotifiedDate': NSDate.dateWithTimeIntervalSince1970_(0),
     'LocalOnlyManifest': None,
     'LogFile': '/Library/Managed Installs/Logs/ManagedSoftwareUpdate.log',
     'LoggingLevel': 1,
     'LogToSyslog': False,
     'ManagedInstallDir': '/Library/Managed Installs',
+    'ManifestPrefetchWorkers': 4,
     'ManifestURL': None,
     'PackageURL': None,
     'PackageVerificationMode': 'hash',
     'PerformAuthRestarts': False,
+    'PerformanceTraceFile': None,
     'RecoveryKeyFile': None,
     'ShowOptionalInstallsForHigherOSVersions': False,
     'SoftwareRepoCACertificate': None,
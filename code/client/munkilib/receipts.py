@@ -0,0 +1,119 @@
+# encoding: utf-8
+#
+# Copyright 2009-2020 Greg Neagle.
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+receipts.py
+
+A snapshot of the installed package receipts, saved to disk so we only ask
+pkgutil for all the receipts again when the receipts directories change.
+
+The snapshot maps each pkgid to a dict with the installed 'version' and,
+where we know it, the 'install_time'.
+"""
+from __future__ import absolute_import, print_function
+
+import hashlib
+import json
+import os
+
+from . import wrappers
+
+
+# where receipts are recorded
+RECEIPTS_DIRS = ('/var/db/receipts', '/Library/Receipts',
+                 '/System/Library/Receipts')
+
+# bump this when the structure of the snapshot changes
+SNAPSHOT_FORMAT = 1
+
+
+def _stat(path):
+    '''Returns [mtime, size] for path, or None if it doesn't exist'''
+    try:
+        attrs = os.lstat(path)
+    except OSError:
+        return None
+    return [getattr(attrs, 'st_mtime_ns', attrs.st_mtime), attrs.st_size]
+
+
+def directory_fingerprint(directories=RECEIPTS_DIRS):
+    """Returns a SHA-256 hash of the listing of directories: each directory's
+    mtime, and the name, mtime and size of everything in it. Any receipt
+    being added, removed or rewritten changes it."""
+    listing = []
+    for directory in directories:
+        if not os.path.isdir(directory):
+            listing.append([directory, None])
+            continue
+        entries = [[name, _stat(os.path.join(directory, name))]
+                   for name in sorted(os.listdir(directory))]
+        listing.append([directory, _stat(directory), entries])
+    return hashlib.sha256(
+        json.dumps(listing).encode('UTF-8')).hexdigest()
+
+
+def load_snapshot(snapshot_path, fingerprint):
+    '''Returns the packages saved at snapshot_path if they were saved with
+    fingerprint, None otherwise'''
+    try:
+        snapshot = wrappers.readPlist(snapshot_path)
+    except wrappers.PlistReadError:
+        return None
+    if (not hasattr(snapshot, 'get') or
+            snapshot.get('format') != SNAPSHOT_FORMAT or
+            snapshot.get('fingerprint') != fingerprint):
+        return None
+    return snapshot.get('packages')
+
+
+def save_snapshot(snapshot_path, fingerprint, packages):
+    '''Saves packages to snapshot_path along with the fingerprint of the
+    receipts directories they were read from. Returns True if it worked.'''
+    snapshot = {'format': SNAPSHOT_FORMAT,
+                'fingerprint': fingerprint,
+                'packages': packages}
+    try:
+        wrappers.writePlist(snapshot, snapshot_path)
+    except wrappers.PlistWriteError:
+        return False
+    return True
+
+
+def installed_packages(snapshot_path, read_packages,
+                       directories=RECEIPTS_DIRS):
+    """Returns the installed packages from the snapshot at snapshot_path if
+    the receipts directories haven't changed since it was saved. Otherwise
+    calls read_packages() to get them and saves a new snapshot."""
+    fingerprint = directory_fingerprint(directories)
+    packages = load_snapshot(snapshot_path, fingerprint)
+    if packages is None:
+        # if receipts change while we read them, the fingerprint we save
+        # won't match and the next call will read them again
+        packages = read_packages()
+        save_snapshot(snapshot_path, fingerprint, packages)
+    return packages
+
+
+def packages_checksum(packages, prefix=''):
+    '''Returns a SHA-256 hash of the pkgids, versions and install times of
+    the packages whose pkgids start with prefix'''
+    selected = sorted(
+        [pkgid, info.get('version'), info.get('install_time')]
+        for (pkgid, info) in packages.items() if pkgid.startswith(prefix))
+    return hashlib.sha256(json.dumps(selected).encode('UTF-8')).hexdigest()
+
+
+if __name__ == '__main__':
+    print('This is a library of support tools for the Munki Suite.')
@@ -23,9 +23,12 @@ Reporting functions
 """
 from __future__ import absolute_import, print_function
 
+import functools
+import json
 import os
 import subprocess
 import sys
+import threading
 import time
 
 # PyLint cannot properly find names inside Cocoa libraries, so issues bogus
@@ -77,6 +80,7 @@ def printreport(reportdict):
 
 def savereport():
     """Save our report"""
+    trace({'type': 'counters', 'counters': dict(report.get('Counters', {}))})
     FoundationPlist.writePlist(
         report, os.path.join(
             prefs.pref('ManagedInstallDir'), 'ManagedInstallReport.plist'))
@@ -103,6 +107,91 @@ def _warn(msg):
     munkilog.log(warning, 'warnings.log')
 
 
+def increment_counter(name, amount=1):
+    """Increments a named counter in the Counters section of the report"""
+    with _STATS_LOCK:
+        counters = report.setdefault('Counters', {})
+        counters[name] = counters.get(name, 0) + amount
+
+
+def record_time(name, seconds, start=None):
+    """Adds seconds to the named timing in the Timings section of the
+    report, and writes a trace record if we are tracing"""
+    with _STATS_LOCK:
+        timing = report.setdefault('Timings', {}).setdefault(
+            name, {'count': 0, 'seconds': 0.0})
+        timing['count'] += 1
+        timing['seconds'] += seconds
+    if start is None:
+        start = time.time() - seconds
+    trace({'type': 'span', 'name': name, 'start': start,
+           'seconds': seconds})
+
+
+class Timer(object):
+    """Times a block of code, or every call of a function, recording the
+    time under name with record_time:
+
+        with reports.Timer('CatalogLoad'):
+            ...
+
+        @reports.Timer('InstalledState')
+        def installed_state(item_pl):
+            ...
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        record_time(self.name, time.time() - self.start, self.start)
+        return False
+
+    def __call__(self, func):
+        @functools.wraps(func)
+        def timed_func(*args, **kwargs):
+            '''Calls func, timing it'''
+            with Timer(self.name):
+                return func(*args, **kwargs)
+        return timed_func
+
+
+def start_trace():
+    """Reads the PerformanceTraceFile preference, which we then use for the
+    rest of the run. Called when we start a new report and at the start of
+    each update check."""
+    # pylint: disable=global-statement
+    global _TRACE_PATH
+    _TRACE_PATH = prefs.pref('PerformanceTraceFile') or ''
+
+
+def trace(record):
+    """Appends record (a dictionary) as a line of JSON to the file named by
+    the PerformanceTraceFile preference, if it is set"""
+    # pylint: disable=global-statement
+    global _TRACE_FILE
+    if _TRACE_PATH is None:
+        start_trace()
+    tracepath = _TRACE_PATH
+    if not tracepath or tracepath in _TRACE_ERRORS:
+        return
+    record = dict(record, pid=os.getpid())
+    with _STATS_LOCK:
+        try:
+            if _TRACE_FILE is None or _TRACE_FILE.name != tracepath:
+                _TRACE_FILE = open(tracepath, 'a')
+            _TRACE_FILE.write(json.dumps(record, sort_keys=True) + '\n')
+            _TRACE_FILE.flush()
+        except (OSError, IOError, TypeError, ValueError) as err:
+            _warn('Could not write to trace file %s: %s' % (tracepath, err))
+            _TRACE_ERRORS.add(tracepath)
+
+
 def archive_report():
     """Archive a report"""
     reportfile = os.path.join(
@@ -145,6 +234,14 @@ def archive_report():
 # pylint: disable=invalid-name
 report = {}
 # pylint: enable=invalid-name
+# protects Counters and Timings, which threads may update
+_STATS_LOCK = threading.RLock()
+# trace file path for this run ('' if we aren't tracing, None if we haven't
+# read the preference yet), the open trace file, and trace files we couldn't
+# write
+_TRACE_PATH = None
+_TRACE_FILE = None
+_TRACE_ERRORS = set()
 
 
 if __name__ == '__main__':
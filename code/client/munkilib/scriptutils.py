@@ -30,6 +30,7 @@ from . import osutils
 from . import display
 from . import munkilog
 from . import munkistatus
+from . import reports
 
 
 def _writefile(stringdata, path):
@@ -79,8 +80,10 @@ def run_embedded_script(scriptname, pkginfo_item, suppress_error=False):
         itemname, scriptpath, scriptname, suppress_error=suppress_error)
 
 
+@reports.Timer('Scripts')
 def run_script(itemname, path, scriptname, suppress_error=False):
     '''Runs a script, Returns return code.'''
+    reports.increment_counter('ScriptsRun')
     if suppress_error:
         display.display_detail(
             'Running %s for %s ' % (scriptname, itemname))
@@ -37,31 +37,116 @@ from .. import info
 from .. import munkilog
 from .. import prefs
 from .. import processes
+from .. import reports
+from .. import utils
 from ..wrappers import is_a_string
 
 
+class ItemList(list):
+    """A list of item names or item dictionaries, as stored in installinfo,
+    that also keeps indexes by name so lookups don't have to scan the list.
+    It is still a list, so it is saved to InstallInfo.plist (and compares)
+    just like one."""
+
+    def __init__(self, iterable=()):
+        list.__init__(self, iterable)
+        self._reindex()
+
+    def _reindex(self):
+        '''Rebuilds the indexes from scratch'''
+        # pylint: disable=attribute-defined-outside-init
+        self._names = set()
+        self._names_without_version = set()
+        self._items_by_name = {}
+        for item in self:
+            self._index(item)
+
+    def _index(self, item):
+        '''Adds item to the indexes'''
+        if is_a_string(item):
+            self._names.add(item)
+            self._names_without_version.add(
+                catalogs.split_name_and_version(item)[0])
+        elif isinstance(item, dict) and 'name' in item:
+            self._items_by_name.setdefault(item['name'], []).append(item)
+
+    def __contains__(self, item):
+        if is_a_string(item):
+            return item in self._names
+        return list.__contains__(self, item)
+
+    def contains_name_without_version(self, name):
+        '''Returns True if name is in the list, ignoring any version
+        suffixes of the names in the list'''
+        return name in self._names_without_version
+
+    def items_named(self, name):
+        '''Returns a list of the item dictionaries with the given name'''
+        return self._items_by_name.get(name, [])
+
+    def append(self, item):
+        list.append(self, item)
+        self._index(item)
+
+    def extend(self, iterable):
+        for item in iterable:
+            self.append(item)
+
+    def __iadd__(self, iterable):
+        self.extend(iterable)
+        return self
+
+    # anything else that changes the list just rebuilds the indexes
+    def insert(self, index, item):
+        list.insert(self, index, item)
+        self._reindex()
+
+    def remove(self, item):
+        list.remove(self, item)
+        self._reindex()
+
+    def pop(self, *args):
+        item = list.pop(self, *args)
+        self._reindex()
+        return item
+
+    def sort(self, *args, **kwargs):
+        list.sort(self, *args, **kwargs)
+        self._reindex()
+
+    def __setitem__(self, index, value):
+        list.__setitem__(self, index, value)
+        self._reindex()
+
+    def __delitem__(self, index):
+        list.__delitem__(self, index)
+        self._reindex()
+
+
 def item_in_installinfo(item_pl, thelist, vers=''):
     """Determines if an item is in a list of processed items.
 
     Returns True if the item has already been processed (it's in the list)
     and, optionally, the version is the same or greater.
     """
-    for listitem in thelist:
-        try:
-            if listitem['name'] == item_pl['name']:
-                if not vers:
-                    return True
-                #if the version already installed or processed to be
-                #installed is the same or greater, then we're good.
-                if listitem.get('installed') and (compare.compare_versions(
-                        listitem.get('installed_version'), vers) in (1, 2)):
-                    return True
-                if (compare.compare_versions(
-                        listitem.get('version_to_install'), vers) in (1, 2)):
-                    return True
-        except KeyError:
-            # item is missing 'name', so doesn't match
-            pass
+    if 'name' not in item_pl:
+        return False
+    if isinstance(thelist, ItemList):
+        candidates = thelist.items_named(item_pl['name'])
+    else:
+        candidates = [listitem for listitem in thelist
+                      if listitem.get('name') == item_pl['name']]
+    if candidates and not vers:
+        return True
+    vers_key = utils.version_key(vers)
+    for listitem in candidates:
+        #if the version already installed or processed to be
+        #installed is the same or greater, then we're good.
+        if listitem.get('installed') and (utils.version_key(
+                listitem.get('installed_version')) >= vers_key):
+            return True
+        if utils.version_key(listitem.get('version_to_install')) >= vers_key:
+            return True
 
     return False
 
@@ -152,30 +237,36 @@ def process_optional_install(manifestitem, cataloglist, installinfo):
 
     # check to see if item (any version) is already in the
     # optional_install list:
-    for item in installinfo['optional_installs']:
+    optional_installs = installinfo['optional_installs']
+    if isinstance(optional_installs, ItemList):
+        optional_installs = optional_installs.items_named(manifestitemname)
+    for item in optional_installs:
         if manifestitemname == item['name']:
             display.display_debug1(
                 '%s has already been processed for optional install.',
                 manifestitemname)
             return
 
-    item_pl = catalogs.get_item_detail(manifestitem, cataloglist,
-                                       suppress_warnings=True)
-    if not item_pl and prefs.pref('ShowOptionalInstallsForHigherOSVersions'):
+    if prefs.pref('ShowOptionalInstallsForHigherOSVersions'):
+        # look for an item valid for the current OS and hardware and
+        # an item that may require a higher OS in one pass
+        (item_pl, higher_os_item_pl) = catalogs.get_item_details(
+            manifestitem, cataloglist, suppress_warnings=True)
+    else:
+        item_pl = catalogs.get_item_detail(manifestitem, cataloglist,
+                                           suppress_warnings=True)
+        higher_os_item_pl = None
+    if not item_pl and higher_os_item_pl:
         # could not find an item valid for the current OS and hardware
-        # try again to see if there is an item for a higher OS
-        item_pl = catalogs.get_item_detail(
-            manifestitem, cataloglist, skip_min_os_check=True,
-            suppress_warnings=True)
-        if item_pl:
-            # found an item that requires a higher OS version
-            display.display_debug1(
-                'Found %s, version %s that requires a higher os version',
-                item_pl['name'], item_pl['version'])
-            # insert a note about the OS version requirement
-            item_pl['note'] = ('Requires macOS version %s.'
-                               % item_pl['minimum_os_version'])
-            item_pl['update_available'] = True
+        # but found an item that requires a higher OS version
+        item_pl = higher_os_item_pl
+        display.display_debug1(
+            'Found %s, version %s that requires a higher os version',
+            item_pl['name'], item_pl['version'])
+        # insert a note about the OS version requirement
+        item_pl['note'] = ('Requires macOS version %s.'
+                           % item_pl['minimum_os_version'])
+        item_pl['update_available'] = True
     if not item_pl:
         # could not find anything that matches and is applicable
         display.display_warning(
@@ -212,9 +303,7 @@ def process_optional_install(manifestitem, cataloglist, installinfo):
             display.display_debug1(
                 'Checking for versions of %s that require a higher OS version',
                 manifestitem)
-            another_item_pl = catalogs.get_item_detail(
-                manifestitem, cataloglist, skip_min_os_check=True,
-                suppress_warnings=True)
+            another_item_pl = higher_os_item_pl
             if another_item_pl != item_pl:
                 # we found a different item. Replace the one we found
                 # previously with this one.
@@ -229,6 +318,13 @@ def process_optional_install(manifestitem, cataloglist, installinfo):
 
     # if we get to this point we can add this item
     # to the list of optional installs
+    try:
+        item_pl = catalogs.full_pkginfo(item_pl)
+    except catalogs.CatalogItemDetailsError as err:
+        display.display_warning(
+            'Could not process item %s for optional install: %s',
+            manifestitem, err)
+        return
     iteminfo = {}
     iteminfo['name'] = item_pl.get('name', manifestitemname)
     iteminfo['description'] = item_pl.get('description', '')
@@ -381,6 +477,27 @@ def process_install(manifestitem, cataloglist, installinfo,
             if not success:
                 dependencies_met = False
 
+    # check_installed_states checked the catalog item, and the keys
+    # full_pkginfo reads back in don't change its installed state, so use
+    # the catalog item for our installed state checks
+    catalog_item_pl = item_pl
+    try:
+        item_pl = catalogs.full_pkginfo(item_pl)
+    except catalogs.CatalogItemDetailsError as err:
+        display.display_warning(
+            'Can\'t install %s: %s', manifestitemname, err)
+        # add information to managed_installs so we have some feedback
+        # to display in MSC.app
+        iteminfo = {}
+        iteminfo['name'] = item_pl.get('name', '')
+        iteminfo['display_name'] = item_pl.get(
+            'display_name', iteminfo['name'])
+        iteminfo['installed'] = False
+        iteminfo['note'] = ('Can\'t install %s because its details could '
+                            'not be read.' % iteminfo['display_name'])
+        iteminfo['version_to_install'] = item_pl.get('version', 'UNKNOWN')
+        installinfo['managed_installs'].append(iteminfo)
+        return False
     iteminfo = {}
     iteminfo['name'] = item_pl.get('name', '')
     iteminfo['display_name'] = item_pl.get('display_name', iteminfo['name'])
@@ -402,7 +519,7 @@ def process_install(manifestitem, cataloglist, installinfo,
         installinfo['managed_installs'].append(iteminfo)
         return False
 
-    installed_state = installationstate.installed_state(item_pl)
+    installed_state = installationstate.installed_state(catalog_item_pl)
     if installed_state == 0:
         display.display_detail('Need to install %s', manifestitemname)
         iteminfo['installer_item_size'] = item_pl.get(
@@ -494,7 +611,8 @@ def process_install(manifestitem, cataloglist, installinfo,
                              'precache']
 
             if (is_optional_install and
-                    not installationstate.some_version_installed(item_pl)):
+                    not installationstate.some_version_installed(
+                        catalog_item_pl)):
                 # For optional installs where no version is installed yet
                 # we do not enforce force_install_after_date
                 optional_keys.remove('force_install_after_date')
@@ -547,6 +665,7 @@ def process_install(manifestitem, cataloglist, installinfo,
             display.display_warning(
                 'Can\'t install %s because the integrity check failed.',
                 manifestitem)
+            reports.increment_counter('DownloadFailures')
             iteminfo['installed'] = False
             iteminfo['note'] = 'Integrity check failed'
             iteminfo['version_to_install'] = item_pl.get('version', 'UNKNOWN')
@@ -560,6 +679,7 @@ def process_install(manifestitem, cataloglist, installinfo,
         except (fetch.GurlError, fetch.GurlDownloadError) as errmsg:
             display.display_warning(
                 'Download of %s failed: %s', manifestitem, errmsg)
+            reports.increment_counter('DownloadFailures')
             iteminfo['installed'] = False
             iteminfo['note'] = u'Download failed (%s)' % errmsg
             iteminfo['version_to_install'] = item_pl.get('version', 'UNKNOWN')
@@ -573,6 +693,7 @@ def process_install(manifestitem, cataloglist, installinfo,
         except fetch.Error as errmsg:
             display.display_warning(
                 'Can\'t install %s because: %s', manifestitemname, errmsg)
+            reports.increment_counter('DownloadFailures')
             iteminfo['installed'] = False
             iteminfo['note'] = '%s' % errmsg
             iteminfo['version_to_install'] = item_pl.get('version', 'UNKNOWN')
@@ -633,21 +754,53 @@ def process_install(manifestitem, cataloglist, installinfo,
         return True
 
 
-def process_manifest_for_key(manifest, manifest_key, installinfo,
-                             parentcatalogs=None):
-    """Processes keys in manifests to build the lists of items to install and
-    remove.
+def resolve_manifest(manifest, parentcatalogs=None):
+    """Expands a manifest's included_manifests and conditional_items into
+    a flat list, in the order their items should be processed: for each
+    manifest, first everything from its included manifests, then its
+    conditional_items whose conditions are true, then the manifest itself.
 
-    Can be recursive if manifests include other manifests.
-    Probably doesn't handle circular manifest references well.
+    A manifest file that is reached more than once with the same catalogs
+    (for example a shared base manifest included by several group
+    manifests) is expanded only the first time; processing its items
+    again would not change the results. Manifests that include each other
+    in a loop are reported as an error and the loop is skipped.
 
     manifest can be a path to a manifest file or a dictionary object.
+    Returns a list of (manifest, manifestdata, cataloglist) tuples, where
+    manifest is the path to a manifest file or 'embedded manifest' for
+    conditional_items, and cataloglist is the catalogs to use for its
+    items. Conditions are evaluated and included manifests are retrieved
+    just once per run.
+
+    Raises manifestutils.ManifestException if an included manifest can't
+    be retrieved.
     """
+    cache_key = None
+    if is_a_string(manifest):
+        cache_key = (manifest, tuple(parentcatalogs or []))
+        if cache_key in _RESOLVED_MANIFESTS:
+            return _RESOLVED_MANIFESTS[cache_key]
+    resolved = []
+    complete = _resolve_manifest(
+        manifest, parentcatalogs, resolved, [], set())
+    if complete and cache_key:
+        _RESOLVED_MANIFESTS[cache_key] = resolved
+    return resolved
+
+
+def _resolve_manifest(manifest, parentcatalogs, resolved, parents, visited,
+                      manifest_name=None):
+    """Does the work for resolve_manifest, appending to resolved.
+    parents is a list of (path, name) tuples for the manifest files that
+    include this one; visited is a set of (path, catalogs) tuples for the
+    manifest files already expanded.
+    Returns False if a stop was requested before we finished."""
+    # pylint: disable=too-many-arguments,too-many-branches
     if is_a_string(manifest):
-        display.display_debug1(
-            "** Processing manifest %s for %s",
-            os.path.basename(manifest), manifest_key)
         manifestdata = manifestutils.get_manifest_data(manifest)
+        parents = parents + [
+            (manifest, manifest_name or os.path.basename(manifest))]
     else:
         manifestdata = manifest
         manifest = 'embedded manifest'
@@ -660,7 +813,17 @@ def process_manifest_for_key(manifest, manifest_key, installinfo,
 
     if not cataloglist:
         display.display_warning('Manifest %s has no catalogs', manifest)
-        return
+        return True
+
+    if manifest != 'embedded manifest':
+        reports.increment_counter('ManifestVisits')
+        visit = (manifest, tuple(cataloglist))
+        if visit in visited:
+            display.display_debug2(
+                '** Manifest %s was already processed', manifest)
+            reports.increment_counter('ManifestVisitsSkipped')
+            return True
+        visited.add(visit)
 
     for item in manifestdata.get('included_manifests', []):
         if item: # only process if item is not empty
@@ -668,9 +831,20 @@ def process_manifest_for_key(manifest, manifest_key, installinfo,
             if not nestedmanifestpath:
                 raise manifestutils.ManifestException
             if processes.stop_requested():
-                return
-            process_manifest_for_key(nestedmanifestpath, manifest_key,
-                                     installinfo, cataloglist)
+                return False
+            parent_paths = [path for (path, dummy_name) in parents]
+            if nestedmanifestpath in parent_paths:
+                loop = parents[parent_paths.index(nestedmanifestpath):]
+                display.display_error(
+                    'Circular manifest include: %s. Skipping the include '
+                    'of %s by %s.',
+                    ' -> '.join([name for (dummy_path, name) in loop] +
+                                [item]), item, parents[-1][1])
+                continue
+            if not _resolve_manifest(
+                    nestedmanifestpath, cataloglist, resolved, parents,
+                    visited, manifest_name=item):
+                return False
 
     conditionalitems = manifestdata.get('conditional_items', [])
     if conditionalitems:
@@ -693,22 +867,71 @@ def process_manifest_for_key(manifest, manifest_key, installinfo,
         if info.predicate_evaluates_as_true(
                 predicate, additional_info={'catalogs': cataloglist}):
             conditionalmanifest = item
-            process_manifest_for_key(
-                conditionalmanifest, manifest_key, installinfo, cataloglist)
+            if not _resolve_manifest(
+                    conditionalmanifest, cataloglist, resolved, parents,
+                    visited):
+                return False
+
+    resolved.append((manifest, manifestdata, cataloglist))
+    return True
+
+
+def clear_resolved_manifests():
+    """Forgets manifests resolved by resolve_manifest. Called at the start
+    of each update check session."""
+    _RESOLVED_MANIFESTS.clear()
+
+
+def process_manifest_for_key(manifest, manifest_key, installinfo,
+                             parentcatalogs=None):
+    """Processes keys in manifests to build the lists of items to install and
+    remove.
+
+    Items from included manifests and conditional_items are processed too,
+    in the order given by resolve_manifest. Manifests that include each
+    other in a loop are reported and the loop is skipped.
+
+    manifest can be a path to a manifest file or a dictionary object.
+    """
+    with reports.Timer('Process:%s' % manifest_key):
+        _process_manifest_for_key(
+            manifest, manifest_key, installinfo, parentcatalogs)
+
 
-    for item in manifestdata.get(manifest_key, []):
+def _process_manifest_for_key(manifest, manifest_key, installinfo,
+                              parentcatalogs):
+    """Does the work for process_manifest_for_key"""
+    for (manifestname, manifestdata, cataloglist) in resolve_manifest(
+            manifest, parentcatalogs):
         if processes.stop_requested():
             return
-        if manifest_key == 'managed_installs':
-            dummy_result = process_install(item, cataloglist, installinfo)
-        elif manifest_key == 'managed_updates':
-            process_managed_update(item, cataloglist, installinfo)
-        elif manifest_key == 'optional_installs':
-            process_optional_install(item, cataloglist, installinfo)
-        elif manifest_key == 'managed_uninstalls':
-            dummy_result = process_removal(item, cataloglist, installinfo)
-        elif manifest_key == 'featured_items':
-            installinfo['featured_items'].append(item)
+        if manifestname != 'embedded manifest':
+            display.display_debug1(
+                "** Processing manifest %s for %s",
+                os.path.basename(manifestname), manifest_key)
+
+        if manifest_key in ('managed_installs', 'managed_updates',
+                            'optional_installs'):
+            # check the installed state of these items concurrently
+            # before we process them in order
+            installationstate.check_installed_states(
+                [catalogs.get_item_detail(item, cataloglist,
+                                          suppress_warnings=True)
+                 for item in manifestdata.get(manifest_key, [])])
+
+        for item in manifestdata.get(manifest_key, []):
+            if processes.stop_requested():
+                return
+            if manifest_key == 'managed_installs':
+                dummy_result = process_install(item, cataloglist, installinfo)
+            elif manifest_key == 'managed_updates':
+                process_managed_update(item, cataloglist, installinfo)
+            elif manifest_key == 'optional_installs':
+                process_optional_install(item, cataloglist, installinfo)
+            elif manifest_key == 'managed_uninstalls':
+                dummy_result = process_removal(item, cataloglist, installinfo)
+            elif manifest_key == 'featured_items':
+                installinfo['featured_items'].append(item)
 
 
 def process_removal(manifestitem, cataloglist, installinfo):
@@ -746,8 +969,16 @@ def process_removal(manifestitem, cataloglist, installinfo):
         manifestitemname_withversion)
 
     # have we processed this already?
-    if manifestitemname in [catalogs.split_name_and_version(item)[0]
-                            for item in installinfo['processed_installs']]:
+    processed_installs = installinfo['processed_installs']
+    if isinstance(processed_installs, ItemList):
+        some_version_processed = (
+            processed_installs.contains_name_without_version(
+                manifestitemname))
+    else:
+        some_version_processed = manifestitemname in [
+            catalogs.split_name_and_version(item)[0]
+            for item in processed_installs]
+    if some_version_processed:
         display.display_warning(
             'Will not attempt to remove %s because some version of it is in '
             'the list of managed installs, or it is required by another'
@@ -835,6 +1066,12 @@ def process_removal(manifestitem, cataloglist, installinfo):
 
     # if we got this far, we have enough info to attempt an uninstall.
     # the pkginfo is in uninstall_item
+    try:
+        uninstall_item = catalogs.full_pkginfo(uninstall_item)
+    except catalogs.CatalogItemDetailsError as err:
+        display.display_warning(
+            'Can\'t remove %s: %s', manifestitemname_withversion, err)
+        return False
     # Now check for dependent items
     #
     # First, look through catalogs for items that are required by this item;
@@ -993,16 +1230,15 @@ def process_removal(manifestitem, cataloglist, installinfo):
         if uninstall_item.get('installs', None):
             iteminfo['remove_app_info'] = uninstall_item['installs'][0]
     elif uninstallmethod == 'uninstall_script':
-        iteminfo['uninstall_script'] = item.get('uninstall_script', '')
+        iteminfo['uninstall_script'] = uninstall_item.get(
+            'uninstall_script', '')
 
     # before we add this removal to the list,
     # check for installed updates and add them to the
     # removal list as well:
     update_list = catalogs.look_for_updates(uninstall_item_name, cataloglist)
-    update_list.extend(catalogs.look_for_updates(
-        uninstall_name_w_version, cataloglist))
-    update_list.extend(catalogs.look_for_updates(
-        alt_uninstall_name_w_version, cataloglist))
+    update_list.extend(catalogs.look_for_updates_for_version(
+        uninstall_item_name, uninstall_item.get('version'), cataloglist))
     for update_item in update_list:
         # call us recursively...
         dummy_result = process_removal(update_item, cataloglist, installinfo)
@@ -1019,5 +1255,9 @@ def process_removal(manifestitem, cataloglist, installinfo):
     return True
 
 
+# module globals
+# manifests expanded by resolve_manifest, keyed by (path, parent catalogs)
+_RESOLVED_MANIFESTS = {}
+
 if __name__ == '__main__':
     print('This is a library of support tools for the Munki Suite.')
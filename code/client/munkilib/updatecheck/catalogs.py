@@ -22,28 +22,42 @@ Functions for working with Munki catalogs
 """
 from __future__ import absolute_import, print_function
 
+import hashlib
 import os
 
 from . import download
 
 from .. import display
+from .. import fetch
 from .. import info
 from .. import pkgutils
+from .. import plistreader
 from .. import prefs
+from .. import reports
 from .. import utils
 from .. import FoundationPlist
 from ..wrappers import is_a_string
 
 
+class CatalogItemDetailsError(Exception):
+    """Lets us raise an exception when we can't re-read the deferred
+    details of a catalog item."""
+    pass
+
+
 def make_catalog_db(catalogitems):
-    """Takes an array of catalog items and builds some indexes so we can
-    get our common data faster. Returns a dict we can use like a database"""
+    """Takes an array (or any iterable, like the generator returned by
+    stream_catalog_items) of catalog items and builds some indexes so we can
+    get our common data faster. Items are indexed as they are read, in a
+    single pass. Returns a dict we can use like a database"""
     name_table = {}
     pkgid_table = {}
+    updates_table = {}
+    autoremoveitems = set()
+    items = []
 
-    itemindex = -1
-    for item in catalogitems:
-        itemindex = itemindex + 1
+    for itemindex, item in enumerate(catalogitems):
+        items.append(item)
         name = item.get('name', 'NO NAME')
         vers = item.get('version', 'NO VERSION')
 
@@ -71,39 +85,217 @@ def make_catalog_db(catalogitems):
                     pkgid_table[pkg_id][version] = []
                 pkgid_table[pkg_id][version].append(itemindex)
 
-    # build table of update items with a list comprehension --
-    # filter all items from the catalogitems that have a non-empty
-    # 'update_for' list
-    updaters = [item for item in catalogitems if item.get('update_for')]
-
-    # now fix possible admin errors where 'update_for' is a string instead
-    # of a list of strings
-    for update in updaters:
-        if is_a_string(update['update_for']):
-            # convert to list of strings
-            update['update_for'] = [update['update_for']]
-
-    # build table of autoremove items with a list comprehension --
-    # filter all items from the catalogitems that have a non-empty
-    # 'autoremove' list
-    # autoremove items are automatically removed if they are not in the
-    # managed_install list (either directly or indirectly via included
-    # manifests)
-    autoremoveitems = [item.get('name') for item in catalogitems
-                       if item.get('autoremove')]
-    # convert to set and back to list to get list of unique names
-    autoremoveitems = list(set(autoremoveitems))
+        if item.get('update_for'):
+            # fix possible admin errors where 'update_for' is a string
+            # instead of a list of strings
+            if is_a_string(item['update_for']):
+                # convert to list of strings
+                item['update_for'] = [item['update_for']]
+            # build an inverted table of updates: for each item name (or
+            # name-version) an updater declares itself an update for,
+            # record the name of the updater
+            for target in item['update_for']:
+                target = normalize_update_target(target)
+                if target not in updates_table:
+                    updates_table[target] = []
+                if item['name'] not in updates_table[target]:
+                    updates_table[target].append(item['name'])
+
+        # autoremove items are automatically removed if they are not in the
+        # managed_install list (either directly or indirectly via included
+        # manifests)
+        if item.get('autoremove'):
+            autoremoveitems.add(item.get('name'))
+
+    # build a list of the versions for each name, highest version first,
+    # so lookups don't have to sort (and re-parse) versions every time
+    version_table = {}
+    for name in name_table:
+        version_table[name] = sorted(
+            name_table[name].keys(), key=utils.version_key, reverse=True)
 
     pkgdb = {}
     pkgdb['named'] = name_table
+    pkgdb['versions'] = version_table
     pkgdb['receipts'] = pkgid_table
-    pkgdb['updaters'] = updaters
-    pkgdb['autoremoveitems'] = autoremoveitems
-    pkgdb['items'] = catalogitems
+    pkgdb['updates'] = updates_table
+    pkgdb['autoremoveitems'] = list(autoremoveitems)
+    pkgdb['items'] = items
 
     return pkgdb
 
 
+# keys the client doesn't need until it actually adds an item to
+# InstallInfo. When the DeferCatalogItemDetails preference is set, these are
+# not kept in memory when loading catalogs; full_pkginfo() re-reads them
+# from the catalog file when needed.
+DEFERRED_KEYS = ['description',
+                 'notes',
+                 'localized_strings',
+                 'preinstall_script',
+                 'postinstall_script',
+                 'preuninstall_script',
+                 'postuninstall_script',
+                 'uninstall_script',
+                 '_metadata']
+
+# private key recording where to find the deferred keys of an item
+DEFERRED_INFO_KEY = '_munki_deferred_keys'
+
+
+def deferred_keys():
+    """Returns the list of keys to defer when loading catalogs, which will
+    be empty unless the DeferCatalogItemDetails preference is set"""
+    if prefs.pref('DeferCatalogItemDetails'):
+        return DEFERRED_KEYS
+    return []
+
+
+# the first bytes of a binary plist
+BINARY_PLIST_HEADER = b'bplist00'
+
+
+def read_binary_catalog_items(catalogname, catalogpath, item_hashes=None):
+    """Returns the items of a catalog that is a binary plist, which
+    plistreader can't stream. The whole catalog is read at once and no keys
+    are deferred. Items aren't shared with other catalogs.
+
+    If item_hashes is a list, a key for each item is appended to it.
+
+    Raises plistreader.PlistReadError if the catalog can't be read."""
+    try:
+        catalogitems = FoundationPlist.readPlist(catalogpath)
+    except FoundationPlist.NSPropertyListSerializationException as err:
+        raise plistreader.PlistReadError(err)
+    if not isinstance(catalogitems, list):
+        raise plistreader.PlistReadError(
+            'Catalog %s is not an array' % catalogname)
+    items = []
+    for index, item in enumerate(catalogitems):
+        if not isinstance(item, dict):
+            raise plistreader.PlistReadError(
+                'Catalog item is not a dictionary: %s' % item)
+        # we don't have the raw bytes to hash, so use a key that's unique
+        # to this item
+        item_key = 'binary-%s-%s' % (catalogname, index)
+        if item_hashes is not None:
+            item_hashes.append(item_key)
+        items.append(shared_pkginfo(dict(item), item_key))
+    return items
+
+
+def stream_catalog_items(catalogname, catalogpath, item_hashes=None):
+    """Generator that yields the items of a catalog one at a time as they are
+    parsed, dropping any deferred keys. Items identical to ones already
+    loaded from another catalog are replaced by the already loaded item.
+    Binary plist catalogs are read in full by read_binary_catalog_items.
+
+    If item_hashes is a list, the content hash of each item is appended to
+    it.
+
+    Raises plistreader.PlistReadError if the catalog can't be parsed."""
+    skip_keys = deferred_keys()
+    try:
+        fileobj = open(catalogpath, 'rb')
+    except (OSError, IOError) as err:
+        raise plistreader.PlistReadError(err)
+    try:
+        if fileobj.read(len(BINARY_PLIST_HEADER)) == BINARY_PLIST_HEADER:
+            for item in read_binary_catalog_items(
+                    catalogname, catalogpath, item_hashes=item_hashes):
+                yield item
+            return
+        for (item, offset, length, skipped_keys) in plistreader.iter_array(
+                catalogpath, skip_keys=skip_keys):
+            if not isinstance(item, dict):
+                raise plistreader.PlistReadError(
+                    'Catalog item is not a dictionary: %s' % item)
+            # hash the raw bytes of the item so identical pkginfo in other
+            # catalogs can share a single object
+            fileobj.seek(offset)
+            content_hash = hashlib.sha1(fileobj.read(length)).hexdigest()
+            if item_hashes is not None:
+                item_hashes.append(content_hash)
+            if skipped_keys:
+                # kept as small as possible since every item may carry one
+                item[DEFERRED_INFO_KEY] = [catalogname, offset, length]
+            yield shared_pkginfo(item, content_hash)
+    finally:
+        fileobj.close()
+
+
+# strings longer than this are unlikely to be repeated, so aren't interned
+INTERN_MAX_LENGTH = 128
+
+
+def intern_strings(value):
+    """Replaces short strings in value (and in any dicts and lists it
+    contains) with a single shared copy of each, returning the new value.
+    Dicts and lists are updated in place."""
+    if is_a_string(value):
+        if len(value) <= INTERN_MAX_LENGTH:
+            return _STRINGS.setdefault(value, value)
+    elif isinstance(value, dict):
+        for key in list(value.keys()):
+            item = value.pop(key)
+            value[intern_strings(key)] = intern_strings(item)
+    elif isinstance(value, list):
+        for index, item in enumerate(value):
+            value[index] = intern_strings(item)
+    return value
+
+
+def shared_pkginfo(item, content_hash):
+    """Returns the already loaded pkginfo item with the same content hash
+    if there is one; otherwise interns the strings in item and records it
+    for later catalogs to share."""
+    if DEFERRED_INFO_KEY in item:
+        # not interchangeable with the same item loaded in full, or with
+        # the same item from another catalog, whose deferred details are
+        # in that catalog's file
+        content_hash = '%s-deferred-%s' % (
+            content_hash, item[DEFERRED_INFO_KEY][0])
+    if content_hash in _PKGINFO_BY_HASH:
+        return _PKGINFO_BY_HASH[content_hash]
+    item = intern_strings(item)
+    _PKGINFO_BY_HASH[content_hash] = item
+    return item
+
+
+def full_pkginfo(item):
+    """Returns item with any keys that were deferred when its catalog was
+    loaded read back in from the catalog. If nothing was deferred, returns
+    item itself; otherwise returns a new dictionary.
+
+    Raises CatalogItemDetailsError if the deferred keys can't be read back
+    in; the item must not be used without them, since they include its
+    install and uninstall scripts."""
+    deferred = item.get(DEFERRED_INFO_KEY)
+    if not deferred:
+        return item
+    (catalogname, offset, length) = deferred
+    full_item = dict(item)
+    del full_item[DEFERRED_INFO_KEY]
+    catalogpath = os.path.join(
+        prefs.pref('ManagedInstallDir'), 'catalogs', catalogname)
+    try:
+        catalog_item = plistreader.read_plist_range(
+            catalogpath, offset, length)
+    except plistreader.PlistReadError as err:
+        catalog_item = {}
+        display.display_debug1('%s', err)
+    if (not isinstance(catalog_item, dict) or
+            catalog_item.get('name') != item.get('name') or
+            catalog_item.get('version') != item.get('version')):
+        raise CatalogItemDetailsError(
+            'Could not re-read details for %s, version %s from catalog %s'
+            % (item.get('name'), item.get('version'), catalogname))
+    for key in DEFERRED_KEYS:
+        if key in catalog_item:
+            full_item[key] = catalog_item[key]
+    return full_item
+
+
 def add_package_ids(catalogitems, itemname_to_pkgid, pkgid_to_itemname):
     """Adds packageids from each catalogitem to two dictionaries.
     One maps itemnames to receipt pkgids, the other maps receipt pkgids
@@ -153,6 +345,17 @@ def split_name_and_version(some_string):
     return (some_string, '')
 
 
+def normalize_update_target(itemname):
+    """Returns the form of itemname used as a key in the table of updates.
+    'Foo--1.0' and 'Foo-1.0' refer to the same thing, so both become
+    'Foo-1.0'. Names without a version are returned unchanged."""
+    if '--' in itemname:
+        (name, vers) = split_name_and_version(itemname)
+        if vers:
+            return '%s-%s' % (name, vers)
+    return itemname
+
+
 def get_all_items_with_name(name, cataloglist):
     """Searches the catalogs in a list for all items matching a given name.
 
@@ -162,8 +365,8 @@ def get_all_items_with_name(name, cataloglist):
     """
 
     def item_version(item):
-        """Returns a MunkiLooseVersion for pkginfo item"""
-        return pkgutils.MunkiLooseVersion(item['version'])
+        """Returns a version key for pkginfo item"""
+        return utils.version_key(item['version'])
 
     itemlist = []
     # we'll throw away any included version info
@@ -176,7 +379,8 @@ def get_all_items_with_name(name, cataloglist):
             continue
         # is name in the catalog name table?
         if name in _CATALOG[catalogname]['named']:
-            versionsmatchingname = _CATALOG[catalogname]['named'][name]
+            # versions are already sorted highest version first
+            versionsmatchingname = _CATALOG[catalogname]['versions'][name]
             for vers in versionsmatchingname:
                 if vers == 'latest':
                     continue
@@ -189,8 +393,9 @@ def get_all_items_with_name(name, cataloglist):
                             name, thisitem['version'], catalogname)
                         itemlist.append(thisitem)
 
-    if itemlist:
-        # sort so latest version is first
+    if len(cataloglist) > 1 and itemlist:
+        # items from each catalog are in order; sort so latest version
+        # is first across all catalogs
         itemlist.sort(key=item_version, reverse=True)
     return itemlist
 
@@ -207,11 +412,13 @@ def get_auto_removal_items(installinfo, cataloglist):
         if catalogname in list(_CATALOG.keys()):
             autoremovalnames += _CATALOG[catalogname]['autoremoveitems']
 
-    processed_installs_names = [split_name_and_version(item)[0]
-                                for item in installinfo['processed_installs']]
+    processed_installs_names = set(
+        split_name_and_version(item)[0]
+        for item in installinfo['processed_installs'])
+    processed_uninstalls = set(installinfo['processed_uninstalls'])
     autoremovalnames = [item for item in autoremovalnames
                         if item not in processed_installs_names
-                        and item not in installinfo['processed_uninstalls']]
+                        and item not in processed_uninstalls]
     return autoremovalnames
 
 
@@ -229,16 +436,13 @@ def look_for_updates(itemname, cataloglist):
     display.display_debug1('Looking for updates for: %s', itemname)
     # get a list of catalog items that are updates for other items
     update_list = []
+    target = normalize_update_target(itemname)
     for catalogname in cataloglist:
         if catalogname not in _CATALOG:
             # in case the list refers to a non-existent catalog
             continue
 
-        updaters = _CATALOG[catalogname]['updaters']
-        # list comprehension coming up...
-        update_items = [catalogitem['name']
-                        for catalogitem in updaters
-                        if itemname in catalogitem.get('update_for', [])]
+        update_items = _CATALOG[catalogname]['updates'].get(target)
         if update_items:
             update_list.extend(update_items)
 
@@ -257,19 +461,13 @@ def look_for_updates(itemname, cataloglist):
 
 
 def look_for_updates_for_version(itemname, itemversion, cataloglist):
-    """Looks for updates for a specific version of an item. Since these
-    can appear in manifests and pkginfo as item-version or item--version
-    we have to search twice."""
+    """Looks for updates for a specific version of an item. These
+    can appear in manifests and pkginfo as item-version or item--version."""
 
+    # 'item--version' forms are normalized to 'item-version' in our
+    # table of updates, so one lookup finds both
     name_and_version = '%s-%s' % (itemname, itemversion)
-    alt_name_and_version = '%s--%s' % (itemname, itemversion)
-    update_list = look_for_updates(name_and_version, cataloglist)
-    update_list.extend(look_for_updates(alt_name_and_version, cataloglist))
-
-    # make sure the list has only unique items:
-    update_list = list(set(update_list))
-
-    return update_list
+    return look_for_updates(name_and_version, cataloglist)
 
 
 def best_version_match(vers_num, item_dict):
@@ -412,22 +610,25 @@ def analyze_installed_pkgs():
     return pkgdata
 
 
-def get_item_detail(name, cataloglist, vers='',
-                    skip_min_os_check=False, suppress_warnings=False):
-    """Searches the catalogs in list for an item matching the given name that
-    can be installed on the current hardware/OS (optionally skipping the
-    minimum OS check so we can return an item that requires a higher OS)
+def find_item_details(name, vers, cataloglist, modes):
+    """Does the actual work for get_item_detail and get_item_details. name
+    and vers must already be normalized. modes is a list of
+    skip_min_os_check values to search with; the candidate items are only
+    walked once, no matter how many modes are asked for.
 
-    If no version is supplied, but the version is appended to the name
-    ('TextWrangler--2.3.0.0.0') that version is used.
-    If no version is given at all, the latest version is assumed.
-    Returns a pkginfo item, or None.
-    """
+    Returns a dict mapping each mode to a tuple: the matching pkginfo item
+    (or None) and a list of reasons items with a matching name were
+    rejected."""
 
-    rejected_items = []
+    results = {}
+    rejected = dict((mode, []) for mode in modes)
     machine = info.getMachineFacts()
+    munki_version_key = utils.version_key(machine['munki_version'])
+    os_version_key = utils.version_key(machine['os_vers'])
+    # installable_condition results, so we evaluate each only once
+    condition_results = {}
     # condition check functions
-    def munki_version_ok(item):
+    def munki_version_ok(item, rejected_items):
         '''Returns a boolean to indicate if the current Munki version is high
         enough to install this item. If not, also adds the failure reason to
         the rejected_items list.'''
@@ -439,18 +640,17 @@ def get_item_detail(name, cataloglist, vers='',
                 item['name'], item['version'], min_munki_vers)
             display.display_debug1(
                 'Our Munki version is %s', machine['munki_version'])
-            if (pkgutils.MunkiLooseVersion(machine['munki_version'])
-                    < pkgutils.MunkiLooseVersion(min_munki_vers)):
+            if munki_version_key < utils.version_key(min_munki_vers):
                 reason = (
                     'Rejected item %s, version %s with minimum Munki version '
                     'required %s. Our Munki version is %s.'
-                    % (item['name'], item['version'],
-                       item['minimum_munki_version'], machine['munki_version']))
+                    % (item['name'], item['version'], min_munki_vers,
+                       machine['munki_version']))
                 rejected_items.append(reason)
                 return False
         return True
 
-    def os_version_ok(item, skip_min_os_check=False):
+    def os_version_ok(item, rejected_items, skip_min_os_check=False):
         '''Returns a boolean to indicate if the item is ok to install under
         the current OS. If not, also adds the failure reason to the
         rejected_items list. If skip_min_os_check is True, skips the minimum os
@@ -464,8 +664,7 @@ def get_item_detail(name, cataloglist, vers='',
                 item['name'], item['version'], min_os_vers)
             display.display_debug1(
                 'Our OS version is %s', machine['os_vers'])
-            if (pkgutils.MunkiLooseVersion(machine['os_vers']) <
-                    pkgutils.MunkiLooseVersion(min_os_vers)):
+            if os_version_key < utils.version_key(min_os_vers):
                 # skip this one, go to the next
                 reason = (
                     'Rejected item %s, version %s with minimum os version '
@@ -484,8 +683,7 @@ def get_item_detail(name, cataloglist, vers='',
                 item['name'], item['version'], max_os_vers)
             display.display_debug1(
                 'Our OS version is %s', machine['os_vers'])
-            if (pkgutils.MunkiLooseVersion(machine['os_vers']) >
-                    pkgutils.MunkiLooseVersion(max_os_vers)):
+            if os_version_key > utils.version_key(max_os_vers):
                 # skip this one, go to the next
                 reason = (
                     'Rejected item %s, version %s with maximum os version '
@@ -496,7 +694,7 @@ def get_item_detail(name, cataloglist, vers='',
                 return False
         return True
 
-    def cpu_arch_ok(item):
+    def cpu_arch_ok(item, rejected_items):
         '''Returns a boolean to indicate if the item is ok to install under
         the current CPU architecture. If not, also adds the failure reason to
         the rejected_items list.'''
@@ -526,14 +724,17 @@ def get_item_detail(name, cataloglist, vers='',
             return False
         return True
 
-    def installable_condition_ok(item):
+    def installable_condition_ok(item, rejected_items):
         '''Returns a boolean to indicate if an installable_condition predicate
         in the current item passes. If not, also adds the failure reason to
         the rejected_items list.'''
 
         if item.get('installable_condition'):
-            if not info.predicate_evaluates_as_true(
-                    item['installable_condition']):
+            condition = item['installable_condition']
+            if condition not in condition_results:
+                condition_results[condition] = (
+                    info.predicate_evaluates_as_true(condition))
+            if not condition_results[condition]:
                 rejected_items.append(
                     'Rejected item %s, version %s with installable_condition: '
                     '%s.' % (item['name'], item['version'],
@@ -541,34 +742,14 @@ def get_item_detail(name, cataloglist, vers='',
                 return False
         return True
 
-    if vers == 'apple_update_metadata':
-        vers = 'latest'
-    else:
-        (name, includedversion) = split_name_and_version(name)
-        if includedversion and vers == '':
-            vers = includedversion
-        if vers:
-            vers = pkgutils.trim_version_string(vers)
-        else:
-            vers = 'latest'
-
-    if skip_min_os_check:
-        display.display_debug1(
-            'Looking for detail for: %s, version %s, '
-            'ignoring minimum_os_version...', name, vers)
-    else:
-        display.display_debug1(
-            'Looking for detail for: %s, version %s...', name, vers)
-
     for catalogname in cataloglist:
         # is name in the catalog?
         if catalogname in _CATALOG and name in _CATALOG[catalogname]['named']:
             itemsmatchingname = _CATALOG[catalogname]['named'][name]
             indexlist = []
             if vers == 'latest':
-                # order all our items, highest version first
-                versionlist = list(itemsmatchingname.keys())
-                versionlist.sort(key=pkgutils.MunkiLooseVersion, reverse=True)
+                # our items are already ordered highest version first
+                versionlist = _CATALOG[catalogname]['versions'][name]
                 for versionkey in versionlist:
                     indexlist.extend(itemsmatchingname[versionkey])
             elif vers in list(itemsmatchingname.keys()):
@@ -584,28 +765,266 @@ def get_item_detail(name, cataloglist, vers='',
                 # version first, looking for first one that passes all the
                 # conditional tests (if any)
                 item = _CATALOG[catalogname]['items'][index]
-                if (munki_version_ok(item) and
-                        os_version_ok(item,
-                                      skip_min_os_check=skip_min_os_check) and
-                        cpu_arch_ok(item) and
-                        installable_condition_ok(item)):
-                    display.display_debug1(
-                        'Found %s, version %s in catalog %s',
-                        item['name'], item['version'], catalogname)
-                    return item
-
-    # if we got this far, we didn't find it.
+                for mode in modes:
+                    if mode in results:
+                        continue
+                    rejected_items = rejected[mode]
+                    if (munki_version_ok(item, rejected_items) and
+                            os_version_ok(item, rejected_items,
+                                          skip_min_os_check=mode) and
+                            cpu_arch_ok(item, rejected_items) and
+                            installable_condition_ok(item, rejected_items)):
+                        display.display_debug1(
+                            'Found %s, version %s in catalog %s',
+                            item['name'], item['version'], catalogname)
+                        results[mode] = (item, rejected_items)
+                if len(results) == len(modes):
+                    return results
+
+    # if we got this far, we didn't find some of them
+    for mode in modes:
+        if mode not in results:
+            results[mode] = (None, rejected[mode])
+    return results
+
+
+def normalize_name_and_version(name, vers):
+    """Splits any version off name and normalizes vers the way
+    get_item_detail expects. Returns a tuple of name and version."""
+    if vers == 'apple_update_metadata':
+        vers = 'latest'
+    else:
+        (name, includedversion) = split_name_and_version(name)
+        if includedversion and vers == '':
+            vers = includedversion
+        if vers:
+            vers = pkgutils.trim_version_string(vers)
+        else:
+            vers = 'latest'
+    return (name, vers)
+
+
+def cached_item_details(name, vers, cataloglist, modes):
+    """Returns cached results of find_item_details for each of the
+    skip_min_os_check values in modes, looking up any we don't have yet in
+    a single search."""
+    cache_keys = [(name, vers, tuple(cataloglist), mode) for mode in modes]
+    missing = []
+    for cache_key in cache_keys:
+        if cache_key in _ITEM_DETAIL_CACHE:
+            reports.increment_counter('ItemDetailCacheHits')
+        else:
+            reports.increment_counter('ItemDetailCacheMisses')
+            missing.append(cache_key[-1])
+    if missing:
+        results = find_item_details(name, vers, cataloglist, missing)
+        for mode in missing:
+            (item, rejected_items) = results[mode]
+            _ITEM_DETAIL_CACHE[(name, vers, tuple(cataloglist), mode)] = {
+                'item': item,
+                'rejected_items': rejected_items,
+                'warned': False}
+    return [_ITEM_DETAIL_CACHE[cache_key] for cache_key in cache_keys]
+
+
+def reported_item(detail, suppress_warnings=False):
+    """Returns the item from a cached detail entry, logging why items were
+    rejected if nothing was found"""
+    if detail['item']:
+        return detail['item']
+
     display.display_debug1('Not found')
-    for reason in rejected_items:
-        if suppress_warnings:
+    for reason in detail['rejected_items']:
+        if suppress_warnings or detail['warned']:
+            # don't repeat the same warnings for every lookup
             display.display_debug1(reason)
         else:
             display.display_warning(reason)
+    if not suppress_warnings:
+        detail['warned'] = True
     return None
 
 
+def get_item_detail(name, cataloglist, vers='',
+                    skip_min_os_check=False, suppress_warnings=False):
+    """Searches the catalogs in list for an item matching the given name that
+    can be installed on the current hardware/OS (optionally skipping the
+    minimum OS check so we can return an item that requires a higher OS)
+
+    If no version is supplied, but the version is appended to the name
+    ('TextWrangler--2.3.0.0.0') that version is used.
+    If no version is given at all, the latest version is assumed.
+    Returns a pkginfo item, or None.
+
+    Results are cached for the rest of the update check session, so
+    repeated lookups of the same item are cheap.
+    """
+    (name, vers) = normalize_name_and_version(name, vers)
+
+    if skip_min_os_check:
+        display.display_debug1(
+            'Looking for detail for: %s, version %s, '
+            'ignoring minimum_os_version...', name, vers)
+    else:
+        display.display_debug1(
+            'Looking for detail for: %s, version %s...', name, vers)
+
+    detail = cached_item_details(
+        name, vers, cataloglist, [skip_min_os_check])[0]
+    return reported_item(detail, suppress_warnings=suppress_warnings)
+
+
+def get_item_details(name, cataloglist, vers='', suppress_warnings=False):
+    """Like get_item_detail, but searches the catalogs just once for both
+    the item that can be installed on the current hardware/OS and the item
+    that could be installed ignoring minimum_os_version (which may be a
+    newer item that requires a higher OS).
+
+    Returns a tuple of two pkginfo items; either may be None.
+    """
+    (name, vers) = normalize_name_and_version(name, vers)
+
+    display.display_debug1(
+        'Looking for detail for: %s, version %s, with and without '
+        'minimum_os_version...', name, vers)
+
+    (detail, detail_ignoring_min_os) = cached_item_details(
+        name, vers, cataloglist, [False, True])
+    return (reported_item(detail, suppress_warnings=suppress_warnings),
+            reported_item(detail_ignoring_min_os,
+                          suppress_warnings=suppress_warnings))
+
+
+def clear_item_detail_cache():
+    """Clears cached results of get_item_detail. Called at the start of each
+    update check session, and whenever we load a new catalog."""
+    _ITEM_DETAIL_CACHE.clear()
+
+
+def clear_shared_items():
+    """Clears the tables of pkginfo items and strings shared between the
+    catalogs we load, so they don't keep every item we've ever seen.
+    Called at the start of each update check session."""
+    _PKGINFO_BY_HASH.clear()
+    _STRINGS.clear()
+
+
+# bump this whenever the structure built by make_catalog_db changes so
+# previously saved catalog indexes are ignored
+CATALOG_INDEX_FORMAT = 6
+CATALOG_INDEX_KEYS = [
+    'named', 'versions', 'receipts', 'updates', 'autoremoveitems', 'items',
+    'hashes']
+
+
+def catalog_index_dir():
+    """Returns the path to the directory holding our compiled catalog
+    indexes"""
+    return os.path.join(prefs.pref('ManagedInstallDir'), 'catalog_index')
+
+
+def get_catalog_hash(catalogpath):
+    """Returns the SHA-256 hash of the catalog file at catalogpath, using
+    the cached checksum stored as an extended attribute if we have one"""
+    catalog_hash = fetch.getxattr(catalogpath, fetch.XATTR_SHA)
+    if catalog_hash:
+        # make sure it's a string and not a bytearray
+        return catalog_hash.decode('UTF-8')
+    return fetch.writeCachedChecksum(catalogpath)
+
+
+def load_catalog_index(catalogname, catalog_hash):
+    """Returns a previously compiled catalog db for catalogname if it was
+    built from a catalog with the same hash, None otherwise"""
+    indexpath = os.path.join(catalog_index_dir(), catalogname)
+    if not os.path.exists(indexpath):
+        return None
+    try:
+        index = FoundationPlist.readPlist(indexpath)
+    except FoundationPlist.NSPropertyListSerializationException:
+        display.display_debug1(
+            'Compiled index for catalog %s is invalid.', catalogname)
+        return None
+    if (index.get('format') != CATALOG_INDEX_FORMAT or
+            index.get('catalog_sha256') != catalog_hash or
+            index.get('deferred_keys') != deferred_keys()):
+        display.display_debug1(
+            'Compiled index for catalog %s is out of date.', catalogname)
+        return None
+    display.display_debug1('Using compiled index for catalog %s', catalogname)
+    pkgdb = {}
+    for key in CATALOG_INDEX_KEYS:
+        pkgdb[key] = index[key]
+    # share items with catalogs we've already loaded
+    pkgdb['items'] = [
+        shared_pkginfo(item, content_hash)
+        for item, content_hash in zip(pkgdb['items'], pkgdb['hashes'])]
+    return pkgdb
+
+
+def save_catalog_index(catalogname, catalog_hash, pkgdb):
+    """Saves a compiled catalog db as a binary plist so we can skip parsing
+    the catalog and rebuilding its indexes while the catalog is unchanged"""
+    indexpath = os.path.join(catalog_index_dir(), catalogname)
+    index = {}
+    index['format'] = CATALOG_INDEX_FORMAT
+    index['catalog_sha256'] = catalog_hash
+    index['deferred_keys'] = deferred_keys()
+    for key in CATALOG_INDEX_KEYS:
+        index[key] = pkgdb[key]
+    try:
+        if not os.path.isdir(os.path.dirname(indexpath)):
+            os.makedirs(os.path.dirname(indexpath), 0o755)
+        FoundationPlist.writePlist(index, indexpath, binary=True)
+    except (OSError, FoundationPlist.FoundationPlistException) as err:
+        display.display_debug1(
+            'Could not save compiled index for catalog %s: %s',
+            catalogname, err)
+
+
 # global to hold our catalog DBs
 _CATALOG = {}
+# cached results of get_item_detail for this session
+_ITEM_DETAIL_CACHE = {}
+# pkginfo items shared between catalogs, keyed by content hash
+_PKGINFO_BY_HASH = {}
+# intern table for strings in catalog items
+_STRINGS = {}
+
+
+@reports.Timer('CatalogLoads')
+def load_catalog(catalogname, catalogpath):
+    """Loads a downloaded catalog file into our catalogs dictionary,
+    using its compiled index if it has one."""
+    catalog_hash = get_catalog_hash(catalogpath)
+    pkgdb = None
+    if catalog_hash:
+        pkgdb = load_catalog_index(catalogname, catalog_hash)
+    if pkgdb is not None:
+        reports.increment_counter('CatalogIndexLoads')
+    else:
+        reports.increment_counter('CatalogParses')
+        item_hashes = []
+        try:
+            pkgdb = make_catalog_db(stream_catalog_items(
+                catalogname, catalogpath, item_hashes=item_hashes))
+        except plistreader.PlistReadError as err:
+            display.display_error(
+                'Retrieved catalog %s is invalid.', catalogname)
+            display.display_debug1('%s', err)
+            try:
+                os.unlink(catalogpath)
+            except (OSError, IOError):
+                pass
+            return
+        pkgdb['hashes'] = item_hashes
+        if catalog_hash:
+            save_catalog_index(catalogname, catalog_hash, pkgdb)
+    _CATALOG[catalogname] = pkgdb
+    # lookups made without this catalog may now have other answers
+    clear_item_detail_cache()
+
+
 def get_catalogs(cataloglist):
     """Retrieves the catalogs from the server and populates our catalogs
     dictionary.
@@ -615,17 +1034,7 @@ def get_catalogs(cataloglist):
         if not catalogname in _CATALOG:
             catalogpath = download.download_catalog(catalogname)
             if catalogpath:
-                try:
-                    catalogdata = FoundationPlist.readPlist(catalogpath)
-                except FoundationPlist.NSPropertyListSerializationException:
-                    display.display_error(
-                        'Retrieved catalog %s is invalid.', catalogname)
-                    try:
-                        os.unlink(catalogpath)
-                    except (OSError, IOError):
-                        pass
-                else:
-                    _CATALOG[catalogname] = make_catalog_db(catalogdata)
+                load_catalog(catalogname, catalogpath)
 
 
 def clean_up():
@@ -635,6 +1044,12 @@ def clean_up():
     for item in os.listdir(catalog_dir):
         if item not in _CATALOG:
             os.unlink(os.path.join(catalog_dir, item))
+    # and any compiled indexes for those catalogs
+    index_dir = catalog_index_dir()
+    if os.path.isdir(index_dir):
+        for item in os.listdir(index_dir):
+            if item not in _CATALOG:
+                os.unlink(os.path.join(index_dir, item))
 
 
 def catalogs():
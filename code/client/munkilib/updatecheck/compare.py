@@ -23,10 +23,9 @@ Comparison/checking functions used by updatecheck
 from __future__ import absolute_import, print_function
 
 import os
-from operator import itemgetter
 
+from .. import checksumcache
 from .. import display
-from .. import munkihash
 from .. import info
 from .. import pkgutils
 from .. import utils
@@ -47,11 +46,11 @@ def compare_versions(thisvers, thatvers):
       1 if thisvers is the same as thatvers
       2 if thisvers is newer than thatvers
     """
-    if (pkgutils.MunkiLooseVersion(thisvers) <
-            pkgutils.MunkiLooseVersion(thatvers)):
+    thiskey = utils.version_key(thisvers)
+    thatkey = utils.version_key(thatvers)
+    if thiskey < thatkey:
         return VERSION_IS_LOWER
-    elif (pkgutils.MunkiLooseVersion(thisvers) ==
-          pkgutils.MunkiLooseVersion(thatvers)):
+    elif thiskey == thatkey:
         return VERSION_IS_THE_SAME
     return VERSION_IS_HIGHER
 
@@ -97,12 +96,9 @@ def compare_application_version(app):
         'Looking for application %s with bundleid: %s, version %s...' %
         (name, bundleid, versionstring))
 
-    # find installed apps that match this item by name or bundleid
-    appdata = info.filtered_app_data()
-    appinfo = [item for item in appdata
-               if (item['path'] and
-                   (item['bundleid'] == bundleid or
-                    (name and item['name'] == name)))]
+    # find installed apps that match this item by name or bundleid,
+    # highest version first
+    appinfo = info.filtered_app_index().find(bundleid, name)
 
     if not appinfo:
         # No matching apps found
@@ -110,13 +106,6 @@ def compare_application_version(app):
             '\tFound no matching applications on the startup disk.')
         return ITEM_NOT_PRESENT
 
-    # sort highest version first
-    try:
-        appinfo.sort(key=itemgetter('version'), reverse=True)
-    except KeyError:
-        # some item did not have a version key
-        pass
-
     # iterate through matching applications
     end_result = ITEM_NOT_PRESENT
     for item in appinfo:
@@ -197,7 +186,7 @@ def compare_plist_version(item):
         return ITEM_NOT_PRESENT
 
     try:
-        plist = FoundationPlist.readPlist(filepath)
+        plist = pkgutils.read_cached_plist(filepath)
     except FoundationPlist.NSPropertyListSerializationException:
         display.display_debug1('\t%s may not be a plist!', filepath)
         return ITEM_NOT_PRESENT
@@ -256,7 +245,7 @@ def filesystem_item_exists(item):
             display.display_debug2('\tExists.')
             if 'md5checksum' in item:
                 storedchecksum = item['md5checksum']
-                ondiskchecksum = munkihash.getmd5hash(filepath)
+                ondiskchecksum = checksumcache.getmd5hash(filepath)
                 display.display_debug2('Comparing checksums...')
                 if storedchecksum == ondiskchecksum:
                     display.display_debug2('Checksums match.')
@@ -296,6 +285,8 @@ def compare_item_version(item):
         # Ensure that 'VersionString', if not present, is populated
         # with the value of 'CFBundleShortVersionString' if present
         item['VersionString'] = item['CFBundleShortVersionString']
+    if item.get('path'):
+        _COMPARED_PATHS.add(item['path'])
     itemtype = item.get('type')
     if itemtype == 'application':
         return compare_application_version(item)
@@ -383,27 +374,17 @@ def get_installed_version(item_plist):
                     # check default location for app
                     filepath = os.path.join(install_item['path'],
                                             'Contents', 'Info.plist')
-                    plist = FoundationPlist.readPlist(filepath)
+                    plist = pkgutils.read_cached_plist(filepath)
                     return plist.get('CFBundleShortVersionString', 'UNKNOWN')
                 except (KeyError,
                         FoundationPlist.NSPropertyListSerializationException):
-                    # that didn't work, fall through to the slow way
-                    appinfo = []
-                    appdata = info.app_data()
-                    if appdata:
-                        for ad_item in appdata:
-                            if bundleid and ad_item['bundleid'] == bundleid:
-                                appinfo.append(ad_item)
-                            elif name and ad_item['name'] == name:
-                                appinfo.append(ad_item)
-
+                    # that didn't work, look for the app by bundleid or
+                    # name; matches are sorted highest version first
+                    appinfo = info.app_index().find(bundleid, name)
                     maxversion = '0.0.0.0.0'
-                    for ai_item in appinfo:
-                        if ('version' in ai_item and
-                                compare_versions(
-                                    ai_item['version'], maxversion) == 2):
-                            # version is higher
-                            maxversion = ai_item['version']
+                    if appinfo and compare_versions(
+                            appinfo[0]['version'], maxversion) == 2:
+                        maxversion = appinfo[0]['version']
                     return maxversion
             elif install_item['type'] == 'bundle':
                 display.display_debug2(
@@ -412,7 +393,7 @@ def get_installed_version(item_plist):
                 filepath = os.path.join(install_item['path'],
                                         'Contents', 'Info.plist')
                 try:
-                    plist = FoundationPlist.readPlist(filepath)
+                    plist = pkgutils.read_cached_plist(filepath)
                     return plist.get('CFBundleShortVersionString', 'UNKNOWN')
                 except FoundationPlist.NSPropertyListSerializationException:
                     pass
@@ -421,7 +402,7 @@ def get_installed_version(item_plist):
                     'Using plist %s to determine installed version of %s',
                     install_item['path'], item_plist['name'])
                 try:
-                    plist = FoundationPlist.readPlist(install_item['path'])
+                    plist = pkgutils.read_cached_plist(install_item['path'])
                     return plist.get('CFBundleShortVersionString', 'UNKNOWN')
                 except FoundationPlist.NSPropertyListSerializationException:
                     pass
@@ -429,5 +410,20 @@ def get_installed_version(item_plist):
     return 'UNKNOWN'
 
 
+def compared_paths():
+    '''Returns the paths of the installs items compared this session'''
+    return sorted(_COMPARED_PATHS)
+
+
+def clear_compared_paths():
+    '''Forgets the installs item paths compared so far'''
+    _COMPARED_PATHS.clear()
+
+
+# module globals
+# paths of installs items we've compared against the startup disk
+_COMPARED_PATHS = set()
+
+
 if __name__ == '__main__':
     print('This is a library of support tools for the Munki Suite.')
@@ -28,16 +28,23 @@ import os
 from . import analyze
 from . import autoconfig
 from . import catalogs
+from . import compare
+from . import depgraph
 from . import download
+from . import fingerprint
+from . import installationstate
 from . import licensing
 from . import manifestutils
+from . import prefetch
 
+from .. import checksumcache
 from .. import display
 from .. import info
 from .. import keychain
 from .. import munkilog
 from .. import munkistatus
 from .. import osutils
+from .. import pkgutils
 from .. import powermgr
 from .. import prefs
 from .. import processes
@@ -50,6 +57,13 @@ class UpdateCheckAbortedError(Exception):
     pass
 
 
+class UpdateCheckUnchangedError(Exception):
+    '''Exception used to skip the analysis when nothing it depends on has
+    changed since the last full check'''
+    pass
+
+
+@reports.Timer('UpdateCheck')
 def check(client_id='', localmanifestpath=None):
     """Checks for available new or updated managed software, downloading
     installer items if needed. Returns 1 if there are available updates,
@@ -72,6 +86,16 @@ def check(client_id='', localmanifestpath=None):
     munkistatus.percent('-1')
     munkistatus.detail('')
 
+    # start each session with fresh item lookups and manifests
+    reports.start_trace()
+    catalogs.clear_item_detail_cache()
+    catalogs.clear_shared_items()
+    analyze.clear_resolved_manifests()
+    compare.clear_compared_paths()
+    pkgutils.clear_plist_cache()
+    checksumcache.close_cache()
+    installationstate.clear_installed_states()
+
     installinfo = {}
 
     try:
@@ -79,7 +103,9 @@ def check(client_id='', localmanifestpath=None):
             mainmanifestpath = localmanifestpath
         else:
             try:
-                mainmanifestpath = manifestutils.get_primary_manifest(client_id)
+                with reports.Timer('PrimaryManifest'):
+                    mainmanifestpath = manifestutils.get_primary_manifest(
+                        client_id)
             except manifestutils.ManifestException:
                 display.display_error(
                     'Could not retrieve managed install primary manifest.')
@@ -97,14 +123,35 @@ def check(client_id='', localmanifestpath=None):
             _caffeinator = powermgr.Caffeinator(
                 'Munki is checking for new software')
 
+        # retrieve included manifests and their catalogs in parallel
+        with reports.Timer('Prefetch'):
+            prefetched = prefetch.prefetch_manifests_and_catalogs(
+                mainmanifestpath)
+        if processes.stop_requested():
+            return 0
+
+        # reuse the results of the last full check if nothing they
+        # depend on has changed. License seats, icons and client resources
+        # are updated only by full checks.
+        if prefetched and not localmanifestpath:
+            state = fingerprint.previous_check_is_current()
+            if state:
+                display.display_detail(
+                    'Nothing has changed since the last full check; '
+                    'using its results.')
+                reports.report['Conditions'] = info.predicate_info_object()
+                reports.report.update(state.get('report', {}))
+                raise UpdateCheckUnchangedError()
+
         # initialize our installinfo record
-        installinfo['processed_installs'] = []
-        installinfo['processed_uninstalls'] = []
-        installinfo['managed_updates'] = []
-        installinfo['optional_installs'] = []
+        # (lists we search by name are indexed)
+        installinfo['processed_installs'] = analyze.ItemList()
+        installinfo['processed_uninstalls'] = analyze.ItemList()
+        installinfo['managed_updates'] = analyze.ItemList()
+        installinfo['optional_installs'] = analyze.ItemList()
         installinfo['featured_items'] = []
-        installinfo['managed_installs'] = []
-        installinfo['removals'] = []
+        installinfo['managed_installs'] = analyze.ItemList()
+        installinfo['removals'] = analyze.ItemList()
 
         # record info object for conditional item comparisons
         reports.report['Conditions'] = info.predicate_info_object()
@@ -338,6 +385,10 @@ def check(client_id='', localmanifestpath=None):
                 except FoundationPlist.FoundationPlistException:
                     pass
 
+        # make sure items come after the prerequisites they need
+        installinfo['managed_installs'] = analyze.ItemList(
+            depgraph.install_order(installinfo['managed_installs']))
+
         # sort startosinstall items to the end of managed_installs
         installinfo['managed_installs'].sort(
             key=lambda x: x.get('install_type') == 'startosinstall')
@@ -384,10 +435,11 @@ def check(client_id='', localmanifestpath=None):
         item_list.extend(installinfo['managed_installs'])
         item_list.extend(installinfo['removals'])
         item_list.extend(installinfo['problem_items'])
-        download.download_icons(item_list)
+        with reports.Timer('IconsAndClientResources'):
+            download.download_icons(item_list)
 
-        # get any custom client resources
-        download.download_client_resources()
+            # get any custom client resources
+            download.download_client_resources()
 
         # record the filtered lists
         reports.report['ItemsToInstall'] = installinfo['managed_installs']
@@ -462,8 +514,13 @@ def check(client_id='', localmanifestpath=None):
                 installinfo,
                 os.path.join(managed_install_dir, 'InstallInfo.plist'))
 
-    except (manifestutils.ManifestException, UpdateCheckAbortedError):
-        # Update check aborted. Check to see if we have a valid
+        # remember what this check depended on for the next one
+        if not localmanifestpath:
+            fingerprint.save()
+
+    except (manifestutils.ManifestException, UpdateCheckAbortedError,
+            UpdateCheckUnchangedError):
+        # Update check aborted or unneeded. Check to see if we have a valid
         # install/remove list from an earlier run.
         installinfopath = os.path.join(managed_install_dir, 'InstallInfo.plist')
         if os.path.exists(installinfopath):
@@ -0,0 +1,157 @@
+# encoding: utf-8
+#
+# Copyright 2009-2020 Greg Neagle.
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+updatecheck.depgraph
+
+Functions for working with the prerequisites (requires and update_for) of
+items to be installed.
+"""
+from __future__ import absolute_import, print_function
+
+from . import catalogs
+
+from .. import display
+from .. import pkgutils
+from ..wrappers import is_a_string
+
+
+def prerequisites(item):
+    '''Returns a list of the prerequisites of item: the items it requires
+    and the items it is an update for. Doesn't change item.'''
+    prereqs = []
+    for key in ('requires', 'update_for'):
+        value = item.get(key) or []
+        if is_a_string(value):
+            value = [value]
+        prereqs.extend(value)
+    return prereqs
+
+
+def _trimmed_version(item):
+    '''Returns the version_to_install of item, trimmed for comparison'''
+    return pkgutils.trim_version_string(item.get('version_to_install', '0.0'))
+
+
+class DependencyGraph(object):
+    """The prerequisite relationships between a list of installinfo items.
+    Each item depends on the items in the list matching its requires and
+    update_for entries; an entry with a version only matches that
+    version."""
+
+    def __init__(self, items):
+        self.items = list(items)
+        items_by_name = {}
+        for (index, item) in enumerate(self.items):
+            items_by_name.setdefault(item.get('name'), []).append(index)
+        # for each item, the indexes of the items it depends on
+        self.edges = []
+        for item in self.items:
+            edges = []
+            for prereq in prerequisites(item):
+                (name, version) = catalogs.split_name_and_version(prereq)
+                if version:
+                    version = pkgutils.trim_version_string(version)
+                for index in items_by_name.get(name, []):
+                    if (not version or
+                            _trimmed_version(self.items[index]) == version):
+                        edges.append(index)
+            self.edges.append(edges)
+
+    def _label(self, index):
+        '''Returns name-version for an item, for messages'''
+        item = self.items[index]
+        return '%s-%s' % (item.get('name'), item.get('version_to_install'))
+
+    def install_order(self):
+        """Returns a tuple of (ordered items, cycles). The items are
+        ordered so that every item comes after its prerequisites, otherwise
+        keeping their original order. cycles is a list of lists of
+        name-version strings for any dependency loops found; the edge that
+        closes each loop is ignored."""
+        ordered = []
+        cycles = []
+        # 0: not visited, 1: visiting, 2: done
+        state = [0] * len(self.items)
+        path = []
+
+        def visit(index):
+            '''Adds the prerequisites of an item, then the item'''
+            state[index] = 1
+            path.append(index)
+            for prereq in self.edges[index]:
+                if state[prereq] == 1:
+                    loop = path[path.index(prereq):] + [prereq]
+                    cycles.append([self._label(item) for item in loop])
+                elif state[prereq] == 0:
+                    visit(prereq)
+            path.pop()
+            state[index] = 2
+            ordered.append(self.items[index])
+
+        for index in range(len(self.items)):
+            if state[index] == 0:
+                visit(index)
+        return (ordered, cycles)
+
+
+def install_order(items):
+    '''Returns items ordered so that prerequisites come before the items
+    that need them, warning about any dependency loops'''
+    (ordered, cycles) = DependencyGraph(items).install_order()
+    for cycle in cycles:
+        display.display_warning(
+            'Circular dependency between items to install: %s',
+            ' -> '.join(cycle))
+    return ordered
+
+
+class SkippedItems(list):
+    """A list of installinfo items that were skipped or failed to install,
+    indexed by name and version so we can quickly tell which prerequisites
+    of another item were skipped."""
+
+    def __init__(self, iterable=()):
+        list.__init__(self)
+        self._versions = {}
+        self.extend(iterable)
+
+    def append(self, item):
+        list.append(self, item)
+        display.display_debug1(
+            'Adding skipped item: %s-%s', item['name'], _trimmed_version(item))
+        self._versions.setdefault(item['name'], set()).add(
+            _trimmed_version(item))
+
+    def extend(self, iterable):
+        for item in iterable:
+            self.append(item)
+
+    def skipped_prerequisites(self, item):
+        '''Returns a list of the prerequisites of item that were skipped'''
+        matched_prereqs = []
+        for prereq in prerequisites(item):
+            (name, version) = catalogs.split_name_and_version(prereq)
+            display.display_debug1(
+                'Comparing %s-%s against skipped items', name, version)
+            if name in self._versions:
+                if (not version or pkgutils.trim_version_string(version)
+                        in self._versions[name]):
+                    matched_prereqs.append(prereq)
+        return matched_prereqs
+
+
+if __name__ == '__main__':
+    print('This is a library of support tools for the Munki Suite.')
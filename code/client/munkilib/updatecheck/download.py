@@ -348,7 +348,7 @@ def download_client_resources():
                     'Could not remove stale %s: %s', resource_archive_path, err)
 
 
-def download_catalog(catalogname):
+def download_catalog(catalogname, suppress_errors=False):
     '''Attempt to download a catalog from the Munki server, Returns the path to
     the downloaded catalog file'''
     catalogbaseurl = (prefs.pref('CatalogURL') or
@@ -365,9 +365,10 @@ def download_catalog(catalogname):
         fetch.munki_resource(catalogurl, catalogpath, message=message)
         return catalogpath
     except fetch.Error as err:
-        display.display_error(
-            'Could not retrieve catalog %s from server: %s',
-            catalogname, err)
+        if not suppress_errors:
+            display.display_error(
+                'Could not retrieve catalog %s from server: %s',
+                catalogname, err)
         return None
 
 
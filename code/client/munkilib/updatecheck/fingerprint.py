@@ -0,0 +1,289 @@
+# encoding: utf-8
+#
+# Copyright 2009-2020 Greg Neagle.
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+updatecheck.fingerprint
+
+Functions for fingerprinting everything the analysis of an update check
+depends on, so a check can reuse the results of the previous one when
+nothing has changed.
+
+The fingerprint covers the manifests and catalogs retrieved for this check,
+the predicate info object (except the date), our preferences, the package
+receipts, the installs items compared during the last full check, the
+installed applications, the Cache directory and InstallInfo.plist itself.
+It can't cover state that only scripts or the OS can report, so results are
+never reused after a check that looked at items using installcheck,
+uninstallcheck or version scripts, configuration profiles or macOS
+installers. Reuse is off unless the FullUpdateCheckInterval preference is
+set to 2 or more.
+
+A check whose results are reused skips everything the analysis does,
+including updating the available license seats and retrieving icons and
+client resources; those wait for the next full check. Results are never
+reused after a check that had problem installs or failed downloads, since
+those might succeed if we tried again.
+"""
+from __future__ import absolute_import, print_function
+
+import hashlib
+import json
+import os
+import re
+
+from . import catalogs
+from . import compare
+from . import installationstate
+from . import manifestutils
+
+from .. import display
+from .. import info
+from .. import munkihash
+from .. import osutils
+from .. import prefs
+from .. import receipts
+from .. import reports
+from .. import FoundationPlist
+from ..wrappers import is_a_string, unicode_or_str
+
+
+# report keys set by the analysis, restored when we reuse its results
+REPORT_KEYS = ['InstalledItems', 'ManagedInstalls', 'ProblemInstalls',
+               'RemovedItems', 'managed_installs_list',
+               'managed_uninstalls_list', 'managed_updates_list']
+
+# preferences that can't change the results of the analysis
+IGNORED_PREFS = ['LastNotifiedDate', 'LogFile', 'LoggingLevel', 'LogToSyslog',
+                 'PerformanceTraceFile']
+
+# matches predicates that use the date
+DATE_PATTERN = re.compile(r'\bdate\b')
+
+
+def state_path():
+    '''Returns the path to the fingerprint of the last full check'''
+    return os.path.join(
+        prefs.pref('ManagedInstallDir'), 'UpdateCheckFingerprint.plist')
+
+
+def _stable(value):
+    '''Returns value converted to something json serializes the same way
+    every time'''
+    if hasattr(value, 'keys'):
+        return sorted([unicode_or_str(key), _stable(value[key])]
+                      for key in value.keys())
+    if is_a_string(value):
+        return unicode_or_str(value)
+    if hasattr(value, '__iter__'):
+        return [_stable(item) for item in value]
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    return unicode_or_str(value)
+
+
+def _stat(path):
+    '''Returns (mtime, size) for path, or None if it doesn't exist'''
+    try:
+        attrs = os.lstat(path)
+    except OSError:
+        return None
+    return [attrs.st_mtime, attrs.st_size]
+
+
+def _listing(directory):
+    '''Returns the names of the items in directory, with their
+    (mtime, size)'''
+    if not os.path.isdir(directory):
+        return None
+    return [[name, _stat(os.path.join(directory, name))]
+            for name in sorted(osutils.listdir(directory))]
+
+
+def _paths(paths):
+    '''Returns the state of paths; for bundles we also look at their
+    Info.plist, since a bundle directory's mtime rarely changes'''
+    states = []
+    for path in paths:
+        infoplist = os.path.join(path, 'Contents', 'Info.plist')
+        states.append([path, _stat(path), _stat(infoplist)])
+    return states
+
+
+def _applications():
+    '''Returns the state of the applications in /Applications'''
+    if not os.path.isdir('/Applications'):
+        return None
+    return [[name, _stat(os.path.join('/Applications', name,
+                                      'Contents', 'Info.plist'))]
+            for name in sorted(osutils.listdir('/Applications'))]
+
+
+def _predicate_info():
+    '''Returns our predicate info object, without the date'''
+    info_object = info.predicate_info_object()
+    del info_object['date']
+    return info_object
+
+
+def _conditions(manifestdata):
+    '''Yields the conditions of the conditional_items in manifestdata'''
+    for item in manifestdata.get('conditional_items', []):
+        try:
+            yield item['condition']
+        except (AttributeError, KeyError, TypeError):
+            continue
+        for condition in _conditions(item):
+            yield condition
+
+
+def conditions_use_date():
+    '''Returns True if any manifest or catalog item condition we've loaded
+    compares the date; the results of those can change with nothing else
+    changing'''
+    for path in manifestutils.manifests().values():
+        for condition in _conditions(manifestutils.get_manifest_data(path)):
+            if DATE_PATTERN.search(condition):
+                return True
+    for pkgdb in catalogs.catalogs().values():
+        for item in pkgdb['items']:
+            condition = item.get('installable_condition')
+            if condition and DATE_PATTERN.search(condition):
+                return True
+    return False
+
+
+def compute_fingerprint(paths):
+    '''Returns a fingerprint of everything the analysis depends on. paths
+    is a list of the installs item paths the analysis compared.'''
+    managed_install_dir = prefs.pref('ManagedInstallDir')
+    manifest_dir = os.path.join(managed_install_dir, 'manifests')
+    fingerprint = {}
+    fingerprint['manifests'] = [
+        [name, munkihash.getsha256hash(path)]
+        for (name, path) in sorted(manifestutils.manifests().items())]
+    fingerprint['catalogs'] = [
+        [name, catalogs.get_catalog_hash(
+            os.path.join(managed_install_dir, 'catalogs', name))]
+        for name in sorted(catalogs.catalogs())]
+    fingerprint['local_manifests'] = [
+        munkihash.getsha256hash(path) for path in (
+            '/Users/Shared/.SelfServeManifest',
+            os.path.join(manifest_dir, 'SelfServeManifest'),
+            os.path.join(manifest_dir, prefs.pref('LocalOnlyManifest') or ''))]
+    fingerprint['info'] = _predicate_info()
+    fingerprint['prefs'] = [
+        [key, prefs.pref(key)] for key in sorted(prefs.DEFAULT_PREFS)
+        if key not in IGNORED_PREFS]
+    fingerprint['receipts'] = receipts.directory_fingerprint()
+    fingerprint['paths'] = _paths(paths)
+    fingerprint['applications'] = _applications()
+    fingerprint['cache'] = _listing(
+        os.path.join(managed_install_dir, 'Cache'))
+    fingerprint['installinfo'] = munkihash.getsha256hash(
+        os.path.join(managed_install_dir, 'InstallInfo.plist'))
+    serialized = json.dumps(_stable(fingerprint), sort_keys=True)
+    return hashlib.sha256(serialized.encode('UTF-8')).hexdigest()
+
+
+def _write_state(state):
+    '''Writes our fingerprint state, which is not fatal if it fails'''
+    try:
+        FoundationPlist.writePlist(state, state_path())
+    except FoundationPlist.FoundationPlistException as err:
+        display.display_warning(
+            'Could not write %s: %s', state_path(), err)
+
+
+def forget():
+    '''Removes the fingerprint of the last full check, so the next check
+    is a full one'''
+    try:
+        os.unlink(state_path())
+    except OSError:
+        pass
+
+
+def had_problems(report):
+    '''Returns True if report has problem installs or failed downloads'''
+    return bool(report.get('ProblemInstalls') or
+                report.get('Counters', {}).get('DownloadFailures'))
+
+
+def save():
+    '''Records the fingerprint at the end of a full check, along with the
+    parts of the report we need to reuse its results'''
+    if had_problems(reports.report):
+        display.display_debug1(
+            'Some items could not be downloaded or installed; the next check '
+            'will be a full one.')
+        forget()
+        return
+    if conditions_use_date():
+        display.display_debug1(
+            'Conditions compare the date; the next check will be a full one.')
+        forget()
+        return
+    items = installationstate.script_or_os_items()
+    if items:
+        display.display_debug1(
+            'Scripts or the OS report the installed state of %s; the next '
+            'check will be a full one.', ', '.join(items))
+        forget()
+        return
+    paths = compare.compared_paths()
+    state = {}
+    state['fingerprint'] = compute_fingerprint(paths)
+    state['paths'] = paths
+    state['checks_since_full_check'] = 0
+    state['report'] = dict((key, reports.report[key])
+                           for key in REPORT_KEYS if key in reports.report)
+    _write_state(state)
+
+
+def previous_check_is_current():
+    '''Returns the saved state of the last full check if nothing its
+    analysis depends on has changed since, and we haven't reused it
+    FullUpdateCheckInterval - 1 times already. Returns None otherwise.'''
+    interval = prefs.pref('FullUpdateCheckInterval') or 0
+    if interval < 2 or not os.path.exists(state_path()):
+        return None
+    try:
+        state = FoundationPlist.readPlist(state_path())
+    except FoundationPlist.NSPropertyListSerializationException:
+        forget()
+        return None
+    if had_problems(state.get('report', {})):
+        forget()
+        return None
+    checks = state.get('checks_since_full_check', 0) + 1
+    if checks >= interval:
+        display.display_detail(
+            'Doing a full check after %s checks without one.', checks)
+        return None
+    if conditions_use_date():
+        return None
+    if compute_fingerprint(state.get('paths', [])) != state.get(
+            'fingerprint'):
+        display.display_debug1('Update check fingerprint changed.')
+        return None
+    state = dict(state)
+    state['checks_since_full_check'] = checks
+    _write_state(state)
+    reports.increment_counter('UnchangedUpdateChecks')
+    return state
+
+
+if __name__ == '__main__':
+    print('This is a library of support tools for the Munki Suite.')
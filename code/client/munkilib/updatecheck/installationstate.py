@@ -26,15 +26,48 @@ import os
 
 from . import catalogs
 from . import compare
+from . import prefetch
 
 from .. import display
+from .. import info
 from .. import osutils
+from .. import pkgutils
+from .. import prefs
 from .. import profiles
+from .. import reports
 from .. import scriptutils
 from .. import utils
 from ..wrappers import unicode_or_str
 
 
+# keys holding scripts that report an item's installed state
+STATE_SCRIPT_KEYS = ['installcheck_script', 'uninstallcheck_script',
+                     'version_script']
+
+
+def state_comes_from_scripts_or_os(item_pl):
+    '''Returns True if the installed state of item_pl is reported by a
+    script or by the OS (profiles, macOS installers) rather than by files
+    we can see'''
+    return bool(
+        any(item_pl.get(key) for key in STATE_SCRIPT_KEYS) or
+        item_pl.get('installer_type') in ('startosinstall', 'profile'))
+
+
+def _note_item(item_pl):
+    '''Remembers the names of the items we check whose installed state
+    comes from scripts or the OS'''
+    if state_comes_from_scripts_or_os(item_pl):
+        _SCRIPT_OR_OS_ITEMS.add(item_pl.get('name'))
+
+
+def script_or_os_items():
+    '''Returns the names of the items checked this session whose installed
+    state comes from scripts or the OS'''
+    return sorted(_SCRIPT_OR_OS_ITEMS)
+
+
+@reports.Timer('InstalledStateChecks')
 def installed_state(item_pl):
     """Checks to see if the item described by item_pl (or a newer version) is
     currently installed
@@ -44,6 +77,11 @@ def installed_state(item_pl):
     Returns 2 if it looks like a newer version is installed.
     Returns 0 otherwise.
     """
+    _note_item(item_pl)
+    states = _STATES.get(id(item_pl))
+    if states and states[0] is item_pl:
+        return states[1]
+
     foundnewer = False
 
     if item_pl.get('OnDemand'):
@@ -153,6 +191,11 @@ def some_version_installed(item_pl):
 
     Returns a boolean.
     """
+    _note_item(item_pl)
+    states = _STATES.get(id(item_pl))
+    if states and states[0] is item_pl:
+        return states[2]
+
     if item_pl.get('OnDemand'):
         # These should never be counted as installed
         display.display_debug1('This is an OnDemand item.')
@@ -222,6 +265,7 @@ def evidence_this_is_installed(item_pl):
 
     Returns a boolean.
     """
+    _note_item(item_pl)
     if item_pl.get('OnDemand'):
         # These should never be counted as installed
         display.display_debug1('This is an OnDemand item.')
@@ -294,5 +338,76 @@ def evidence_this_is_installed(item_pl):
     return False
 
 
+def can_check_concurrently(item_pl):
+    '''Returns True if the installed state of item_pl depends only on its
+    installs items or receipts, so it can be checked on a worker thread.
+    Scripts, profiles and OS installers are checked as we come to them.'''
+    return bool(
+        not item_pl.get('OnDemand') and
+        not item_pl.get('installcheck_script') and
+        item_pl.get('installer_type') not in ('startosinstall', 'profile') and
+        (item_pl.get('installs') or item_pl.get('receipts')))
+
+
+def _check_states(item_pl):
+    '''Returns a tuple of (item_pl, installed_state, some_version_installed)
+    for item_pl'''
+    return (item_pl, installed_state(item_pl), some_version_installed(item_pl))
+
+
+def check_installed_states(item_pls):
+    """Checks the installed state of a list of pkginfo items concurrently,
+    using a pool of InstalledStateWorkers threads, so that later calls to
+    installed_state and some_version_installed for the same items return
+    the results at once. Items we can't check concurrently, and None
+    entries, are ignored."""
+    workers = prefs.pref('InstalledStateWorkers') or 0
+    if workers < 2:
+        return
+    items = []
+    for item_pl in item_pls:
+        if (item_pl and id(item_pl) not in _STATES and
+                can_check_concurrently(item_pl)):
+            # mark it so we don't add it twice
+            _STATES[id(item_pl)] = None
+            items.append(item_pl)
+    if not items:
+        return
+    display.display_debug1(
+        'Checking installed state of %s items with %s workers...',
+        len(items), workers)
+
+    # build the shared caches the checks use before the workers need them
+    installs = [install_item for item_pl in items
+                for install_item in item_pl.get('installs') or []]
+    if any(item_pl.get('receipts') and not item_pl.get('installs')
+           for item_pl in items):
+        pkgutils.getInstalledPackages()
+    if any(install_item.get('type') == 'application' and
+           'path' not in install_item for install_item in installs):
+        info.filtered_app_index()
+
+    for states in prefetch.run_jobs(
+            [(_check_states, item_pl) for item_pl in items], workers):
+        if states:
+            _STATES[id(states[0])] = states
+
+
+def clear_installed_states():
+    '''Forgets the results of check_installed_states, and which items
+    we've checked'''
+    _STATES.clear()
+    _SCRIPT_OR_OS_ITEMS.clear()
+
+
+# module globals
+# results of check_installed_states: tuples of (item_pl, installed_state,
+# some_version_installed) keyed by id(item_pl)
+_STATES = {}
+# names of items checked this session whose state comes from scripts or the
+# OS; see script_or_os_items()
+_SCRIPT_OR_OS_ITEMS = set()
+
+
 if __name__ == '__main__':
     print('This is a library of support tools for the Munki Suite.')
@@ -75,6 +75,14 @@ def set_manifest(name, path):
     _MANIFESTS[name] = path
 
 
+def manifest_local_path(manifest_name):
+    '''Returns the path we store the manifest named manifest_name at'''
+    manifest_dir = os.path.join(prefs.pref('ManagedInstallDir'),
+                                'manifests')
+    return os.path.normpath(
+        os.path.join(manifest_dir, manifest_name.lstrip('/')))
+
+
 def get_manifest(manifest_name, suppress_errors=False):
     """Gets a manifest from the server.
 
@@ -92,15 +100,12 @@ def get_manifest(manifest_name, suppress_errors=False):
     if (not manifestbaseurl.endswith('?') and
             not manifestbaseurl.endswith('/')):
         manifestbaseurl = manifestbaseurl + '/'
-    manifest_dir = os.path.join(prefs.pref('ManagedInstallDir'),
-                                'manifests')
-
     manifesturl = (
         manifestbaseurl + quote(manifest_name.encode('UTF-8')))
 
     display.display_debug2('Manifest base URL is: %s', manifestbaseurl)
     display.display_detail('Getting manifest %s...', manifest_name)
-    manifestpath = os.path.join(manifest_dir, manifest_name.lstrip('/'))
+    manifestpath = manifest_local_path(manifest_name)
 
     # Create the folder the manifest shall be stored in
     destinationdir = os.path.dirname(manifestpath)
@@ -131,7 +136,7 @@ def get_manifest(manifest_name, suppress_errors=False):
 
     try:
         # read plist to see if it is valid
-        dummy_data = FoundationPlist.readPlist(manifestpath)
+        manifest_data = FoundationPlist.readPlist(manifestpath)
     except FoundationPlist.NSPropertyListSerializationException:
         errormsg = 'manifest returned for %s is invalid.' % manifest_name
         display.display_error(errormsg)
@@ -141,7 +146,8 @@ def get_manifest(manifest_name, suppress_errors=False):
             pass
         raise ManifestInvalidException(errormsg)
     else:
-        # plist is valid
+        # plist is valid; keep the parsed data for get_manifest_data
+        cache_manifest_data(manifestpath, manifest_data)
         display.display_detail('Retrieved manifest %s', manifest_name)
         _MANIFESTS[manifest_name] = manifestpath
         return manifestpath
@@ -248,9 +254,38 @@ def clean_up_manifests():
                 pass
 
 
+def manifest_file_signature(manifestpath):
+    '''Returns a tuple that changes whenever the manifest file is modified
+    or replaced, or None if we can't stat the file. The mtime is in
+    nanoseconds where we can get it.'''
+    try:
+        stat = os.stat(manifestpath)
+    except OSError:
+        return None
+    return (getattr(stat, 'st_mtime_ns', stat.st_mtime),
+            stat.st_size, stat.st_ino)
+
+
+def cache_manifest_data(manifestpath, plist, signature=None):
+    '''Remembers the parsed data for a manifest file'''
+    signature = signature or manifest_file_signature(manifestpath)
+    if signature:
+        _MANIFEST_DATA[manifestpath] = (signature, plist)
+
+
 def get_manifest_data(manifestpath):
-    '''Reads a manifest file, returns a dictionary-like object.'''
+    '''Reads a manifest file, returns a dictionary-like object.
+
+    Parsed manifests are cached; the same object is returned until the file
+    changes on disk, so callers must not modify it.'''
+    signature = manifest_file_signature(manifestpath)
+    if signature and manifestpath in _MANIFEST_DATA:
+        (cached_signature, plist) = _MANIFEST_DATA[manifestpath]
+        if cached_signature == signature:
+            reports.increment_counter('ManifestParsesSaved')
+            return plist
     plist = {}
+    reports.increment_counter('ManifestParses')
     try:
         plist = FoundationPlist.readPlist(manifestpath)
     except FoundationPlist.NSPropertyListSerializationException:
@@ -262,6 +297,8 @@ def get_manifest_data(manifestpath):
                 display.display_error(u'Failed to delete plist: %s', err)
         else:
             display.display_error('plist does not exist.')
+    else:
+        cache_manifest_data(manifestpath, plist, signature)
     return plist
 
 
@@ -324,6 +361,8 @@ def remove_from_selfserve_uninstalls(itemname):
 
 # module globals
 _MANIFESTS = {}
+# parsed manifests, keyed by path: (file signature, manifest data)
+_MANIFEST_DATA = {}
 
 if __name__ == '__main__':
     print('This is a library of support tools for the Munki Suite.')
@@ -0,0 +1,184 @@
+# encoding: utf-8
+#
+# Copyright 2009-2020 Greg Neagle.
+#
+# Licensed under the Apache License, Version 2.0 (the 'License');
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an 'AS IS' BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""
+updatecheck.prefetch
+
+Functions for retrieving the manifests and catalogs an update check will
+need in parallel, before the manifests are processed.
+
+Anything that can't be retrieved here is simply left alone; it will be
+retrieved (and any errors reported) when the manifests are processed.
+"""
+from __future__ import absolute_import, print_function
+
+import threading
+
+try:
+    # Python 2
+    import Queue as queue
+except ImportError:
+    # Python 3
+    import queue
+
+from . import catalogs
+from . import download
+from . import manifestutils
+
+from .. import display
+from .. import info
+from .. import prefs
+from .. import processes
+
+
+def run_jobs(jobs, workers):
+    '''Calls function(argument) for each (function, argument) tuple in jobs,
+    using up to workers threads. Returns a list of the results, in the same
+    order as jobs. If any job raises an exception, the jobs not yet started
+    are skipped and the exception is raised again in the calling thread.'''
+    results = [None] * len(jobs)
+    if workers < 2 or len(jobs) < 2:
+        for index, (function, argument) in enumerate(jobs):
+            results[index] = function(argument)
+        return results
+
+    job_queue = queue.Queue()
+    for index, job in enumerate(jobs):
+        job_queue.put((index, job))
+    errors = []
+
+    def worker():
+        '''Runs jobs until there are none left, or one has failed'''
+        while not errors:
+            try:
+                index, (function, argument) = job_queue.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                results[index] = function(argument)
+            # pylint: disable=broad-except
+            except Exception as err:
+                errors.append((index, err))
+            # pylint: enable=broad-except
+
+    threads = [threading.Thread(target=worker)
+               for dummy_i in range(min(workers, len(jobs)))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        # the failure of the earliest job, as if we'd run them in order
+        raise min(errors, key=lambda error: error[0])[1]
+    return results
+
+
+def fetch_manifest(manifest_name):
+    '''Retrieves a manifest, returning its local path or None'''
+    try:
+        return manifestutils.get_manifest(
+            manifest_name, suppress_errors=True)
+    except manifestutils.ManifestException:
+        return None
+
+
+def fetch_catalog(catalogname):
+    '''Retrieves a catalog, returning its local path or None'''
+    return download.download_catalog(catalogname, suppress_errors=True)
+
+
+def find_references(manifestdata, parentcatalogs, includes, cataloglists):
+    '''Adds (manifest name, catalog list) tuples for the manifests
+    manifestdata includes to includes, and the catalog lists it uses to
+    cataloglists. Conditional items are followed only if their conditions
+    are true.'''
+    cataloglist = manifestdata.get('catalogs') or parentcatalogs
+    if not cataloglist:
+        # resolving this manifest will report the problem
+        return
+    cataloglists.append(cataloglist)
+    for item in manifestdata.get('included_manifests', []):
+        if item:
+            includes.append((item, cataloglist))
+    for item in manifestdata.get('conditional_items', []):
+        try:
+            predicate = item['condition']
+        except (AttributeError, KeyError, TypeError):
+            continue
+        if info.predicate_evaluates_as_true(
+                predicate, additional_info={'catalogs': cataloglist}):
+            find_references(item, cataloglist, includes, cataloglists)
+
+
+def prefetch_manifests_and_catalogs(mainmanifestpath):
+    """Walks the included_manifests of mainmanifestpath breadth-first,
+    retrieving each level of manifests, and the catalogs they use, with a
+    pool of worker threads. Retrieved manifests are recorded by
+    manifestutils.get_manifest; retrieved catalogs are loaded into the
+    catalogs dictionary. Returns True if we walked all the manifests."""
+    workers = prefs.pref('ManifestPrefetchWorkers') or 0
+    if workers < 2:
+        return False
+    display.display_debug1(
+        'Prefetching manifests and catalogs with %s workers...', workers)
+    seen_manifests = set()
+    seen_catalogs = set(catalogs.catalogs())
+    level = [(mainmanifestpath, None)]
+    while level:
+        if processes.stop_requested():
+            return False
+        includes = []
+        cataloglists = []
+        for (manifestpath, parentcatalogs) in level:
+            find_references(
+                manifestutils.get_manifest_data(manifestpath),
+                parentcatalogs, includes, cataloglists)
+
+        jobs = []
+        next_catalogs = []
+        for (manifest_name, cataloglist) in includes:
+            # names that differ only in form, like 'site' and '/site', are
+            # the same manifest file
+            manifestpath = manifestutils.manifest_local_path(manifest_name)
+            if manifestpath not in seen_manifests:
+                seen_manifests.add(manifestpath)
+                jobs.append((fetch_manifest, manifest_name))
+                next_catalogs.append(cataloglist)
+        new_catalogs = []
+        for cataloglist in cataloglists:
+            for catalogname in cataloglist:
+                if catalogname not in seen_catalogs:
+                    seen_catalogs.add(catalogname)
+                    new_catalogs.append(catalogname)
+        jobs.extend((fetch_catalog, name) for name in new_catalogs)
+
+        results = run_jobs(jobs, workers)
+
+        # parse catalogs here, not in the worker threads
+        catalog_paths = results[len(next_catalogs):]
+        for (catalogname, catalogpath) in zip(new_catalogs, catalog_paths):
+            if catalogpath and catalogname not in catalogs.catalogs():
+                catalogs.load_catalog(catalogname, catalogpath)
+
+        level = [(manifestpath, cataloglist)
+                 for (manifestpath, cataloglist)
+                 in zip(results[:len(next_catalogs)], next_catalogs)
+                 if manifestpath]
+    return True
+
+
+if __name__ == '__main__':
+    print('This is a library of support tools for the Munki Suite.')
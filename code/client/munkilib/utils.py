@@ -25,10 +25,13 @@ Note: this module should be 100% free of ObjC-dependent Python imports.
 from __future__ import absolute_import, print_function
 
 
+import collections
 import grp
 import os
+import re
 import subprocess
 import stat
+import threading
 
 
 class Memoize(dict):
@@ -46,6 +49,75 @@ class Memoize(dict):
         return result
 
 
+# version string components are runs of digits, runs of lowercase letters
+# and periods, same as distutils' LooseVersion
+VERSION_COMPONENT_RE = re.compile(r'(\d+ | [a-z]+ | \.)', re.VERBOSE)
+
+
+def version_string(vstring):
+    """Returns vstring as a str, treating None like an empty string"""
+    # pylint: disable=unicode-builtin
+    if vstring is None:
+        return ''
+    try:
+        if isinstance(vstring, unicode):
+            # Python 2: compare UTF-8 bytes, like LooseVersion did
+            return vstring.encode('UTF-8')
+    except NameError:
+        # python 3
+        pass
+    return str(vstring)
+
+
+def version_components(vstring):
+    """Splits a version string into a list of int and string components,
+    the same way distutils' LooseVersion does"""
+    components = [x for x in VERSION_COMPONENT_RE.split(vstring)
+                  if x and x != '.']
+    for index, obj in enumerate(components):
+        try:
+            components[index] = int(obj)
+        except ValueError:
+            pass
+    return components
+
+
+def _make_version_key(vstring):
+    """Builds the sort key for version_key"""
+    # ints sort before strings
+    key = [(1, component) if isinstance(component, str) else (0, component)
+           for component in version_components(vstring)]
+    # "10.6" and "10.6.0" are the same version
+    while key and key[-1] == (0, 0):
+        key.pop()
+    return tuple(key)
+
+
+# version_key results for the most recently used version strings
+VERSION_KEY_CACHE_SIZE = 10000
+_VERSION_KEYS = collections.OrderedDict()
+_VERSION_KEYS_LOCK = threading.Lock()
+
+
+def version_key(vstring):
+    """Returns a tuple that can be compared or sorted on in place of
+    pkgutils.MunkiLooseVersion(vstring): components are compared in order,
+    integers numerically and before any strings, and missing trailing
+    components count as zeros. Keys for recently used version strings are
+    cached."""
+    vstring = version_string(vstring)
+    with _VERSION_KEYS_LOCK:
+        try:
+            key = _VERSION_KEYS.pop(vstring)
+        except KeyError:
+            key = _make_version_key(vstring)
+            if len(_VERSION_KEYS) >= VERSION_KEY_CACHE_SIZE:
+                # forget the least recently used version
+                _VERSION_KEYS.popitem(last=False)
+        _VERSION_KEYS[vstring] = key
+    return key
+
+
 class Error(Exception):
     """Class for domain specific exceptions."""
 
@@ -0,0 +1,160 @@
+#!/usr/bin/python
+# encoding: utf-8
+"""
+test_checksumcache.py
+
+Unit tests for the checksum cache module.
+
+"""
+# Copyright 2020 Greg Neagle.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import, print_function
+
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+
+from munkilib import checksumcache
+
+
+try:
+    from mock import patch
+except ImportError:
+    import sys
+    print("mock module is required. run: easy_install mock", file=sys.stderr)
+    raise
+
+
+DATA = b'package data' * 1024
+
+
+class TestChecksumCache(unittest.TestCase):
+    """Tests for the persistent MD5 checksum cache."""
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.prefs = {'ManagedInstallDir': self.tempdir,
+                      'ForceChecksumVerification': False}
+        self.counters = {}
+        self.path = os.path.join(self.tempdir, 'item.pkg')
+        self.write_item(DATA)
+        patchers = [
+            patch('munkilib.checksumcache.prefs.pref',
+                  side_effect=self.prefs.get),
+            patch('munkilib.checksumcache.reports.increment_counter',
+                  side_effect=self.increment_counter),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        checksumcache.close_cache()
+
+    def tearDown(self):
+        checksumcache.close_cache()
+        shutil.rmtree(self.tempdir)
+
+    def write_item(self, data, mtime=1600000000):
+        """Writes the fixture file, with an mtime old enough to cache"""
+        with open(self.path, 'wb') as fileobj:
+            fileobj.write(data)
+        os.utime(self.path, (mtime, mtime))
+
+    def increment_counter(self, name, amount=1):
+        """Stands in for reports.increment_counter"""
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def getmd5hash(self):
+        """Returns the checksum of the fixture file via the cache"""
+        return checksumcache.getmd5hash(self.path)
+
+    def test_cache_hit(self):
+        """The second checksum of an unchanged file comes from the cache."""
+        expected = hashlib.md5(DATA).hexdigest()
+        self.assertEqual(self.getmd5hash(), expected)
+        self.assertEqual(self.counters, {'ChecksumCacheMisses': 1})
+        self.assertEqual(self.getmd5hash(), expected)
+        self.assertEqual(self.counters, {'ChecksumCacheMisses': 1,
+                                         'ChecksumCacheHits': 1})
+
+    def test_cache_persists(self):
+        """A cached checksum survives closing and reopening the cache."""
+        self.getmd5hash()
+        checksumcache.close_cache()
+        self.getmd5hash()
+        self.assertEqual(self.counters.get('ChecksumCacheHits'), 1)
+
+    def test_signature_change_invalidates(self):
+        """A change to any of inode, size, mtime or ctime means the cached
+        checksum isn't used."""
+        signature = (100, 200, 300, 400)
+        checksumcache.cache_md5(self.path, signature, 'abc123')
+        self.assertEqual(
+            checksumcache.cached_md5(self.path, signature), 'abc123')
+        for index in range(len(signature)):
+            changed = list(signature)
+            changed[index] += 1
+            self.assertEqual(
+                checksumcache.cached_md5(self.path, tuple(changed)), None)
+
+    def test_modified_file_rehashed(self):
+        """Rewriting the file gives the new checksum, not the cached one."""
+        self.getmd5hash()
+        self.write_item(b'other data', mtime=1600000500)
+        self.assertEqual(
+            self.getmd5hash(), hashlib.md5(b'other data').hexdigest())
+        self.assertEqual(self.counters, {'ChecksumCacheMisses': 2})
+        # same size and mtime, but a new ctime
+        self.write_item(b'other DATA', mtime=1600000500)
+        self.assertEqual(
+            self.getmd5hash(), hashlib.md5(b'other DATA').hexdigest())
+
+    def test_recently_modified_not_cached(self):
+        """A file modified just now isn't cached."""
+        with open(self.path, 'wb') as fileobj:
+            fileobj.write(DATA)
+        self.getmd5hash()
+        self.getmd5hash()
+        self.assertEqual(self.counters, {'ChecksumCacheMisses': 2})
+
+    def test_force_checksum_verification(self):
+        """ForceChecksumVerification always reads the file."""
+        self.getmd5hash()
+        self.prefs['ForceChecksumVerification'] = True
+        self.assertEqual(self.getmd5hash(), hashlib.md5(DATA).hexdigest())
+        self.assertEqual(self.counters, {'ChecksumCacheMisses': 2})
+
+    def test_damaged_database_replaced(self):
+        """A damaged cache database is replaced."""
+        with open(checksumcache.cache_path(), 'wb') as fileobj:
+            fileobj.write(b'this is not a database' * 100)
+        self.assertEqual(self.getmd5hash(), hashlib.md5(DATA).hexdigest())
+        self.assertEqual(self.getmd5hash(), hashlib.md5(DATA).hexdigest())
+        self.assertEqual(self.counters, {'ChecksumCacheMisses': 1,
+                                         'ChecksumCacheHits': 1})
+
+    def test_missing_file(self):
+        """A missing file isn't cached."""
+        os.unlink(self.path)
+        self.assertEqual(self.getmd5hash(), 'NOT A FILE')
+        self.assertEqual(self.counters, {})
+
+
+def main():
+    unittest.main(buffer=True)
+
+
+if __name__ == '__main__':
+    main()
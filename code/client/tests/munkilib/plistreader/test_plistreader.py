@@ -0,0 +1,249 @@
+#!/usr/bin/python
+# encoding: utf-8
+"""
+test_plistreader.py
+
+Unit tests for the plistreader module.
+
+"""
+# Copyright 2020 Greg Neagle.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import, print_function
+
+import datetime
+import os
+import shutil
+import tempfile
+import timeit
+import unittest
+
+from munkilib import plistreader
+from munkilib import utils
+
+
+CATALOG = b'''<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE plist PUBLIC "-//Apple//DTD PLIST 1.0//EN" \
+"http://www.apple.com/DTDs/PropertyList-1.0.dtd">
+<plist version="1.0">
+<array>
+    <dict>
+        <key>name</key>
+        <string>Firefox</string>
+        <key>version</key>
+        <string>80.0</string>
+        <key>description</key>
+        <string>G\xc3\xbcnther's &lt;favorite&gt; browser</string>
+        <key>postinstall_script</key>
+        <string>#!/bin/sh
+echo done</string>
+        <key>receipts</key>
+        <array>
+            <dict>
+                <key>packageid</key>
+                <string>org.mozilla.firefox</string>
+                <key>version</key>
+                <string>80.0</string>
+            </dict>
+        </array>
+        <key>installed_size</key>
+        <integer>204800</integer>
+        <key>uninstallable</key>
+        <true/>
+        <key>force_install_after_date</key>
+        <date>2020-09-01T12:00:00Z</date>
+        <key>_metadata</key>
+        <dict>
+            <key>nested</key>
+            <dict><key>deeper</key><array><string>x</string></array></dict>
+        </dict>
+    </dict>
+    <dict>
+        <key>name</key>
+        <string>Empty</string>
+        <key>version</key>
+        <string>1.0</string>
+        <key>notes</key>
+        <string/>
+        <key>requires</key>
+        <array/>
+    </dict>
+</array>
+</plist>
+'''
+
+
+class TestPlistReader(unittest.TestCase):
+    """Test streaming and whole-file plist reading."""
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tempdir, 'catalog')
+        with open(self.path, 'wb') as fileobj:
+            fileobj.write(CATALOG)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_read_plist(self):
+        """Whole plist is read with the expected types."""
+        items = plistreader.read_plist(self.path)
+        self.assertEqual(len(items), 2)
+        self.assertEqual(items[0]['name'], u'Firefox')
+        self.assertEqual(
+            items[0]['description'], u'G\xfcnther\'s <favorite> browser')
+        self.assertEqual(items[0]['postinstall_script'],
+                         u'#!/bin/sh\necho done')
+        self.assertEqual(items[0]['installed_size'], 204800)
+        self.assertTrue(items[0]['uninstallable'] is True)
+        self.assertEqual(items[0]['force_install_after_date'],
+                         datetime.datetime(2020, 9, 1, 12, 0, 0))
+        self.assertEqual(items[0]['receipts'][0]['packageid'],
+                         u'org.mozilla.firefox')
+        self.assertEqual(items[0]['_metadata'],
+                         {'nested': {'deeper': [u'x']}})
+        self.assertEqual(items[1]['notes'], u'')
+        self.assertEqual(items[1]['requires'], [])
+
+    def test_iter_array_matches_read_plist(self):
+        """Streamed elements are the same as the whole plist."""
+        streamed = [element[0]
+                    for element in plistreader.iter_array(self.path)]
+        self.assertEqual(streamed, plistreader.read_plist(self.path))
+
+    def test_skip_keys_and_read_range(self):
+        """Skipped keys are left out and can be re-read by offset."""
+        full_items = plistreader.read_plist(self.path)
+        skip_keys = ['description', 'postinstall_script', '_metadata',
+                     'notes']
+        elements = list(plistreader.iter_array(
+            self.path, skip_keys=skip_keys))
+        for (item, offset, length, skipped), full_item in zip(
+                elements, full_items):
+            for key in skip_keys:
+                self.assertFalse(key in item)
+            self.assertEqual(sorted(skipped),
+                             sorted(set(full_item).intersection(skip_keys)))
+            self.assertEqual(
+                plistreader.read_plist_range(self.path, offset, length),
+                full_item)
+
+    def test_small_chunks(self):
+        """Elements split across parser feeds are handled."""
+        saved_chunk_size = plistreader.CHUNK_SIZE
+        plistreader.CHUNK_SIZE = 7
+        try:
+            streamed = [element[0]
+                        for element in plistreader.iter_array(self.path)]
+        finally:
+            plistreader.CHUNK_SIZE = saved_chunk_size
+        self.assertEqual(streamed, plistreader.read_plist(self.path))
+
+    def test_non_array_root(self):
+        """iter_array requires an array at the root."""
+        with open(self.path, 'wb') as fileobj:
+            fileobj.write(b'<plist><dict><key>a</key><true/></dict></plist>')
+        with self.assertRaises(plistreader.PlistReadError):
+            list(plistreader.iter_array(self.path))
+
+    def test_invalid_plist(self):
+        """Malformed XML raises PlistReadError."""
+        with open(self.path, 'wb') as fileobj:
+            fileobj.write(CATALOG[:-20])
+        with self.assertRaises(plistreader.PlistReadError):
+            list(plistreader.iter_array(self.path))
+
+
+RECEIPT = b'''<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE plist PUBLIC "-//Apple//DTD PLIST 1.0//EN" \
+"http://www.apple.com/DTDs/PropertyList-1.0.dtd">
+<plist version="1.0">
+<dict>
+	<key>install-location</key>
+	<string>/</string>
+	<key>install-time</key>
+	<integer>1600000000</integer>
+	<key>pkg-version</key>
+	<string>%d.0</string>
+	<key>pkgid</key>
+	<string>com.example.pkg%d</string>
+	<key>receipt-plist-version</key>
+	<real>1</real>
+	<key>volume</key>
+	<string>/</string>
+</dict>
+</plist>
+'''
+
+
+def receipt_stream(count):
+    """Returns synthetic `pkgutil --pkg-info-plist` output for count
+    receipts"""
+    return b''.join(RECEIPT % (index, index) for index in range(count))
+
+
+def reference_plists(data):
+    """Splits and parses data the way we used to"""
+    plists = []
+    while data:
+        (pliststr, data) = utils.getFirstPlist(data)
+        if not pliststr:
+            break
+        plists.append(plistreader.read_plist_from_string(pliststr))
+    return plists
+
+
+class TestIterPlists(unittest.TestCase):
+    """Tests for iter_plists_from_string."""
+
+    def test_matches_get_first_plist(self):
+        """Yields the same plists as repeated getFirstPlist calls."""
+        data = b'junk' + receipt_stream(3) + b'\n' + receipt_stream(2)
+        plists = list(plistreader.iter_plists_from_string(data))
+        self.assertEqual(plists, reference_plists(data))
+        self.assertEqual(len(plists), 5)
+        self.assertEqual(plists[1]['pkgid'], u'com.example.pkg1')
+        self.assertEqual(plists[1]['pkg-version'], u'1.0')
+
+    def test_incomplete_plist(self):
+        """A plist without an end is ignored."""
+        data = receipt_stream(2)
+        plists = list(plistreader.iter_plists_from_string(data[:-20]))
+        self.assertEqual(len(plists), 1)
+        self.assertEqual(list(plistreader.iter_plists_from_string(b'')), [])
+
+    def test_invalid_plist(self):
+        """A malformed plist raises PlistReadError."""
+        data = receipt_stream(1).replace(b'</dict>', b'</array>')
+        with self.assertRaises(plistreader.PlistReadError):
+            list(plistreader.iter_plists_from_string(data))
+
+
+def benchmark():
+    """Prints how long it takes to split and parse 5000 receipts with
+    getFirstPlist and with iter_plists_from_string"""
+    data = receipt_stream(5000)
+    old_time = timeit.timeit(lambda: reference_plists(data), number=1)
+    new_time = timeit.timeit(
+        lambda: list(plistreader.iter_plists_from_string(data)), number=1)
+    print('Parsing 5000 receipts: getFirstPlist %.3fs, '
+          'iter_plists_from_string %.3fs' % (old_time, new_time))
+
+
+def main():
+    unittest.main(buffer=True)
+
+
+if __name__ == '__main__':
+    benchmark()
+    main()
@@ -0,0 +1,246 @@
+#!/usr/bin/python
+# encoding: utf-8
+"""
+test_predicates.py
+
+Unit tests for predicates.compile_predicate.
+
+Each conformance case is a predicate string, as found in conditional_items
+conditions and installable_condition, and the result NSPredicate gives for
+it against INFO. Run this module directly to also print a small benchmark.
+
+"""
+# Copyright 2020 Greg Neagle.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import, print_function
+
+import datetime
+import timeit
+import unittest
+
+from munkilib import predicates
+
+
+# an info object like info.predicate_info_object() returns
+INFO = {
+    'hostname': u'Café-Mac.example.com',
+    'arch': 'x86_64',
+    'os_vers': '10.15.7',
+    'os_vers_major': 10,
+    'os_vers_minor': 15,
+    'os_vers_patch': 7,
+    'os_build_number': '19H15',
+    'os_build_last_component': 15,
+    'machine_model': 'MacBookPro16,1',
+    'machine_type': 'laptop',
+    'munki_version': '5.1.0.4000',
+    'serial_number': 'C02ABC123XYZ',
+    'ipv4_address': ['10.0.1.20', '192.168.1.4'],
+    'ipv6_address': [],
+    'x86_64_capable': True,
+    'catalogs': ['testing', 'production'],
+    'date': datetime.datetime(2020, 6, 1, 12, 0, 0),
+    'departments': [{'name': 'IT'}, {'name': 'Design'}],
+    'extra': {'enrolled': True, 'tags': ['a', 'b']},
+}
+
+CONFORMANCE = [
+    # comparisons
+    ('os_vers_minor == 15', True),
+    ('os_vers_minor = 15', True),
+    ('os_vers_minor != 15', False),
+    ('os_vers_minor <> 14', True),
+    ('os_vers_minor > 14', True),
+    ('os_vers_minor >= 15', True),
+    ('os_vers_minor => 16', False),
+    ('os_vers_minor < 15', False),
+    ('os_vers_minor <= 15', True),
+    ('os_vers_minor =< 14', False),
+    ('os_vers_patch BETWEEN {5, 7}', True),
+    ('os_vers_patch BETWEEN {8, 9}', False),
+    ('os_vers_minor == 15.0', True),
+    ('machine_type == "laptop"', True),
+    ("machine_type == 'desktop'", False),
+    ('machine_type == "LAPTOP"', False),
+    ('machine_type ==[c] "LAPTOP"', True),
+    ('arch > "i386"', True),
+    ('x86_64_capable == TRUE', True),
+    ('x86_64_capable == YES', True),
+    ('x86_64_capable == false', False),
+    ('x86_64_capable == 1', True),
+    ('os_vers_minor == "15"', False),
+    ('no_such_key == nil', True),
+    ('no_such_key == NULL', True),
+    ('machine_type != nil', True),
+    ('no_such_key == "x"', False),
+    # string operators
+    ('machine_model BEGINSWITH "MacBook"', True),
+    ('machine_model BEGINSWITH[c] "macbook"', True),
+    ('machine_model BEGINSWITH "iMac"', False),
+    ('serial_number ENDSWITH "XYZ"', True),
+    ('machine_model CONTAINS "Pro"', True),
+    ('machine_model CONTAINS[c] "pro"', True),
+    ('machine_model CONTAINS "Air"', False),
+    ('machine_model LIKE "MacBook*"', True),
+    ('machine_model LIKE "MacBookPro1?,1"', True),
+    ('machine_model LIKE "MacBook"', False),
+    ('machine_model LIKE[c] "macbook*"', True),
+    ('hostname LIKE[cd] "cafe-*"', True),
+    ('hostname LIKE "cafe-*"', False),
+    ('hostname BEGINSWITH[d] "Cafe"', True),
+    ('serial_number MATCHES "C02[A-Z0-9]{9}"', True),
+    ('serial_number MATCHES "C02"', False),
+    ('serial_number MATCHES[c] "c02.*"', True),
+    ('no_such_key BEGINSWITH "x"', False),
+    ('no_such_key CONTAINS "x"', False),
+    ('"Book" IN machine_model', True),
+    # collections
+    ('"testing" IN catalogs', True),
+    ('"development" IN catalogs', False),
+    ('"TESTING" IN[c] catalogs', True),
+    ('catalogs CONTAINS "production"', True),
+    ('machine_type IN {"laptop", "desktop"}', True),
+    ('os_vers_minor IN {13, 14}', False),
+    ('ANY ipv4_address BEGINSWITH "192.168."', True),
+    ('SOME ipv4_address == "10.0.1.20"', True),
+    ('ANY ipv4_address BEGINSWITH "172."', False),
+    ('ALL ipv4_address BEGINSWITH "1"', True),
+    ('ALL ipv4_address BEGINSWITH "10."', False),
+    ('NONE ipv4_address BEGINSWITH "172."', True),
+    ('ANY ipv6_address BEGINSWITH "fe80"', False),
+    ('ALL ipv6_address BEGINSWITH "fe80"', True),
+    ('ANY departments.name == "Design"', True),
+    ('"IT" IN departments.name', True),
+    ('extra.enrolled == TRUE', True),
+    ('"b" IN extra.tags', True),
+    ('SELF.machine_type == "laptop"', True),
+    ('catalogs == {"testing", "production"}', True),
+    # logic
+    ('os_vers_minor >= 13 AND machine_type == "laptop"', True),
+    ('os_vers_minor >= 16 AND machine_type == "laptop"', False),
+    ('os_vers_minor >= 16 OR machine_type == "laptop"', True),
+    ('os_vers_minor >= 13 && machine_type == "laptop"', True),
+    ('os_vers_minor >= 16 || machine_type == "desktop"', False),
+    ('NOT machine_type == "desktop"', True),
+    ('!(machine_type == "laptop")', False),
+    ('NOT (os_vers_minor < 13 OR os_vers_minor > 15)', True),
+    ('(os_vers_major == 10 AND os_vers_minor == 15) OR os_vers_major >= 11',
+     True),
+    ('TRUEPREDICATE', True),
+    ('FALSEPREDICATE', False),
+    ('machine_type == "laptop" and arch == "x86_64"', True),
+    # dates
+    ('date > CAST("2020-01-01T00:00:00Z", "NSDate")', True),
+    ('date < CAST("2020-01-01T00:00:00Z", "NSDate")', False),
+    ('date == CAST("2020-06-01T12:00:00Z", "NSDate")', True),
+    ('date > CAST(600000000, "NSDate")', True),
+    ('date BETWEEN {CAST("2020-05-01T00:00:00Z", "NSDate"), '
+     'CAST("2020-07-01T00:00:00Z", "NSDate")}', True),
+    # escapes
+    (r'"it\"s" == "it\"s"', True),
+    (r'"a*b" LIKE "a\\*b"', True),
+    (r'"axb" LIKE "a\\*b"', False),
+]
+
+UNSUPPORTED = [
+    'catalogs.@count > 1',
+    'os_vers_minor + 1 == 16',
+    'FUNCTION(machine_model, "length") > 3',
+    'SUBQUERY(catalogs, $x, $x == "testing").@count > 0',
+    'catalogs[FIRST] == "testing"',
+    'date > CAST("2020-01-01", "NSString")',
+    'machine_type',
+    'machine_type == ',
+    '(machine_type == "laptop"',
+]
+
+UNCOMPARABLE = [
+    'os_vers_minor > "14"',
+    'no_such_key > 5',
+    'ANY machine_type == "laptop"',
+    'ANY no_such_key == "x"',
+    'os_vers_minor BEGINSWITH "1"',
+    'date > 5',
+    'serial_number MATCHES "C02["',
+]
+
+
+class TestPredicates(unittest.TestCase):
+    """Test predicates against NSPredicate's results."""
+
+    def test_conformance(self):
+        """Predicates evaluate like NSPredicate."""
+        for (predicate_string, expected) in CONFORMANCE:
+            self.assertEqual(
+                predicates.evaluate_predicate(predicate_string, INFO),
+                expected, predicate_string)
+
+    def test_unsupported_syntax(self):
+        """Syntax we don't handle raises PredicateError when compiled."""
+        for predicate_string in UNSUPPORTED:
+            self.assertRaises(
+                predicates.PredicateError,
+                predicates.compile_predicate, predicate_string)
+
+    def test_uncomparable_values(self):
+        """Values NSPredicate wouldn't compare raise PredicateError."""
+        for predicate_string in UNCOMPARABLE:
+            self.assertRaises(
+                predicates.PredicateError,
+                predicates.evaluate_predicate, predicate_string, INFO)
+
+    def test_compiled_once(self):
+        """The same predicate string compiles to the same function."""
+        predicate_string = 'machine_type == "laptop" AND os_vers_minor > 13'
+        self.assertTrue(
+            predicates.compile_predicate(predicate_string) is
+            predicates.compile_predicate(predicate_string))
+
+    def test_date_objects(self):
+        """Date values with timeIntervalSince1970, like NSDate, work."""
+
+        class FakeNSDate(object):
+            """Stands in for an NSDate"""
+            def timeIntervalSince1970(self):
+                """2020-06-01T12:00:00Z"""
+                return 1591012800.0
+
+        self.assertTrue(predicates.evaluate_predicate(
+            'date == CAST("2020-06-01T12:00:00Z", "NSDate")',
+            {'date': FakeNSDate()}))
+
+
+def benchmark():
+    """Prints how long 10,000 evaluations of a typical condition take"""
+    predicate_string = (
+        'os_vers_minor >= 13 AND machine_type == "laptop" AND '
+        'ANY ipv4_address BEGINSWITH "192.168." AND '
+        'date > CAST("2020-01-01T00:00:00Z", "NSDate")')
+    compile_time = timeit.timeit(
+        lambda: predicates._Parser(
+            predicates.tokenize(predicate_string)).parse(), number=10000)
+    evaluate_time = timeit.timeit(
+        lambda: predicates.evaluate_predicate(predicate_string, INFO),
+        number=10000)
+    print('10000 evaluations: parsing each time %.3fs, compiled once %.3fs'
+          % (compile_time, evaluate_time))
+
+
+def main():
+    unittest.main(buffer=True)
+
+
+if __name__ == '__main__':
+    benchmark()
+    main()
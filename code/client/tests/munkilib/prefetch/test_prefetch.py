@@ -0,0 +1,216 @@
+#!/usr/bin/python
+# encoding: utf-8
+"""
+test_prefetch.py
+
+Unit tests for updatecheck.prefetch.
+
+"""
+# Copyright 2020 Greg Neagle.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import, print_function
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+try:
+    # Python 2
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    # Python 3
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+
+from munkilib import prefs
+from munkilib import wrappers
+from munkilib.updatecheck import prefetch
+
+
+try:
+    from mock import patch
+except ImportError:
+    import sys
+    print("mock module is required. run: easy_install mock", file=sys.stderr)
+    raise
+
+
+MANIFESTS = {
+    'site_default': {'catalogs': ['production'],
+                     'included_manifests': ['site', '/site', 'common']},
+    'site': {'included_manifests': ['common', 'apps']},
+    'common': {'catalogs': ['testing', 'production']},
+    'apps': {},
+}
+
+CATALOGS = ['production', 'testing']
+
+
+class RepoHandler(BaseHTTPRequestHandler):
+    """Serves MANIFESTS and empty catalogs, and counts the requests for
+    each path."""
+
+    def do_GET(self):
+        """Handles a GET request"""
+        # pylint: disable=invalid-name
+        self.server.requests.append(self.path)
+        section, name = self.path.lstrip('/').split('/', 1)
+        if section == 'manifests' and name.lstrip('/') in MANIFESTS:
+            data = wrappers.writePlistToString(MANIFESTS[name.lstrip('/')])
+        elif section == 'catalogs' and name in CATALOGS:
+            data = wrappers.writePlistToString([])
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/xml')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        """Keeps the test output quiet"""
+        pass
+
+
+class TestRunJobs(unittest.TestCase):
+    """Tests for running jobs with a pool of threads."""
+
+    def test_results_in_job_order(self):
+        """Results are returned in job order, whichever finishes first."""
+        jobs = [(lambda value: value * 2, index) for index in range(20)]
+        self.assertEqual(prefetch.run_jobs(jobs, 4),
+                         [index * 2 for index in range(20)])
+        self.assertEqual(prefetch.run_jobs(jobs, 1),
+                         [index * 2 for index in range(20)])
+
+    def test_slow_jobs_keep_their_place(self):
+        """A job that finishes last still has its result first."""
+        def job(delay):
+            """Sleeps for delay and returns it"""
+            time.sleep(delay)
+            return delay
+        delays = [0.2, 0.1, 0.0, 0.05]
+        self.assertEqual(
+            prefetch.run_jobs([(job, delay) for delay in delays], 4), delays)
+
+    def test_exception_raised_in_calling_thread(self):
+        """An exception in a job is raised again by run_jobs."""
+        def job(value):
+            """Fails for odd values"""
+            if value % 2:
+                raise ValueError(value)
+            return value
+        jobs = [(job, value) for value in range(10)]
+        for workers in (1, 4):
+            with self.assertRaises(ValueError) as context:
+                prefetch.run_jobs(jobs, workers)
+            # the earliest job's failure, however the threads ran
+            self.assertEqual(context.exception.args, (1,))
+
+
+class TestPrefetch(unittest.TestCase):
+    """Tests for prefetching manifests and catalogs from a local
+    server."""
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.server = HTTPServer(('127.0.0.1', 0), RepoHandler)
+        self.server.requests = []
+        self.server_thread = threading.Thread(
+            target=self.server.serve_forever)
+        self.server_thread.daemon = True
+        self.server_thread.start()
+        repo_url = 'http://127.0.0.1:%s' % self.server.server_address[1]
+        self.prefs = dict(prefs.DEFAULT_PREFS)
+        self.prefs.update({
+            'ManagedInstallDir': self.tempdir,
+            'LogFile': os.path.join(self.tempdir, 'test.log'),
+            'SoftwareRepoURL': repo_url,
+            'ManifestPrefetchWorkers': 4})
+        patchers = [
+            patch('munkilib.prefs.pref', side_effect=self.prefs.get),
+            patch.dict('munkilib.updatecheck.manifestutils._MANIFESTS',
+                       clear=True),
+            patch.dict('munkilib.updatecheck.catalogs._CATALOG', clear=True),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        manifest_dir = os.path.join(self.tempdir, 'manifests')
+        os.makedirs(manifest_dir)
+        os.makedirs(os.path.join(self.tempdir, 'catalogs'))
+        self.mainmanifestpath = os.path.join(manifest_dir, 'site_default')
+        wrappers.writePlist(MANIFESTS['site_default'], self.mainmanifestpath)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.tempdir)
+
+    def requests(self, path):
+        """Returns the number of requests the server had for path"""
+        return self.server.requests.count(path)
+
+    def test_prefetch_retrieves_everything(self):
+        """Every included manifest and catalog is retrieved."""
+        self.assertTrue(
+            prefetch.prefetch_manifests_and_catalogs(self.mainmanifestpath))
+        for name in ('common', 'apps'):
+            self.assertTrue(os.path.exists(
+                os.path.join(self.tempdir, 'manifests', name)))
+        for name in CATALOGS:
+            self.assertTrue(os.path.exists(
+                os.path.join(self.tempdir, 'catalogs', name)))
+
+    def test_each_manifest_retrieved_once(self):
+        """Manifests included more than once, or by names for the same
+        file, are retrieved once."""
+        prefetch.prefetch_manifests_and_catalogs(self.mainmanifestpath)
+        self.assertEqual(self.requests('/manifests/site') +
+                         self.requests('/manifests//site'), 1)
+        self.assertEqual(self.requests('/manifests/common'), 1)
+        self.assertEqual(self.requests('/manifests/apps'), 1)
+        for name in CATALOGS:
+            self.assertEqual(self.requests('/catalogs/' + name), 1)
+
+    def test_missing_manifest_ignored(self):
+        """A manifest the server doesn't have is left for the manifest
+        processing to report."""
+        wrappers.writePlist({'catalogs': ['production'],
+                             'included_manifests': ['missing', 'apps']},
+                            self.mainmanifestpath)
+        self.assertTrue(
+            prefetch.prefetch_manifests_and_catalogs(self.mainmanifestpath))
+        self.assertFalse(os.path.exists(
+            os.path.join(self.tempdir, 'manifests', 'missing')))
+        self.assertTrue(os.path.exists(
+            os.path.join(self.tempdir, 'manifests', 'apps')))
+
+    def test_no_workers(self):
+        """With fewer than two workers we don't prefetch."""
+        self.prefs['ManifestPrefetchWorkers'] = 1
+        self.assertFalse(
+            prefetch.prefetch_manifests_and_catalogs(self.mainmanifestpath))
+        self.assertEqual(self.server.requests, [])
+
+
+def main():
+    unittest.main(buffer=True)
+
+
+if __name__ == '__main__':
+    main()
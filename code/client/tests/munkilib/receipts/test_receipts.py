@@ -0,0 +1,162 @@
+#!/usr/bin/python
+# encoding: utf-8
+"""
+test_receipts.py
+
+Unit tests for the receipts snapshot module.
+
+"""
+# Copyright 2020 Greg Neagle.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from munkilib import receipts
+
+
+PACKAGES = {
+    'com.apple.pkg.Core': {'version': '10.15.7', 'install_time': 1600000000},
+    'com.example.tool': {'version': '2.1', 'install_time': 1600000100},
+    'com.example.legacy': {'version': '1.0'},
+}
+
+
+class TestReceipts(unittest.TestCase):
+    """Tests for the receipts directory fingerprint and snapshot."""
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.receiptsdir = os.path.join(self.tempdir, 'receipts')
+        os.mkdir(self.receiptsdir)
+        for pkgid in ('com.apple.pkg.Core', 'com.example.tool'):
+            self.write_receipt(pkgid, b'receipt')
+        self.directories = (self.receiptsdir,
+                            os.path.join(self.tempdir, 'missing'))
+        self.snapshot_path = os.path.join(self.tempdir, 'snapshot.plist')
+        self.reads = 0
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def write_receipt(self, pkgid, data, mtime=1600000000):
+        """Writes a fake receipt file to the fixture receipts directory"""
+        path = os.path.join(self.receiptsdir, pkgid + '.plist')
+        with open(path, 'wb') as fileobj:
+            fileobj.write(data)
+        os.utime(path, (mtime, mtime))
+
+    def read_packages(self):
+        """Stands in for asking pkgutil for the receipts"""
+        self.reads += 1
+        return dict((pkgid, dict(info)) for (pkgid, info) in PACKAGES.items())
+
+    def fingerprint(self):
+        """Returns the fingerprint of our fixture directories"""
+        return receipts.directory_fingerprint(self.directories)
+
+    def test_fingerprint_unchanged(self):
+        """The fingerprint is stable while nothing changes."""
+        self.assertEqual(self.fingerprint(), self.fingerprint())
+
+    def test_fingerprint_changes(self):
+        """Adding, rewriting or removing a receipt changes the
+        fingerprint."""
+        original = self.fingerprint()
+        self.write_receipt('com.example.new', b'receipt')
+        added = self.fingerprint()
+        self.assertNotEqual(added, original)
+        self.write_receipt('com.example.new', b'a longer receipt')
+        rewritten = self.fingerprint()
+        self.assertNotEqual(rewritten, added)
+        self.write_receipt('com.example.new', b'a longer receipt',
+                           mtime=1600000500)
+        touched = self.fingerprint()
+        self.assertNotEqual(touched, rewritten)
+        os.unlink(os.path.join(self.receiptsdir, 'com.example.new.plist'))
+        self.assertNotEqual(self.fingerprint(), touched)
+
+    def test_snapshot_reused_until_receipts_change(self):
+        """Packages are read only when the receipts have changed."""
+        packages = receipts.installed_packages(
+            self.snapshot_path, self.read_packages, self.directories)
+        self.assertEqual(packages, PACKAGES)
+        self.assertEqual(self.reads, 1)
+        packages = receipts.installed_packages(
+            self.snapshot_path, self.read_packages, self.directories)
+        self.assertEqual(packages, PACKAGES)
+        self.assertEqual(self.reads, 1)
+        self.write_receipt('com.example.tool', b'updated receipt')
+        receipts.installed_packages(
+            self.snapshot_path, self.read_packages, self.directories)
+        self.assertEqual(self.reads, 2)
+
+    def test_system_receipts_change(self):
+        """A receipt added to /System/Library/Receipts invalidates the
+        snapshot."""
+        self.assertIn('/System/Library/Receipts', receipts.RECEIPTS_DIRS)
+        # a fixture directory stands in for /System/Library/Receipts
+        systemdir = os.path.join(self.tempdir, 'System', 'Receipts')
+        os.makedirs(systemdir)
+        directories = self.directories + (systemdir,)
+        receipts.installed_packages(
+            self.snapshot_path, self.read_packages, directories)
+        receipts.installed_packages(
+            self.snapshot_path, self.read_packages, directories)
+        self.assertEqual(self.reads, 1)
+        with open(os.path.join(systemdir, 'com.apple.pkg.OS.bom'),
+                  'wb') as fileobj:
+            fileobj.write(b'receipt')
+        receipts.installed_packages(
+            self.snapshot_path, self.read_packages, directories)
+        self.assertEqual(self.reads, 2)
+
+    def test_invalid_snapshot(self):
+        """A damaged snapshot is replaced."""
+        with open(self.snapshot_path, 'wb') as fileobj:
+            fileobj.write(b'not a plist')
+        self.assertEqual(
+            receipts.load_snapshot(self.snapshot_path, self.fingerprint()),
+            None)
+        receipts.installed_packages(
+            self.snapshot_path, self.read_packages, self.directories)
+        self.assertEqual(self.reads, 1)
+        self.assertEqual(
+            receipts.load_snapshot(self.snapshot_path, self.fingerprint()),
+            PACKAGES)
+
+    def test_packages_checksum(self):
+        """The checksum covers only packages matching the prefix."""
+        apple = receipts.packages_checksum(PACKAGES, prefix='com.apple')
+        changed = dict(PACKAGES)
+        changed['com.example.tool'] = {'version': '3.0'}
+        self.assertEqual(
+            receipts.packages_checksum(changed, prefix='com.apple'), apple)
+        self.assertNotEqual(receipts.packages_checksum(changed),
+                            receipts.packages_checksum(PACKAGES))
+        changed['com.apple.pkg.Core'] = {'version': '10.15.7',
+                                         'install_time': 1600009999}
+        self.assertNotEqual(
+            receipts.packages_checksum(changed, prefix='com.apple'), apple)
+
+
+def main():
+    unittest.main(buffer=True)
+
+
+if __name__ == '__main__':
+    main()
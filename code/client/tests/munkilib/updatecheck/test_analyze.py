@@ -0,0 +1,117 @@
+#!/usr/bin/python
+# encoding: utf-8
+"""
+test_analyze.py
+
+Unit tests for updatecheck.analyze.
+
+"""
+# Copyright 2020 Greg Neagle.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import, print_function
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from munkilib import prefs
+from munkilib import wrappers
+from munkilib.updatecheck import analyze
+from munkilib.updatecheck import catalogs
+from munkilib.updatecheck import compare
+from munkilib.updatecheck import installationstate
+
+
+try:
+    from mock import patch
+except ImportError:
+    import sys
+    print("mock module is required. run: easy_install mock", file=sys.stderr)
+    raise
+
+
+class TestInstalledStatePrepass(unittest.TestCase):
+    """Tests that process_install uses the installed states checked
+    before the manifests are processed."""
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.prefs = dict(prefs.DEFAULT_PREFS)
+        self.prefs.update({
+            'ManagedInstallDir': self.tempdir,
+            'LogFile': os.path.join(self.tempdir, 'test.log'),
+            'DeferCatalogItemDetails': True,
+            'InstalledStateWorkers': 4})
+        patchers = [
+            patch('munkilib.prefs.pref', side_effect=self.prefs.get),
+            patch.dict('munkilib.updatecheck.catalogs._CATALOG', clear=True),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        catalogs.clear_item_detail_cache()
+        installationstate.clear_installed_states()
+        self.addCleanup(installationstate.clear_installed_states)
+        self.addCleanup(catalogs.clear_item_detail_cache)
+
+        catalog = []
+        for name in ('Foo', 'Bar'):
+            installed_path = os.path.join(self.tempdir, name)
+            with open(installed_path, 'wb') as fileobj:
+                fileobj.write(b'installed')
+            catalog.append({
+                'name': name,
+                'version': '1.0',
+                'catalogs': ['testing'],
+                'description': 'A description of %s' % name,
+                'installer_item_location': '%s-1.0.dmg' % name,
+                'installs': [{'type': 'file', 'path': installed_path}]})
+        os.makedirs(os.path.join(self.tempdir, 'catalogs'))
+        catalogpath = os.path.join(self.tempdir, 'catalogs', 'testing')
+        wrappers.writePlist(catalog, catalogpath)
+        catalogs.load_catalog('testing', catalogpath)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_prepass_result_reused(self):
+        """With DeferCatalogItemDetails, process_install doesn't check the
+        installs items again."""
+        items = [catalogs.get_item_detail(name, ['testing'])
+                 for name in ('Foo', 'Bar')]
+        self.assertIn(catalogs.DEFERRED_INFO_KEY, items[0])
+        installationstate.check_installed_states(items)
+
+        installinfo = {'processed_installs': analyze.ItemList(),
+                       'processed_uninstalls': analyze.ItemList(),
+                       'managed_installs': analyze.ItemList()}
+        with patch('munkilib.updatecheck.installationstate.compare.'
+                   'compare_item_version',
+                   wraps=compare.compare_item_version) as compare_mock:
+            self.assertTrue(
+                analyze.process_install('Foo', ['testing'], installinfo))
+        self.assertEqual(compare_mock.call_count, 0)
+        iteminfo = installinfo['managed_installs'][0]
+        self.assertTrue(iteminfo['installed'])
+        # the item we report has the deferred details
+        self.assertEqual(iteminfo['description'], 'A description of Foo')
+
+
+def main():
+    unittest.main(buffer=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+#!/usr/bin/python
+# encoding: utf-8
+"""
+test_catalogs.py
+
+Unit tests for loading catalogs.
+
+"""
+# Copyright 2020 Greg Neagle.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import, print_function
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from munkilib import prefs
+from munkilib import FoundationPlist
+from munkilib import wrappers
+from munkilib.updatecheck import catalogs
+
+
+try:
+    from mock import patch
+except ImportError:
+    import sys
+    print("mock module is required. run: easy_install mock", file=sys.stderr)
+    raise
+
+
+ITEM = {'name': 'Foo',
+        'version': '1.0',
+        'description': 'A description of Foo',
+        'postinstall_script': '#!/bin/sh\necho installed\n',
+        'installer_item_location': 'Foo-1.0.dmg',
+        'catalogs': ['testing', 'production']}
+
+
+class TestLoadCatalog(unittest.TestCase):
+    """Tests for loading catalogs with DeferCatalogItemDetails set."""
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.prefs = dict(prefs.DEFAULT_PREFS)
+        self.prefs.update({
+            'ManagedInstallDir': self.tempdir,
+            'LogFile': os.path.join(self.tempdir, 'test.log'),
+            'DeferCatalogItemDetails': True})
+        patchers = [
+            patch('munkilib.prefs.pref', side_effect=self.prefs.get),
+            patch.dict('munkilib.updatecheck.catalogs._CATALOG', clear=True),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        catalogs.clear_shared_items()
+        self.addCleanup(catalogs.clear_shared_items)
+        self.addCleanup(catalogs.clear_item_detail_cache)
+        os.makedirs(os.path.join(self.tempdir, 'catalogs'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def write_catalog(self, catalogname, items):
+        """Writes a catalog file and returns its path"""
+        catalogpath = os.path.join(self.tempdir, 'catalogs', catalogname)
+        wrappers.writePlist(items, catalogpath)
+        return catalogpath
+
+    def load_catalog(self, catalogname, items):
+        """Writes and loads a catalog"""
+        catalogs.load_catalog(
+            catalogname, self.write_catalog(catalogname, items))
+
+    def test_deferred_items_not_shared_between_catalogs(self):
+        """Each catalog's deferred items point into its own file."""
+        other = dict(ITEM, name='Bar')
+        self.load_catalog('testing', [other, ITEM])
+        self.load_catalog('production', [ITEM])
+        for catalogname in ('testing', 'production'):
+            item = catalogs.get_item_detail('Foo', [catalogname])
+            self.assertEqual(
+                item[catalogs.DEFERRED_INFO_KEY][0], catalogname)
+        # an edit to one catalog doesn't affect the other's items
+        self.write_catalog('testing', [ITEM])
+        item = catalogs.get_item_detail('Foo', ['production'])
+        self.assertEqual(catalogs.full_pkginfo(item)['postinstall_script'],
+                         ITEM['postinstall_script'])
+
+    def test_unreadable_details_raise(self):
+        """An item whose details can't be read back in isn't returned
+        without them."""
+        self.load_catalog('testing', [ITEM])
+        item = catalogs.get_item_detail('Foo', ['testing'])
+        self.assertEqual(catalogs.full_pkginfo(item)['description'],
+                         ITEM['description'])
+        os.unlink(os.path.join(self.tempdir, 'catalogs', 'testing'))
+        self.assertRaises(catalogs.CatalogItemDetailsError,
+                          catalogs.full_pkginfo, item)
+
+    def test_binary_catalog(self):
+        """A catalog served as a binary plist is loaded in full."""
+        catalogpath = os.path.join(self.tempdir, 'catalogs', 'testing')
+        FoundationPlist.writePlist([ITEM], catalogpath, binary=True)
+        catalogs.load_catalog('testing', catalogpath)
+        self.assertTrue(os.path.exists(catalogpath))
+        item = catalogs.get_item_detail('Foo', ['testing'])
+        self.assertNotIn(catalogs.DEFERRED_INFO_KEY, item)
+        self.assertEqual(item['description'], ITEM['description'])
+
+
+def main():
+    unittest.main(buffer=True)
+
+
+if __name__ == '__main__':
+    main()
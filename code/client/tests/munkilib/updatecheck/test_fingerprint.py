@@ -0,0 +1,125 @@
+#!/usr/bin/python
+# encoding: utf-8
+"""
+test_fingerprint.py
+
+Unit tests for updatecheck.fingerprint.
+
+"""
+# Copyright 2020 Greg Neagle.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import, print_function
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from munkilib import prefs
+from munkilib import reports
+from munkilib.updatecheck import fingerprint
+from munkilib.updatecheck import installationstate
+
+
+try:
+    from mock import patch
+except ImportError:
+    import sys
+    print("mock module is required. run: easy_install mock", file=sys.stderr)
+    raise
+
+
+class TestFingerprint(unittest.TestCase):
+    """Tests for saving and reusing the results of a full check."""
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.prefs = dict(prefs.DEFAULT_PREFS)
+        self.prefs.update({
+            'ManagedInstallDir': self.tempdir,
+            'LogFile': os.path.join(self.tempdir, 'test.log'),
+            'FullUpdateCheckInterval': 12})
+        patchers = [
+            patch('munkilib.prefs.pref', side_effect=self.prefs.get),
+            patch.dict('munkilib.reports.report',
+                       {'ManagedInstalls': [], 'ProblemInstalls': [],
+                        'Counters': {}}, clear=True),
+            patch('munkilib.updatecheck.fingerprint.compute_fingerprint',
+                  return_value='fingerprint'),
+            patch('munkilib.updatecheck.fingerprint.conditions_use_date',
+                  return_value=False),
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        installationstate.clear_installed_states()
+        self.addCleanup(installationstate.clear_installed_states)
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir)
+
+    def test_reused_when_unchanged(self):
+        """A clean full check's results are reused."""
+        fingerprint.save()
+        state = fingerprint.previous_check_is_current()
+        self.assertEqual(state['checks_since_full_check'], 1)
+        self.assertEqual(state['report']['ManagedInstalls'], [])
+
+    def test_off_by_default(self):
+        """Results aren't reused unless FullUpdateCheckInterval is set."""
+        self.prefs['FullUpdateCheckInterval'] = (
+            prefs.DEFAULT_PREFS['FullUpdateCheckInterval'])
+        fingerprint.save()
+        self.assertEqual(fingerprint.previous_check_is_current(), None)
+
+    def test_installcheck_script_not_reused(self):
+        """A check that looked at an item with an installcheck_script is
+        never reused, since the fingerprint can't see what the script
+        checks."""
+        fingerprint.save()
+        item = {'name': 'Scripted', 'version': '1.0',
+                'installcheck_script': '#!/bin/sh\nexit 1\n'}
+        with patch('munkilib.updatecheck.installationstate.scriptutils.'
+                   'run_embedded_script', return_value=1):
+            self.assertEqual(installationstate.installed_state(item), 1)
+        fingerprint.save()
+        self.assertFalse(os.path.exists(fingerprint.state_path()))
+        self.assertEqual(fingerprint.previous_check_is_current(), None)
+
+    def test_problem_installs_not_reused(self):
+        """A check with problem installs forgets the previous fingerprint
+        and doesn't save its own."""
+        fingerprint.save()
+        self.assertTrue(os.path.exists(fingerprint.state_path()))
+        reports.report['ProblemInstalls'] = [{'name': 'Foo'}]
+        fingerprint.save()
+        self.assertFalse(os.path.exists(fingerprint.state_path()))
+        self.assertEqual(fingerprint.previous_check_is_current(), None)
+
+    def test_failed_downloads_not_reused(self):
+        """A check where a download failed forgets the previous
+        fingerprint and doesn't save its own."""
+        fingerprint.save()
+        reports.report['Counters']['DownloadFailures'] = 1
+        fingerprint.save()
+        self.assertFalse(os.path.exists(fingerprint.state_path()))
+        self.assertEqual(fingerprint.previous_check_is_current(), None)
+
+
+def main():
+    unittest.main(buffer=True)
+
+
+if __name__ == '__main__':
+    main()
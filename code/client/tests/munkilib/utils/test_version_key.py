@@ -0,0 +1,178 @@
+#!/usr/bin/python
+# encoding: utf-8
+"""
+test_version_key.py
+
+Unit tests for utils.version_key.
+
+Checks that version keys order version strings exactly like the original
+distutils LooseVersion-based MunkiLooseVersion comparison did. Run this
+module directly to also print a small benchmark.
+
+"""
+# Copyright 2020 Greg Neagle.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+from __future__ import absolute_import, print_function
+
+import functools
+import random
+import re
+import timeit
+import unittest
+
+from munkilib import utils
+
+
+# a copy of how MunkiLooseVersion parsed and compared versions when it was
+# based on distutils.version.LooseVersion, to check against
+REFERENCE_COMPONENT_RE = re.compile(r'(\d+ | [a-z]+ | \.)', re.VERBOSE)
+
+
+def reference_parse(vstring):
+    """distutils.version.LooseVersion.parse"""
+    components = [x for x in REFERENCE_COMPONENT_RE.split(vstring)
+                  if x and x != '.']
+    for i, obj in enumerate(components):
+        try:
+            components[i] = int(obj)
+        except ValueError:
+            pass
+    return components
+
+
+def reference_compare(this, that):
+    """MunkiLooseVersion._compare, on two version strings"""
+    this_version = reference_parse(this)
+    that_version = reference_parse(that)
+    max_length = max(len(this_version), len(that_version))
+    this_version += [0] * (max_length - len(this_version))
+    that_version += [0] * (max_length - len(that_version))
+    for index, value in enumerate(this_version):
+        other = that_version[index]
+        if isinstance(value, int) != isinstance(other, int):
+            # integer is less than character/string
+            if isinstance(value, int):
+                return -1
+            return 1
+        cmp_result = (value > other) - (value < other)
+        if cmp_result:
+            return cmp_result
+    return 0
+
+
+def key_compare(this, that):
+    """Compares two version strings using version_key"""
+    this_key = utils.version_key(this)
+    that_key = utils.version_key(that)
+    return (this_key > that_key) - (this_key < that_key)
+
+
+VERSION_SAMPLES = [
+    '', '0', '0.0', '1', '1.0', '1.0.0', '1.0.1', '1.00.1', '1.1', '1.10',
+    '1.9', '10.6', '10.6.0', '10.6.8', '10.10', '10.14.6', '11.0.1',
+    '1.0a', '1.0a1', '1.0b', '1.0b2', '1.0.a', '1.0B3', '1.0-beta',
+    '1.0 beta 2', '2020.01.01', 'a', 'b1', '1..2', '.1', '1.', '1a2b3c',
+    '4.5.6 (1234)', '5.0.3(6)', '3.2_1', '02.1', '2.01', 'v2', 'V2',
+]
+
+
+def random_version(rng):
+    """Returns a random, frequently odd, version string"""
+    pieces = []
+    for dummy_index in range(rng.randint(0, 6)):
+        pieces.append(rng.choice([
+            str(rng.randint(0, 3)), str(rng.randint(0, 200)), '0', '00',
+            rng.choice(['a', 'b', 'rc', 'beta', 'B', 'RC', '-', '_', ' ']),
+        ]))
+        pieces.append(rng.choice(['.', '.', '.', '', '-']))
+    return ''.join(pieces)
+
+
+class TestVersionKey(unittest.TestCase):
+    """Test utils.version_key against the original comparison."""
+
+    def assert_same_order(self, versions):
+        """Every pair of versions compares the same both ways"""
+        for this in versions:
+            for that in versions:
+                self.assertEqual(
+                    key_compare(this, that), reference_compare(this, that),
+                    'Comparing %r to %r' % (this, that))
+
+    def test_samples(self):
+        """Known tricky versions compare like they used to."""
+        self.assert_same_order(VERSION_SAMPLES)
+
+    def test_random_versions(self):
+        """Random versions compare like they used to."""
+        rng = random.Random(1234)
+        self.assert_same_order(
+            [random_version(rng) for dummy_index in range(300)])
+
+    def test_sorting(self):
+        """Sorting with version_key matches sorting with the old
+        comparison."""
+        rng = random.Random(5678)
+        versions = [random_version(rng) for dummy_index in range(2000)]
+        by_key = sorted(versions, key=utils.version_key)
+        by_reference = sorted(
+            versions, key=functools.cmp_to_key(reference_compare))
+        self.assertEqual(
+            [utils.version_key(item) for item in by_key],
+            [utils.version_key(item) for item in by_reference])
+
+    def test_trailing_zeros(self):
+        """Trailing zero components don't matter."""
+        self.assertEqual(utils.version_key('10.6'),
+                         utils.version_key('10.6.0.0'))
+        self.assertNotEqual(utils.version_key('10.6'),
+                            utils.version_key('10.6.0.a'))
+
+    def test_non_strings(self):
+        """None and numbers are treated like strings."""
+        self.assertEqual(utils.version_key(None), utils.version_key(''))
+        self.assertEqual(utils.version_key(5), utils.version_key('5.0'))
+        self.assertEqual(utils.version_key(u'1.0é'),
+                         utils.version_key(u'1.0é'))
+
+    def test_cache_is_bounded(self):
+        """The key cache doesn't grow past its limit."""
+        for index in range(utils.VERSION_KEY_CACHE_SIZE + 10):
+            utils.version_key('%s.1' % index)
+        self.assertTrue(
+            len(utils._VERSION_KEYS) <= utils.VERSION_KEY_CACHE_SIZE)
+
+
+def benchmark():
+    """Prints how long it takes to sort versions with the old comparison
+    and with version_key"""
+    rng = random.Random(42)
+    versions = ['%s.%s.%s' % (rng.randint(0, 20), rng.randint(0, 20),
+                              rng.randint(0, 99)) for dummy in range(5000)]
+    old_time = timeit.timeit(
+        lambda: sorted(versions, key=functools.cmp_to_key(reference_compare)),
+        number=3)
+    new_time = timeit.timeit(
+        lambda: sorted(versions, key=utils.version_key), number=3)
+    print('Sorting 5000 versions 3 times: reference %.3fs, version_key %.3fs'
+          % (old_time, new_time))
+
+
+def main():
+    unittest.main(buffer=True)
+
+
+if __name__ == '__main__':
+    benchmark()
+    main()